@@ -1,25 +1,53 @@
 import sys
 import os
 import argparse
-from datetime import datetime
+from datetime import datetime, timedelta
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from influxdb_client import InfluxDBClient
 from src.infrastructure.storage.training_exporter import TrainingDataExporter
 
+def parse_class_targets(value: str) -> dict:
+    """"HEALTHY=5000,WARNING=0.3" -> {"HEALTHY": 5000, "WARNING": 0.3}"""
+    targets = {}
+    for item in value.split(","):
+        state, _, amount = item.partition("=")
+        if not amount:
+            raise argparse.ArgumentTypeError(f"Target non valido: {item}")
+        targets[state.strip().upper()] = float(amount) if "." in amount else int(amount)
+    return targets
+
 def main():
     parser = argparse.ArgumentParser(description='Esporta dati pompa da InfluxDB a CSV')
     parser.add_argument('--hours', type=int, default=12, help='Ore di dati (default: 12)')
     parser.add_argument('--output', type=str, help='Path output CSV custom')
     parser.add_argument('--summary-only', action='store_true', help='Solo statistiche')
+    # Export a fette parallele con memoria limitata e ripresa incrementale
+    parser.add_argument('--stream', action='store_true', help='Export a fette temporali in parallelo')
+    parser.add_argument('--format', choices=['parquet', 'csv'], default='parquet', help='Formato export a fette (default: parquet)')
+    parser.add_argument('--slice-minutes', type=int, default=60, help='Durata di ogni fetta in minuti (default: 60)')
+    parser.add_argument('--workers', type=int, default=4, help='Query parallele (default: 4)')
+    parser.add_argument('--watermark', type=str, help='File watermark: riprende dalla fine dell\'export precedente')
+    parser.add_argument('--lag-minutes', type=float, default=float(os.getenv("EXPORT_LAG_MINUTES", 15)),
+                        help='L\'export si ferma a now - lag: margine per i punti in ritardo, es. replay dello spool (default: 15)')
+    # Campionamento stratificato lato InfluxDB (implica --stream)
+    parser.add_argument('--sample', type=str,
+                        help='Target per classe, conteggi o quote: "HEALTHY=5000,WARNING=5000" oppure "HEALTHY=0.25,WARNING=0.25,..."')
+    parser.add_argument('--sample-total', type=int, help='Dimensione totale del dataset per i target espressi come quote')
     
     args = parser.parse_args()
+
+    class_targets = None
+    if args.sample:
+        class_targets = parse_class_targets(args.sample)
+        args.stream = True
     
     # Se l'output non è specificato, creiamo un nome file con timestamp
     if not args.output:
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        args.output = f'data/processed/training_{timestamp}.csv'
+        extension = args.format if args.stream else 'csv'
+        args.output = f'data/processed/training_{timestamp}.{extension}'
     
     url = os.getenv("INFLUX_URL", "http://localhost:8086")
     token = os.getenv("INFLUX_TOKEN", "your-super-secret-token")
@@ -37,6 +65,30 @@ def main():
                 print("Nessun dato trovato.")
             for state, count in summary.items():
                 print(f"  {state}: {count} campioni")
+        elif args.stream:
+            # Il watermark non deve superare i punti ancora in arrivo: quelli con
+            # timestamp precedente al watermark non verrebbero mai esportati
+            end_time = datetime.utcnow() - timedelta(minutes=args.lag_minutes)
+            start_time = end_time - timedelta(hours=args.hours)
+            if args.watermark:
+                watermark = exporter.read_watermark(args.watermark)
+                if watermark:
+                    print(f"▶️ Ripresa dal watermark {watermark.isoformat()}")
+                    start_time = watermark
+            if start_time >= end_time:
+                print("Nessun dato nuovo da esportare.")
+                return
+            result = exporter.export_streaming(
+                args.output, start_time, end_time,
+                slice_minutes=args.slice_minutes,
+                workers=args.workers,
+                fmt=args.format,
+                watermark_path=args.watermark,
+                class_targets=class_targets,
+                sample_total=args.sample_total
+            )
+            if result["rows"]:
+                print(f"\n✅ Export completato con successo.")
         else:
             df = exporter.export_to_csv(args.output, hours_back=args.hours)
             if not df.empty:
@@ -5,8 +5,14 @@ from pydantic import TypeAdapter
 from domain.schemas.telemetry_schemas import TrainingPayload
 
 class MQTTPumpFetcher:
-    def __init__(self, output_queue: queue.Queue, broker="localhost", port=1883, topic="factory/training/+/training_data"):
+    def __init__(self, output_queue: queue.Queue, broker="localhost", port=1883, topic="factory/training/+/training_data",
+                 overflow=None):
         self.output_queue = output_queue
+        # Destinazione dei messaggi quando la coda è piena (es. spool su disco):
+        # il loop MQTT non resta bloccato, ma i messaggi in overflow possono
+        # precedere nello storage quelli ancora in coda (ognuno ha il proprio timestamp).
+        # Senza overflow la put è bloccante: backpressure verso il broker, nessuna perdita
+        self.overflow = overflow
         self.topic = topic
         self.client = mqtt.Client()
         self.client.on_connect = self._on_connect
@@ -26,7 +32,13 @@ class MQTTPumpFetcher:
             validated_data = self._adapter.validate_python(raw_payload)
             
             # Invio diretto alla coda verso InfluxDB
-            self.output_queue.put(validated_data)
+            if self.overflow is None:
+                self.output_queue.put(validated_data)
+            else:
+                try:
+                    self.output_queue.put_nowait(validated_data)
+                except queue.Full:
+                    self.overflow([validated_data])
             
         except Exception as e:
             print(f"❌ Errore processamento messaggio: {e}")
@@ -0,0 +1,48 @@
+import logging
+from typing import List
+from domain.schemas.telemetry_schemas import TrainingPayload
+from infrastructure.storage.storage_interface import StorageInterface
+
+logger = logging.getLogger(__name__)
+
+class FanOutWriter(StorageInterface):
+    """
+    Scrive gli stessi batch su più storage. Il primario determina l'esito:
+    i secondari ricevono il batch solo dopo una scrittura riuscita sul
+    primario, così il replay dallo spool non li duplica; un errore di un
+    secondario viene solo registrato.
+    """
+
+    def __init__(self, primary: StorageInterface, *secondaries: StorageInterface):
+        self.primary = primary
+        self.secondaries = secondaries
+
+    def write(self, point: TrainingPayload) -> bool:
+        return self.write_batch([point]) == 1
+
+    def write_batch(self, points: List[TrainingPayload]) -> int:
+        written = self.primary.write_batch(points)
+        if written == len(points):
+            for storage in self.secondaries:
+                try:
+                    saved = storage.write_batch(points)
+                except Exception as e:
+                    # Non si propaga: il DataManager rimetterebbe nello spool un batch già sul primario
+                    logger.error(f"Errore scrittura su {type(storage).__name__}: {e}")
+                    continue
+                if saved < len(points):
+                    logger.error(f"Errore scrittura su {type(storage).__name__}: {len(points)} punti non salvati")
+        return written
+
+    def flush(self):
+        self.primary.flush()
+        for storage in self.secondaries:
+            storage.flush()
+
+    def health_check(self) -> bool:
+        return self.primary.health_check()
+
+    def close(self):
+        self.primary.close()
+        for storage in self.secondaries:
+            storage.close()
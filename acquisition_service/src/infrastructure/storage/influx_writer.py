@@ -2,12 +2,17 @@ import os
 import logging
 from typing import List
 from influxdb_client import InfluxDBClient, Point
-from influxdb_client.client.write_api import WriteOptions
+from influxdb_client.client.write_api import SYNCHRONOUS
+from influxdb_client.rest import ApiException
 from domain.schemas.telemetry_schemas import TrainingPayload
 from infrastructure.storage.storage_interface import StorageInterface
 
 logger = logging.getLogger(__name__)
 
+# Risposte con cui InfluxDB rifiuta il contenuto del batch: riprovare non serve.
+# Auth, bucket mancante, 429 e 5xx dipendono dalla configurazione o dal carico
+REJECTED_STATUS = {400, 413, 422}
+
 class InfluxDBWriter(StorageInterface):
     def __init__(self, url: str = None, token: str = None, org: str = None, bucket: str = None):
         self.url = url or os.getenv("INFLUX_URL", "http://localhost:8086")
@@ -19,7 +24,8 @@ class InfluxDBWriter(StorageInterface):
             raise ValueError("InfluxDB token mancante.")
         
         self.client = InfluxDBClient(url=self.url, token=self.token, org=self.org)
-        self.write_api = self.client.write_api(write_options=WriteOptions(batch_size=10))
+        # Scrittura sincrona: il batching è gestito solo dal DataManager
+        self.write_api = self.client.write_api(write_options=SYNCHRONOUS)
 
     def _to_influx_point(self, data: TrainingPayload) -> Point:
         return Point("pump_telemetry") \
@@ -45,16 +51,19 @@ class InfluxDBWriter(StorageInterface):
             return False
 
     def write_batch(self, points: List[TrainingPayload]) -> int:
+        """Ritorna 0 se InfluxDB rifiuta il batch; gli errori transitori (timeout, 5xx) vengono propagati"""
         if not points: return 0
         try:
             influx_points = [self._to_influx_point(p) for p in points]
             self.write_api.write(bucket=self.bucket, record=influx_points)
             return len(points)
-        except Exception as e:
-            logger.error(f"Errore batch: {e}")
+        except ApiException as e:
+            if e.status not in REJECTED_STATUS:
+                raise
+            logger.error(f"Batch rifiutato ({e.status}): {e.body}")
             return 0
 
-    def flush(self): self.write_api.flush()
+    def flush(self): pass
     def health_check(self) -> bool: return self.client.ping()
     def close(self):
         self.write_api.close()
@@ -0,0 +1,219 @@
+import os
+import time
+import logging
+import threading
+from datetime import timezone
+from typing import List
+import pyarrow as pa
+import pyarrow.parquet as pq
+from domain.schemas.telemetry_schemas import TrainingPayload
+from infrastructure.storage.storage_interface import StorageInterface
+
+logger = logging.getLogger(__name__)
+
+# Colonne nei file: date e device_id sono nel percorso (partizionamento Hive)
+DATASET_SCHEMA = pa.schema([
+    ("timestamp", pa.timestamp("us", tz="UTC")),
+    ("state", pa.dictionary(pa.int8(), pa.string())),
+    ("vibration_x", pa.float64()),
+    ("vibration_y", pa.float64()),
+    ("vibration_z", pa.float64()),
+    ("vibration_rms", pa.float64()),
+    ("temperature", pa.float64()),
+    ("current", pa.float64()),
+    ("pressure", pa.float64()),
+    ("rpm", pa.int64()),
+    ("health_percent", pa.float64()),
+])
+
+_FIELD_COLUMNS = [f.name for f in DATASET_SCHEMA if f.name not in ("timestamp", "state")]
+
+
+def _open_writer(path: str) -> pq.ParquetWriter:
+    return pq.ParquetWriter(path, DATASET_SCHEMA, compression="zstd", use_dictionary=["state"])
+
+
+def _to_table(rows) -> pa.Table:
+    columns = {
+        "timestamp": [ts for ts, _ in rows],
+        "state": [p.ground_truth for _, p in rows],
+    }
+    for name in _FIELD_COLUMNS:
+        columns[name] = [getattr(p, name) for _, p in rows]
+    return pa.Table.from_pydict(columns, schema=DATASET_SCHEMA)
+
+
+def _utc(ts):
+    return ts if ts.tzinfo is not None else ts.replace(tzinfo=timezone.utc)
+
+
+class _PartitionFile:
+    __slots__ = ("writer", "tmp_path", "final_path", "wal", "wal_path", "opened_at", "rows", "buffer")
+
+    def __init__(self, directory: str, name: str):
+        # File nascosti (prefisso ".") finché sono aperti: i reader di dataset li ignorano.
+        # Il .tmp non ha ancora il footer Parquet: le righe sono durevoli solo nel .wal
+        self.tmp_path = os.path.join(directory, f".{name}.tmp")
+        self.wal_path = os.path.join(directory, f".{name}.wal")
+        self.final_path = os.path.join(directory, name)
+        self.writer = _open_writer(self.tmp_path)
+        self.wal = open(self.wal_path, "ab")
+        self.opened_at = time.monotonic()
+        self.rows = 0
+        self.buffer = []
+
+
+class ParquetDatasetWriter(StorageInterface):
+    """
+    Dataset colonnare per il training, partizionato Hive come
+    date=YYYY-MM-DD/device_id=X/part-*.parquet. Le righe vengono accumulate
+    per partizione e scritte a row group di row_group_size righe; un file
+    viene chiuso e reso visibile (rename atomico) oltre max_file_rows righe o
+    max_file_age secondi, e alla chiusura del writer. L'età viene controllata
+    anche da un thread in background, così un file senza nuove scritture
+    viene pubblicato comunque.
+
+    Un file Parquet è leggibile solo dopo la chiusura (footer), quindi ogni
+    batch viene prima accodato al write-ahead log del file (.wal, JSON lines)
+    e write_batch conferma solo dopo il flush (fsync) del log. Il log viene
+    rimosso dopo il rename del file; all'avvio i .wal rimasti vengono
+    riscritti in file completi e i .tmp orfani eliminati.
+    """
+
+    def __init__(self, base_path: str = None, row_group_size: int = 50_000,
+                 max_file_rows: int = 1_000_000, max_file_age: float = 300.0, fsync: bool = True):
+        self.base_path = base_path or os.getenv("PARQUET_DATASET_PATH", "data/dataset")
+        self.row_group_size = row_group_size
+        self.max_file_rows = max_file_rows
+        self.max_file_age = max_file_age
+        self.fsync = fsync
+        self._files = {}
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        os.makedirs(self.base_path, exist_ok=True)
+        self._recover()
+
+        self._rotator = threading.Thread(target=self._rotate_loop, daemon=True)
+        self._rotator.start()
+
+    def _rotate_loop(self):
+        while not self._stop_event.wait(max(1.0, self.max_file_age / 2)):
+            try:
+                with self._lock:
+                    self._rotate(force=False)
+            except Exception as e:
+                logger.error(f"Errore rotazione Parquet: {e}")
+
+    def _recover(self):
+        """Ricostruisce i file interrotti da un arresto non pulito a partire dai .wal"""
+        recovered = removed = 0
+        for directory, _, names in os.walk(self.base_path):
+            for name in names:
+                path = os.path.join(directory, name)
+                if name.startswith(".") and name.endswith((".tmp", ".recover")):
+                    # Senza footer il file non è leggibile: le sue righe sono nel .wal
+                    os.remove(path)
+                    removed += 1
+                elif name.startswith(".") and name.endswith(".wal"):
+                    final_path = os.path.join(directory, name[1:-len(".wal")])
+                    if not os.path.exists(final_path):
+                        rows = self._read_wal(path)
+                        if rows:
+                            tmp_path = os.path.join(directory, name[:-len(".wal")] + ".recover")
+                            writer = _open_writer(tmp_path)
+                            writer.write_table(_to_table(rows), row_group_size=self.row_group_size)
+                            writer.close()
+                            os.replace(tmp_path, final_path)
+                            recovered += len(rows)
+                    os.remove(path)
+        if recovered or removed:
+            logger.warning(f"🧯 Dataset Parquet: {recovered} righe recuperate dai log, {removed} file parziali rimossi")
+
+    @staticmethod
+    def _read_wal(path: str):
+        rows = []
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # scrittura interrotta: il batch non era stato confermato
+                try:
+                    p = TrainingPayload.model_validate_json(line)
+                except ValueError:
+                    continue
+                rows.append((_utc(p.timestamp_received), p))
+        return rows
+
+    def _partition(self, date: str, device_id: str) -> _PartitionFile:
+        key = (date, device_id)
+        part = self._files.get(key)
+        if part is None:
+            directory = os.path.join(self.base_path, f"date={date}", f"device_id={device_id}")
+            os.makedirs(directory, exist_ok=True)
+            self._seq += 1
+            name = f"part-{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{self._seq:06d}.parquet"
+            part = self._files[key] = _PartitionFile(directory, name)
+        return part
+
+    def write(self, point: TrainingPayload) -> bool:
+        return self.write_batch([point]) == 1
+
+    def write_batch(self, points: List[TrainingPayload]) -> int:
+        if not points: return 0
+        try:
+            with self._lock:
+                batches = {}
+                for p in points:
+                    ts = _utc(p.timestamp_received)
+                    part = self._partition(ts.strftime("%Y-%m-%d"), p.device_id)
+                    batches.setdefault(id(part), (part, []))[1].append((ts, p))
+
+                # Prima il log (durevole), poi il buffer del row group
+                for part, rows in batches.values():
+                    part.wal.write("".join(p.model_dump_json() + "\n" for _, p in rows).encode())
+                    part.wal.flush()
+                    if self.fsync:
+                        os.fsync(part.wal.fileno())
+                for part, rows in batches.values():
+                    part.buffer.extend(rows)
+                    if len(part.buffer) >= self.row_group_size:
+                        self._write_row_group(part)
+                self._rotate(force=False)
+            return len(points)
+        except Exception as e:
+            logger.error(f"Errore scrittura Parquet: {e}")
+            return 0
+
+    def _write_row_group(self, part: _PartitionFile):
+        if not part.buffer:
+            return
+        rows = part.buffer
+        part.buffer = []
+        part.writer.write_table(_to_table(rows), row_group_size=self.row_group_size)
+        part.rows += len(rows)
+
+    def _rotate(self, force: bool):
+        now = time.monotonic()
+        for key in list(self._files):
+            part = self._files[key]
+            if force or part.rows + len(part.buffer) >= self.max_file_rows or now - part.opened_at >= self.max_file_age:
+                self._write_row_group(part)
+                part.writer.close()
+                os.replace(part.tmp_path, part.final_path)
+                # File pubblicato: il log non serve più (il recovery lo ignora se il file esiste)
+                part.wal.close()
+                os.remove(part.wal_path)
+                del self._files[key]
+
+    def flush(self):
+        """Chiude e pubblica tutti i file aperti"""
+        with self._lock:
+            self._rotate(force=True)
+
+    def health_check(self) -> bool:
+        return os.access(self.base_path, os.W_OK)
+
+    def close(self):
+        self._stop_event.set()
+        self._rotator.join()
+        self.flush()
@@ -0,0 +1,209 @@
+import os
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import List, Optional
+from domain.schemas.telemetry_schemas import TrainingPayload
+
+logger = logging.getLogger(__name__)
+
+class DiskSpool:
+    """
+    Write-ahead spool su disco a segmenti append-only (JSON lines).
+    I punti vengono accodati nel segmento attivo, ruotato oltre
+    segment_max_bytes; il replay legge in ordine dal segmento più vecchio
+    con memoria limitata (al massimo un batch) e il cursore di lettura
+    (segmento, offset) viene persistito a ogni commit, così un riavvio
+    riprende senza perdere dati (consegna at-least-once).
+
+    All'avvio una riga finale troncata (crash durante la scrittura) viene
+    rimossa; le righe illeggibili vengono saltate. I batch rifiutati in modo
+    permanente dallo storage finiscono nel file dead-letter.
+    """
+
+    CURSOR_FILE = "cursor"
+    DEAD_LETTER_FILE = "dead-letter.jsonl"
+
+    def __init__(self, directory: str, segment_max_bytes: int = 8 * 1024 * 1024, fsync: bool = False):
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        self._segments = sorted(f for f in os.listdir(directory) if f.startswith("seg-") and f.endswith(".jsonl"))
+        for name in self._segments:
+            self._repair_tail(self._path(name))
+        self._next_seq = int(self._segments[-1][4:16]) + 1 if self._segments else 0
+        self._read_segment, self._read_offset = self._load_cursor()
+        self._active = None
+        self._active_name = None
+
+        self.spooled = 0
+        self.replayed = 0
+        self.skipped = 0
+        self.dead_lettered = 0
+        self.pending = self._count_pending()
+        if self.pending:
+            logger.warning(f"📼 Spool: {self.pending} punti da reinviare in {len(self._segments)} segmenti")
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _load_cursor(self):
+        try:
+            with open(self._path(self.CURSOR_FILE)) as f:
+                name, offset = f.read().split()
+            if name in self._segments:
+                return name, int(offset)
+        except (OSError, ValueError):
+            pass
+        return (self._segments[0] if self._segments else None), 0
+
+    def _save_cursor(self):
+        tmp = self._path(self.CURSOR_FILE + ".tmp")
+        with open(tmp, "w") as f:
+            f.write(f"{self._read_segment} {self._read_offset}")
+        os.replace(tmp, self._path(self.CURSOR_FILE))
+
+    @staticmethod
+    def _repair_tail(path: str):
+        """Tronca il segmento all'ultima riga completa (scrittura interrotta da un crash)"""
+        with open(path, "rb+") as f:
+            size = f.seek(0, os.SEEK_END)
+            end = size
+            while end > 0:
+                start = max(0, end - 65536)
+                f.seek(start)
+                newline = f.read(end - start).rfind(b"\n")
+                if newline >= 0:
+                    end = start + newline + 1
+                    break
+                end = start
+            if end < size:
+                f.truncate(end)
+                logger.warning(f"📼 Spool: rimossa riga incompleta ({size - end} byte) da {os.path.basename(path)}")
+
+    def _count_pending(self) -> int:
+        total = 0
+        for name in self._segments:
+            with open(self._path(name), "rb") as f:
+                if name == self._read_segment:
+                    f.seek(self._read_offset)
+                total += sum(1 for line in f if line.endswith(b"\n"))
+        return total
+
+    def append(self, points: List[TrainingPayload]):
+        if not points:
+            return
+        data = "".join(p.model_dump_json() + "\n" for p in points).encode()
+        with self._lock:
+            if self._active is None or self._active.tell() + len(data) > self.segment_max_bytes:
+                self._rotate()
+            self._active.write(data)
+            self._active.flush()
+            if self.fsync:
+                os.fsync(self._active.fileno())
+            self.spooled += len(points)
+            self.pending += len(points)
+
+    def _rotate(self):
+        if self._active is not None:
+            self._active.close()
+        self._active_name = f"seg-{self._next_seq:012d}.jsonl"
+        self._next_seq += 1
+        self._active = open(self._path(self._active_name), "ab")
+        self._segments.append(self._active_name)
+        if self._read_segment is None:
+            self._read_segment, self._read_offset = self._active_name, 0
+
+    def read_batch(self, max_items: int):
+        """
+        Prossimi punti da reinviare (senza consumarli); (punti, posizione da passare
+        a commit). La posizione conta anche le righe illeggibili saltate.
+        """
+        with self._lock:
+            name, offset = self._read_segment, self._read_offset
+            points = []
+            consumed = 0
+            while name is not None and len(points) < max_items:
+                with open(self._path(name), "rb") as f:
+                    f.seek(offset)
+                    for line in f:
+                        if not line.endswith(b"\n"):
+                            break  # riga ancora in scrittura
+                        offset += len(line)
+                        consumed += 1
+                        try:
+                            points.append(TrainingPayload.model_validate_json(line))
+                        except ValueError as e:
+                            logger.error(f"📼 Spool: riga illeggibile saltata in {name}: {e}")
+                            continue
+                        if len(points) >= max_items:
+                            break
+                if len(points) >= max_items or name == self._active_name:
+                    break
+                # Segmento chiuso e letto tutto: si passa al successivo
+                index = self._segments.index(name)
+                if index + 1 >= len(self._segments):
+                    break
+                name, offset = self._segments[index + 1], 0
+            return points, (name, offset, consumed)
+
+    def commit(self, position, count: int):
+        """Conferma la scrittura dei punti letti: avanza il cursore ed elimina i segmenti consumati"""
+        with self._lock:
+            consumed = self._advance(position)
+            self.replayed += count
+            self.skipped += consumed - count
+
+    def dead_letter(self, points: List[TrainingPayload], position):
+        """Sposta nel file dead-letter un batch rifiutato in modo permanente e lo consuma"""
+        data = "".join(p.model_dump_json() + "\n" for p in points).encode()
+        with self._lock:
+            with open(self._path(self.DEAD_LETTER_FILE), "ab") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            consumed = self._advance(position)
+            self.dead_lettered += len(points)
+            self.skipped += consumed - len(points)
+
+    def _advance(self, position) -> int:
+        name, offset, consumed = position
+        while self._segments and self._segments[0] != name:
+            os.remove(self._path(self._segments.pop(0)))
+        self._read_segment, self._read_offset = name, offset
+        self.pending = max(0, self.pending - consumed)
+        self._save_cursor()
+        return consumed
+
+    def oldest_timestamp(self) -> Optional[datetime]:
+        points, _ = self.read_batch(1)
+        return points[0].timestamp_received if points else None
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = sum(os.path.getsize(self._path(name)) for name in self._segments)
+            segments = len(self._segments)
+        oldest = self.oldest_timestamp() if self.pending else None
+        lag = 0.0
+        if oldest is not None:
+            now = datetime.now(timezone.utc) if oldest.tzinfo else datetime.utcnow()
+            lag = round((now - oldest).total_seconds(), 1)
+        return {
+            "pending": self.pending,
+            "segments": segments,
+            "size_bytes": size,
+            "spooled": self.spooled,
+            "replayed": self.replayed,
+            "skipped": self.skipped,
+            "dead_lettered": self.dead_lettered,
+            "lag_seconds": lag,
+        }
+
+    def close(self):
+        with self._lock:
+            if self._active is not None:
+                self._active.close()
+                self._active = None
@@ -11,6 +11,7 @@ class StorageInterface(ABC):
     
     @abstractmethod
     def write_batch(self, points: List[TrainingPayload]) -> int:
+        """Punti salvati; meno di len(points) se lo storage li rifiuta, eccezione se l'errore è transitorio"""
         pass
     
     @abstractmethod
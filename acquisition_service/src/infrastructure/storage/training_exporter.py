@@ -1,9 +1,62 @@
 import os
+import json
+import math
 import pandas as pd
-from datetime import datetime, timedelta
+import pyarrow as pa
+import pyarrow.parquet as pq
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from typing import Optional
 from influxdb_client import InfluxDBClient
 
+# Colonne tecniche di Influx rimosse dall'export
+TECHNICAL_COLUMNS = ['_start', '_stop', '_measurement', 'table', 'result']
+
+# Schema fisso dell'export a fette: tutte le fette producono le stesse colonne
+EXPORT_COLUMNS = [
+    'timestamp', 'device_id', 'state', 'vibration_x', 'vibration_y', 'vibration_z',
+    'vibration_rms', 'temperature', 'current', 'pressure', 'rpm', 'health_percent'
+]
+
+EXPORT_SCHEMA = pa.schema([
+    ('timestamp', pa.timestamp('ns', tz='UTC')),
+    ('device_id', pa.string()),
+    ('state', pa.string()),
+    *[(c, pa.int64() if c == 'rpm' else pa.float64()) for c in EXPORT_COLUMNS[3:]],
+])
+
+
+def _flux_time(value: datetime) -> str:
+    return value.isoformat() + "Z"
+
+
+def _flux_string(value: str) -> str:
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def resolve_class_targets(targets: dict, totals: dict, total_size: Optional[int] = None) -> dict:
+    """
+    Converte i target per classe in numero di campioni. Valori interi: conteggi;
+    valori frazionari (<1): quote di total_size, oppure della dimensione massima
+    ottenibile rispettando le proporzioni se total_size non è indicato.
+    Il target non supera mai i campioni disponibili.
+    """
+    if not targets:
+        raise ValueError("Nessun target di classe indicato")
+    negative = [state for state, v in targets.items() if v < 0]
+    if negative:
+        raise ValueError(f"Target negativi per: {', '.join(sorted(negative))}")
+    ratios = {state: v for state, v in targets.items() if isinstance(v, float) and v < 1}
+    counts = {state: int(v) for state, v in targets.items() if state not in ratios}
+    if ratios:
+        if total_size is None:
+            if not any(ratio > 0 for ratio in ratios.values()):
+                raise ValueError("Quote tutte nulle: indicare almeno una quota > 0 oppure la dimensione totale")
+            total_size = min(totals.get(state, 0) / ratio for state, ratio in ratios.items() if ratio > 0)
+        counts.update({state: int(total_size * ratio) for state, ratio in ratios.items()})
+    return {state: min(count, totals.get(state, 0)) for state, count in counts.items()}
+
 class TrainingDataExporter:
     """Estrae dati da InfluxDB in formato CSV pronto per ML."""
     
@@ -76,6 +129,240 @@ class TrainingDataExporter:
         
         return df
     
+    def _slice_query(self, start: datetime, stop: datetime) -> str:
+        return f'''
+        from(bucket: "{self.bucket}")
+            |> range(start: {_flux_time(start)}, stop: {_flux_time(stop)})
+            |> filter(fn: (r) => r._measurement == "pump_telemetry")
+            |> pivot(
+                rowKey: ["_time", "device_id", "state"],
+                columnKey: ["_field"],
+                valueColumn: "_value"
+            )
+        '''
+
+    def _sampled_slice_query(self, start: datetime, stop: datetime, plan: dict, include_others: bool) -> str:
+        """
+        Campionamento stratificato eseguito da InfluxDB: per ogni classe un
+        ramo che filtra sul tag state, prende una riga ogni `stride` (sample)
+        e al massimo `quota` righe (limit). Con include_others le classi senza
+        piano vengono esportate per intero.
+        """
+        pivot = '''|> pivot(rowKey: ["_time", "device_id", "state"], columnKey: ["_field"], valueColumn: "_value")
+                |> group()
+                |> sort(columns: ["_time"])'''
+        branches = []
+        for state, (stride, quota) in sorted(plan.items()):
+            if quota <= 0:
+                continue
+            branches.append(f'''data
+                |> filter(fn: (r) => r.state == {_flux_string(state)})
+                {pivot}
+                |> sample(n: {stride}, pos: 0)
+                |> limit(n: {quota})''')
+        if include_others:
+            excluded = " and ".join(f"r.state != {_flux_string(state)}" for state in sorted(plan)) or "true"
+            branches.append(f'''data
+                |> filter(fn: (r) => {excluded})
+                {pivot}''')
+        if not branches:
+            return ""
+
+        if len(branches) == 1:
+            body = branches[0]
+        else:
+            body = "union(tables: [\n            " + ",\n            ".join(branches) + "\n        ])"
+        return f'''
+        data = from(bucket: "{self.bucket}")
+            |> range(start: {_flux_time(start)}, stop: {_flux_time(stop)})
+            |> filter(fn: (r) => r._measurement == "pump_telemetry")
+        {body}
+        '''
+
+    def class_counts_by_slice(self, start: datetime, stop: datetime, slice_minutes: int) -> dict:
+        """Conteggi per (fetta, classe) con un'unica query aggregata, finestre allineate alle fette"""
+        slice_seconds = slice_minutes * 60
+        # Offset al microsecondo: con i soli secondi ogni finestra inizierebbe poco
+        # prima del bordo della fetta e verrebbe attribuita alla fetta precedente
+        offset_us = (start - datetime(1970, 1, 1)) // timedelta(microseconds=1) % (slice_seconds * 1_000_000)
+        query = f'''
+        from(bucket: "{self.bucket}")
+            |> range(start: {_flux_time(start)}, stop: {_flux_time(stop)})
+            |> filter(fn: (r) => r._measurement == "pump_telemetry" and r._field == "health_percent")
+            |> group(columns: ["state"])
+            |> aggregateWindow(every: {slice_seconds}s, offset: {offset_us}us, fn: count, timeSrc: "_start", createEmpty: false)
+        '''
+        counts = {}
+        for table in self.query_api.query(query, org=self.org):
+            for record in table.records:
+                window_start = record.get_time().astimezone(timezone.utc).replace(tzinfo=None)
+                index = max(0, round((window_start - start).total_seconds() / slice_seconds))
+                per_slice = counts.setdefault(index, {})
+                state = record.values.get("state", "unknown")
+                per_slice[state] = per_slice.get(state, 0) + int(record.get_value())
+        return counts
+
+    def _query_slice(self, start: datetime, stop: datetime, plan: Optional[dict] = None) -> pd.DataFrame:
+        if plan is None:
+            query = self._slice_query(start, stop)
+        else:
+            query = self._sampled_slice_query(start, stop, *plan)
+            if not query:
+                return pd.DataFrame(columns=EXPORT_COLUMNS)
+        df = self.query_api.query_data_frame(query, org=self.org)
+        if isinstance(df, list):
+            df = pd.concat(df) if df else pd.DataFrame()
+        if df is None or df.empty:
+            return pd.DataFrame(columns=EXPORT_COLUMNS)
+
+        df = df.drop(columns=[c for c in TECHNICAL_COLUMNS if c in df.columns])
+        df = df.rename(columns={'_time': 'timestamp'})
+        df['timestamp'] = pd.to_datetime(df['timestamp'])
+        df = df.reindex(columns=EXPORT_COLUMNS)
+        df['rpm'] = df['rpm'].astype('Int64')
+        return df.sort_values('timestamp')
+
+    @staticmethod
+    def _time_slices(start: datetime, stop: datetime, slice_minutes: int):
+        step = timedelta(minutes=slice_minutes)
+        cursor = start
+        while cursor < stop:
+            yield cursor, min(cursor + step, stop)
+            cursor += step
+
+    @staticmethod
+    def read_watermark(path: str) -> Optional[datetime]:
+        try:
+            with open(path) as f:
+                return datetime.fromisoformat(json.load(f)["last_stop"])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    @staticmethod
+    def _write_watermark(path: str, value: datetime):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"last_stop": value.isoformat()}, f)
+        os.replace(tmp, path)
+
+    def export_streaming(self,
+                         output_path: str,
+                         start_time: datetime,
+                         end_time: datetime,
+                         slice_minutes: int = 60,
+                         workers: int = 4,
+                         fmt: str = "parquet",
+                         watermark_path: Optional[str] = None,
+                         class_targets: Optional[dict] = None,
+                         sample_total: Optional[int] = None) -> dict:
+        """
+        Export a fette temporali: le fette vengono interrogate in parallelo
+        (al massimo `workers` in volo, quindi memoria limitata) e scritte in
+        ordine su un unico file Parquet/CSV. Dopo ogni fetta scritta il
+        watermark (se indicato) avanza alla fine della fetta: un export
+        successivo può ripartire da lì e scaricare solo i dati nuovi.
+
+        Con class_targets (conteggi o quote per classe) l'export è stratificato:
+        dai conteggi per fetta e classe si ricava la quota di ogni fetta,
+        proporzionale ai dati disponibili, e il campionamento avviene nella
+        query, quindi vengono trasferite solo le righe necessarie.
+        """
+        if fmt not in ("parquet", "csv"):
+            raise ValueError(f"Formato non supportato: {fmt}")
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        # Bordi delle fette al secondo intero (start da utcnow() - lag o dal watermark)
+        start_time = start_time.replace(microsecond=0)
+        end_time = end_time.replace(microsecond=0)
+
+        slices = list(self._time_slices(start_time, end_time, slice_minutes))
+        print(f"[Exporter] Export a fette: {len(slices)} fette da {slice_minutes} min, {workers} query parallele")
+
+        plans = [None] * len(slices)
+        if class_targets:
+            plans = self._sampling_plans(start_time, end_time, slice_minutes, len(slices), class_targets, sample_total)
+
+        writer = None
+        rows = 0
+        class_counts = {}
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                pending = deque()
+                remaining = iter(slices)
+                submitted = 0
+                for window in remaining:
+                    pending.append((window, executor.submit(self._query_slice, *window, plans[submitted])))
+                    submitted += 1
+                    if len(pending) >= workers:
+                        break
+
+                while pending:
+                    (slice_start, slice_stop), future = pending.popleft()
+                    df = future.result()
+                    # Una nuova query parte solo quando una fetta viene consumata
+                    window = next(remaining, None)
+                    if window is not None:
+                        pending.append((window, executor.submit(self._query_slice, *window, plans[submitted])))
+                        submitted += 1
+
+                    if not df.empty:
+                        writer = self._write_slice(writer, output_path, df, fmt)
+                        rows += len(df)
+                        for state, count in df['state'].value_counts().items():
+                            class_counts[state] = class_counts.get(state, 0) + int(count)
+                    if watermark_path:
+                        self._write_watermark(watermark_path, slice_stop)
+                    print(f"[Exporter] Fetta {slice_start.isoformat()} -> {slice_stop.isoformat()}: {len(df)} righe")
+        finally:
+            # Un errore a metà lascia un file valido fino all'ultima fetta scritta (e il watermark)
+            if writer is not None and fmt == "parquet":
+                writer.close()
+
+        print(f"[Exporter] Salvati {rows} campioni in {output_path}")
+        if class_counts:
+            print(f"[Exporter] Distribuzione classi: {class_counts}")
+        return {"rows": rows, "slices": len(slices), "classes": class_counts, "output": output_path if rows else None}
+
+    def _sampling_plans(self, start: datetime, stop: datetime, slice_minutes: int, num_slices: int,
+                        class_targets: dict, sample_total: Optional[int]):
+        """Per ogni fetta: ({classe: (stride, quota)}, include_others) dai conteggi aggregati"""
+        counts = self.class_counts_by_slice(start, stop, slice_minutes)
+        totals = {}
+        for per_slice in counts.values():
+            for state, count in per_slice.items():
+                totals[state] = totals.get(state, 0) + count
+
+        targets = resolve_class_targets(class_targets, totals, sample_total)
+        # Le classi non indicate nei target vengono esportate per intero
+        include_others = bool(set(totals) - set(targets))
+        print(f"[Exporter] Disponibili: {totals} | Target: {targets}")
+
+        plans = []
+        # Resto frazionario riportato tra le fette: il totale per classe coincide col target
+        carry = {state: 0.0 for state in targets}
+        for index in range(num_slices):
+            per_slice = counts.get(index, {})
+            plan = {}
+            for state, target in targets.items():
+                available = per_slice.get(state, 0)
+                exact = available * target / totals[state] + carry[state] if totals.get(state) else 0.0
+                quota = min(available, int(exact))
+                carry[state] = exact - quota
+                plan[state] = (max(1, available // quota) if quota else 1, quota)
+            plans.append((plan, include_others))
+        return plans
+
+    @staticmethod
+    def _write_slice(writer, output_path: str, df: pd.DataFrame, fmt: str):
+        if fmt == "csv":
+            df.to_csv(output_path, mode="a" if writer else "w", header=writer is None, index=False)
+            return True
+
+        if writer is None:
+            writer = pq.ParquetWriter(output_path, EXPORT_SCHEMA, compression="zstd", use_dictionary=["device_id", "state"])
+        writer.write_table(pa.Table.from_pandas(df, preserve_index=False).cast(EXPORT_SCHEMA))
+        return writer
+
     def get_dataset_summary(self, hours_back: int = 24) -> dict:
         query = f'''
         from(bucket: "{self.bucket}")
@@ -1,7 +1,8 @@
 import os
 import queue
+import signal
 import logging
-import time
+import threading
 import sys
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -11,31 +12,91 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from acquisition.mqtt_fetcher import MQTTPumpFetcher
 from orchestration.data_manager import DataManager
+from infrastructure.storage.spool import DiskSpool
+from infrastructure.storage.influx_writer import InfluxDBWriter
+from infrastructure.storage.parquet_writer import ParquetDatasetWriter
+from infrastructure.storage.fanout_writer import FanOutWriter
+
+def create_storage():
+    """Backend di storage: influx (default), parquet, oppure both (Influx + dataset Parquet)"""
+    mode = os.getenv("ACQ_STORAGE", "influx").lower()
+    if mode == "influx":
+        return InfluxDBWriter()
+
+    parquet = ParquetDatasetWriter(
+        os.getenv("PARQUET_DATASET_PATH", "data/dataset"),
+        row_group_size=int(os.getenv("PARQUET_ROW_GROUP_SIZE", 50_000)),
+        max_file_rows=int(os.getenv("PARQUET_MAX_FILE_ROWS", 1_000_000)),
+        max_file_age=float(os.getenv("PARQUET_MAX_FILE_AGE", 300)),
+        fsync=os.getenv("PARQUET_FSYNC", "true").lower() == "true"
+    )
+    if mode == "parquet":
+        return parquet
+    if mode == "both":
+        return FanOutWriter(InfluxDBWriter(), parquet)
+    raise ValueError(f"ACQ_STORAGE non valido: {mode} (ammessi: influx, parquet, both)")
 
 def main():
     logger.info("🚀 Avvio Servizio Acquisizione (Python Simulator Mode)")
     
-    data_queue = queue.Queue(maxsize=1000)
+    data_queue = queue.Queue(maxsize=int(os.getenv("ACQ_QUEUE_SIZE", 1000)))
     
+    # Spool su disco: raccoglie i punti quando la coda o InfluxDB sono saturi
+    spool = None
+    if os.getenv("ACQ_SPOOL_ENABLED", "true").lower() == "true":
+        spool = DiskSpool(
+            os.getenv("ACQ_SPOOL_DIR", "data/spool"),
+            segment_max_bytes=int(os.getenv("ACQ_SPOOL_SEGMENT_MB", 8)) * 1024 * 1024,
+            fsync=os.getenv("ACQ_SPOOL_FSYNC", "false").lower() == "true"
+        )
+
     # Configura il Fetcher (Assicurati che il topic sia quello del nuovo simulatore)
     fetcher = MQTTPumpFetcher(
         output_queue=data_queue, 
         broker="172.17.0.1", # IP del broker
-        topic="factory/training/+/training_data"
+        topic="factory/training/+/training_data",
+        overflow=spool.append if spool else None
     )
     
-    data_manager = DataManager(data_queue=data_queue, batch_size=10)
+    # Batch adattivo: tra min e max, dimensionato sul rate e sulla latenza obiettivo
+    data_manager = DataManager(
+        data_queue=data_queue,
+        storage=create_storage(),
+        min_batch=int(os.getenv("ACQ_MIN_BATCH", 10)),
+        max_batch=int(os.getenv("ACQ_MAX_BATCH", 5000)),
+        target_latency=float(os.getenv("ACQ_TARGET_LATENCY_MS", 1000)) / 1000,
+        spool=spool,
+        max_replay_attempts=int(os.getenv("ACQ_SPOOL_MAX_REPLAY_ATTEMPTS", 5))
+    )
+
+    # SIGTERM (docker stop) e Ctrl+C: arresto ordinato, i file aperti vengono chiusi e pubblicati
+    stop_event = threading.Event()
+    def on_signal(signum, frame):
+        logger.info(f"🛑 Segnale {signal.Signals(signum).name} ricevuto")
+        stop_event.set()
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
 
     try:
         fetcher.start()
         data_manager.start()
         
-        while True:
-            time.sleep(10)
+        while not stop_event.wait(10):
             status = "OK" if data_manager.storage.health_check() else "DOWN"
-            logger.info(f"📊 Queue: {data_queue.qsize()} | Storage: {status}")
-            
-    except KeyboardInterrupt:
+            stats = data_manager.stats()
+            logger.info(
+                f"📊 Queue: {data_queue.qsize()} | Storage: {status} | "
+                f"Batch: {stats['batch_size']} | Rate: {stats['ingest_rate']}/s | "
+                f"Last write: {stats['last_write_ms']} ms"
+            )
+            if stats["spool"] and stats["spool"]["pending"]:
+                spool_stats = stats["spool"]
+                logger.warning(
+                    f"📼 Spool: {spool_stats['pending']} punti in attesa | "
+                    f"{spool_stats['size_bytes'] / 1e6:.1f} MB in {spool_stats['segments']} segmenti | "
+                    f"Lag: {spool_stats['lag_seconds']} s"
+                )
+    finally:
         logger.info("🛑 Arresto...")
         fetcher.stop()
         data_manager.stop()
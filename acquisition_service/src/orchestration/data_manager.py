@@ -1,3 +1,4 @@
+import time
 import queue
 import threading
 import logging
@@ -5,44 +6,242 @@ from typing import Optional, List
 from domain.schemas.telemetry_schemas import TrainingPayload
 from infrastructure.storage.storage_interface import StorageInterface
 from infrastructure.storage.influx_writer import InfluxDBWriter
+from infrastructure.storage.spool import DiskSpool
 
 logger = logging.getLogger(__name__)
 
 class DataManager:
-    def __init__(self, data_queue: queue.Queue, storage: Optional[StorageInterface] = None, batch_size: int = 5):
+    """
+    Consumer della coda di acquisizione con un unico livello di batching:
+    - dequeue a drenaggio: dopo il primo elemento si svuota tutto ciò che è
+      già in coda, senza un get bloccante per elemento
+    - batch adattivo: la dimensione segue il rate di ingresso (elementi
+      arrivati in target_latency secondi) ed è limitata da un tetto che si
+      riduce se la scrittura supera la latenza obiettivo e cresce altrimenti
+    - doppio buffer: la scrittura avviene su un thread dedicato, mentre il
+      consumer continua a riempire il batch successivo
+    - spool su disco (opzionale): se lo storage non è sano o una scrittura
+      fallisce i batch vanno nello spool; finché lo spool non è vuoto anche i
+      nuovi batch vi vengono accodati e reinviati in ordine, un batch alla volta;
+      un batch che lo storage continua a rifiutare mentre risponde al ping
+      (errore permanente, es. 4xx) va nel dead-letter dopo max_replay_attempts.
+      Gli errori transitori (eccezioni di write_batch: timeout, 5xx) non
+      contano come rifiuti: il batch resta nello spool finché non passa
+    """
+
+    def __init__(self, data_queue: queue.Queue, storage: Optional[StorageInterface] = None,
+                 min_batch: int = 10, max_batch: int = 5000, target_latency: float = 1.0,
+                 spool: Optional[DiskSpool] = None, health_interval: float = 5.0,
+                 max_replay_attempts: int = 5):
         self.queue = data_queue
         self.storage = storage or InfluxDBWriter()
-        self.batch_size = batch_size
+        self.min_batch = min_batch
+        self.max_batch = max_batch
+        self.target_latency = target_latency
         self._stop_event = threading.Event()
         self._thread: Optional[threading.Thread] = None
+        self._writer_thread: Optional[threading.Thread] = None
         self._buffer: List[TrainingPayload] = []
+        # Slot di passaggio verso il writer: un batch in scrittura, uno in riempimento
+        self._handoff: queue.Queue = queue.Queue(maxsize=1)
+
+        self.batch_size = min_batch
+        self._batch_cap = max_batch
+        self._ingest_rate = 0.0
+        self.written = 0
+        self.failed = 0
+        self.last_write_seconds = 0.0
+
+        self.spool = spool
+        self.health_interval = health_interval
+        self._healthy = True
+        self._next_health_check = 0.0
+        self.max_replay_attempts = max(1, max_replay_attempts)
+        self._replay_rejections = 0
+        self._last_error_transient = False
 
     def start(self):
+        self._writer_thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer_thread.start()
         self._thread = threading.Thread(target=self._run, daemon=True)
         self._thread.start()
 
+    def _drain(self, limit: int) -> int:
+        taken = 0
+        while taken < limit:
+            try:
+                self._buffer.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+            taken += 1
+        return taken
+
     def _run(self):
         while not self._stop_event.is_set():
+            started = time.monotonic()
+            carried = len(self._buffer)
             try:
-                data: TrainingPayload = self.queue.get(timeout=2.0)
-                self._buffer.append(data)
-                if len(self._buffer) >= self.batch_size:
-                    self._flush_buffer()
+                self._buffer.append(self.queue.get(timeout=self.target_latency))
             except queue.Empty:
-                if self._buffer: self._flush_buffer()
-        
-        if self._buffer: self._flush_buffer()
+                if self._buffer:
+                    self._hand_off(block=True)
+                continue
+
+            # Riempimento del batch fino alla dimensione corrente o alla latenza obiettivo
+            deadline = started + self.target_latency
+            while len(self._buffer) < self.batch_size and not self._stop_event.is_set():
+                if self._drain(self.batch_size - len(self._buffer)):
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    self._buffer.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            self._update_rate(len(self._buffer) - carried, time.monotonic() - started)
+            # Se il writer è ancora occupato si continua ad accumulare fino a max_batch
+            self._hand_off(block=len(self._buffer) >= self.max_batch)
+
+        self._drain(self.queue.qsize())
+        while self._buffer:
+            self._hand_off(block=True)
+        self._handoff.put(None)
+        self._writer_thread.join()
         self.storage.close()
+        if self.spool:
+            self.spool.close()
 
-    def _flush_buffer(self):
-        points = self._buffer.copy()
-        self._buffer = []
+    def _hand_off(self, block: bool):
+        batch = self._buffer[:self.max_batch]
         try:
-            self.storage.write_batch(points)
-            logger.info(f"💾 Salvati {len(points)} punti. Ultimo stato: {points[-1].ground_truth}")
+            self._handoff.put(batch, block=block)
+        except queue.Full:
+            return
+        del self._buffer[:len(batch)]
+
+    def _update_rate(self, items: int, elapsed: float):
+        rate = items / max(elapsed, 1e-3)
+        self._ingest_rate = rate if not self._ingest_rate else 0.8 * self._ingest_rate + 0.2 * rate
+        wanted = int(self._ingest_rate * self.target_latency)
+        self.batch_size = max(self.min_batch, min(wanted, self._batch_cap))
+
+    def _write_loop(self):
+        progress = True
+        while True:
+            replaying = self.spool is not None and self.spool.pending and self._storage_healthy()
+            try:
+                # Durante il replay non si attende: lo spool si svuota a piena velocità.
+                # Se l'ultimo replay non ha avanzato si attende come da idle (nessun busy loop)
+                if replaying and progress:
+                    points = self._handoff.get_nowait()
+                else:
+                    points = self._handoff.get(timeout=self.health_interval)
+            except queue.Empty:
+                points = []
+            if points is None:
+                return
+
+            if points:
+                if self.spool is not None and (self.spool.pending or not self._healthy):
+                    # Ordine preservato: i nuovi punti seguono quelli già nello spool
+                    self.spool.append(points)
+                else:
+                    self._write(points)
+            if replaying:
+                progress = self._replay()
+
+    def _storage_healthy(self) -> bool:
+        if not self._healthy and time.monotonic() >= self._next_health_check:
+            self._healthy = self._ping()
+            self._next_health_check = time.monotonic() + self.health_interval
+            if self._healthy:
+                logger.info(f"✅ Storage di nuovo disponibile, replay di {self.spool.pending} punti dallo spool")
+        return self._healthy
+
+    def _mark_unhealthy(self):
+        self._healthy = False
+        self._next_health_check = time.monotonic() + self.health_interval
+
+    def _replay(self) -> bool:
+        """Reinvia il prossimo batch dello spool; False se non ha potuto avanzare"""
+        points, position = self.spool.read_batch(self.max_batch)
+        if not points:
+            if position[2]:
+                # Solo righe illeggibili: si avanza il cursore
+                self.spool.commit(position, 0)
+                return True
+            return False
+        if self._write(points, from_spool=True):
+            self._replay_rejections = 0
+            self.spool.commit(position, len(points))
+            return True
+
+        # Storage raggiungibile e batch rifiutato senza eccezione: errore permanente
+        if not self._last_error_transient and self._ping():
+            self._replay_rejections += 1
+            if self._replay_rejections >= self.max_replay_attempts:
+                self.spool.dead_letter(points, position)
+                self._replay_rejections = 0
+                self._healthy = True
+                logger.error(f"☠️ Batch di {len(points)} punti rifiutato {self.max_replay_attempts} volte "
+                             f"con storage raggiungibile: spostato nel dead-letter")
+                return True
+        return False
+
+    def _ping(self) -> bool:
+        try:
+            return bool(self.storage.health_check())
+        except Exception:
+            return False
+
+    def _write(self, points, from_spool: bool = False) -> bool:
+        started = time.monotonic()
+        written = 0
+        self._last_error_transient = False
+        try:
+            written = self.storage.write_batch(points)
         except Exception as e:
+            self._last_error_transient = True
             logger.error(f"Errore flush: {e}")
+        self.last_write_seconds = time.monotonic() - started
+
+        if written < len(points) and self.spool is not None:
+            # Scrittura fallita: i punti restano (o finiscono) nello spool, nessuna perdita
+            self._mark_unhealthy()
+            if not from_spool:
+                self.spool.append(points)
+            logger.warning(f"📼 Storage non disponibile: {len(points)} punti nello spool ({self.spool.pending} in attesa)")
+            return False
+
+        self.written += written
+        self.failed += len(points) - written
+
+        # Tetto adattivo sulla latenza di scrittura (AIMD)
+        if self.last_write_seconds > self.target_latency:
+            self._batch_cap = max(self.min_batch, int(len(points) * 0.7))
+        elif len(points) >= self._batch_cap:
+            self._batch_cap = min(self.max_batch, int(self._batch_cap * 1.25) + 1)
+
+        if written:
+            logger.info(
+                f"💾 Salvati {written} punti in {self.last_write_seconds * 1000:.0f} ms "
+                f"(batch {self.batch_size}{', replay' if from_spool else ''}). Ultimo stato: {points[-1].ground_truth}"
+            )
+        return written == len(points)
+
+    def stats(self) -> dict:
+        return {
+            "batch_size": self.batch_size,
+            "batch_cap": self._batch_cap,
+            "ingest_rate": round(self._ingest_rate, 1),
+            "written": self.written,
+            "failed": self.failed,
+            "last_write_ms": round(self.last_write_seconds * 1000, 1),
+            "spool": self.spool.stats() if self.spool else None,
+        }
 
     def stop(self):
         self._stop_event.set()
-        if self._thread: self._thread.join()
\ No newline at end of file
+        if self._thread: self._thread.join()
@@ -0,0 +1,56 @@
+import os
+import sys
+import queue
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from domain.schemas.telemetry_schemas import TrainingPayload
+from infrastructure.storage.spool import DiskSpool
+from infrastructure.storage.storage_interface import StorageInterface
+from orchestration.data_manager import DataManager
+
+
+class _FailingStorage(StorageInterface):
+    """Storage raggiungibile (ping OK) che fallisce ogni scrittura"""
+
+    def __init__(self, transient):
+        self.transient = transient
+
+    def write(self, point):
+        return False
+
+    def write_batch(self, points):
+        if self.transient:
+            raise TimeoutError("timeout di scrittura")
+        return 0
+
+    def flush(self): pass
+    def health_check(self): return True
+    def close(self): pass
+
+
+def _point(i):
+    return TrainingPayload(device_id=f"pump-{i}", vibration_x=1.0, vibration_y=1.0, vibration_z=1.0,
+                           vibration_rms=1.0, temperature=60.0, current=5.0, pressure=3.0, rpm=1450,
+                           health_percent=90.0, ground_truth="HEALTHY")
+
+
+def _replay(storage, spool_dir):
+    spool = DiskSpool(str(spool_dir))
+    spool.append([_point(i) for i in range(3)])
+    manager = DataManager(queue.Queue(), storage=storage, spool=spool, max_replay_attempts=3)
+    for _ in range(5):
+        manager._replay()
+    return spool
+
+
+def test_transient_errors_never_dead_letter(tmp_path):
+    spool = _replay(_FailingStorage(transient=True), tmp_path)
+    assert spool.dead_lettered == 0
+    assert spool.pending == 3
+
+
+def test_rejected_batch_is_dead_lettered(tmp_path):
+    spool = _replay(_FailingStorage(transient=False), tmp_path)
+    assert spool.dead_lettered == 3
+    assert spool.pending == 0
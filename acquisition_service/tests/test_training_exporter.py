@@ -0,0 +1,88 @@
+import os
+import re
+import sys
+from datetime import datetime, timedelta, timezone
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from infrastructure.storage.training_exporter import TrainingDataExporter, resolve_class_targets
+
+EPOCH = datetime(1970, 1, 1)
+_UNITS_US = {"us": 1, "s": 1_000_000}
+
+
+class _Record:
+    def __init__(self, time, state, count):
+        self.values = {"state": state}
+        self._time = time
+        self._count = count
+
+    def get_time(self):
+        return self._time.replace(tzinfo=timezone.utc)
+
+    def get_value(self):
+        return self._count
+
+
+class _Table:
+    def __init__(self, records):
+        self.records = records
+
+
+class _WindowedCountApi:
+    """Simula aggregateWindow(fn: count, timeSrc: "_start"): finestre epoch + offset, la prima tagliata allo start"""
+
+    def __init__(self, points):
+        self.points = points
+
+    def query(self, query, org=None):
+        every = int(re.search(r"every: (\d+)s", query).group(1)) * 1_000_000
+        value, unit = re.search(r"offset: (\d+)(us|s)\b", query).groups()
+        offset = int(value) * _UNITS_US[unit]
+        start, stop = (datetime.fromisoformat(t.rstrip("Z")) for t in re.search(r"range\(start: (\S+), stop: (\S+)\)", query).groups())
+
+        counts = {}
+        for time, state in self.points:
+            if not start <= time < stop:
+                continue
+            us = (time - EPOCH) // timedelta(microseconds=1)
+            window = EPOCH + timedelta(microseconds=(us - offset) // every * every + offset)
+            key = (max(window, start), state)
+            counts[key] = counts.get(key, 0) + 1
+        return [_Table([_Record(window, state, n) for (window, state), n in sorted(counts.items())])]
+
+
+def _exporter(points):
+    exporter = TrainingDataExporter.__new__(TrainingDataExporter)
+    exporter.bucket, exporter.org = "pump-data", "pump-org"
+    exporter.query_api = _WindowedCountApi(points)
+    return exporter
+
+
+def test_slice_counts_with_sub_second_start():
+    start = datetime(2026, 10, 17, 8, 0, 0, 734512)
+    points = [(start + timedelta(minutes=10 * k + 5, seconds=i), "HEALTHY") for k in range(3) for i in range(k + 1)]
+    exporter = _exporter(points)
+
+    counts = exporter.class_counts_by_slice(start, start + timedelta(minutes=30), 10)
+
+    assert counts == {0: {"HEALTHY": 1}, 1: {"HEALTHY": 2}, 2: {"HEALTHY": 3}}
+
+
+def test_sampling_plans_reach_targets_with_sub_second_start():
+    start = datetime(2026, 10, 17, 8, 0, 0, 500001)
+    points = [(start + timedelta(minutes=10 * k, seconds=1 + i), "WARNING") for k in range(4) for i in range(100)]
+    exporter = _exporter(points)
+
+    stop = start + timedelta(minutes=40)
+    plans = exporter._sampling_plans(start, stop, 10, 4, {"WARNING": 200}, None)
+
+    quotas = [plan["WARNING"][1] for plan, _ in plans]
+    assert quotas == [50, 50, 50, 50]
+
+
+def test_resolve_class_targets_rejects_all_zero_ratios():
+    with pytest.raises(ValueError, match="Quote tutte nulle"):
+        resolve_class_targets({"HEALTHY": 0.0, "FAULTY": 0.0}, {"HEALTHY": 10, "FAULTY": 5})
+    assert resolve_class_targets({"HEALTHY": 0.5, "FAULTY": 0.0}, {"HEALTHY": 10, "FAULTY": 5}) == {"HEALTHY": 10, "FAULTY": 0}
@@ -1,46 +1,114 @@
-import React, { useState, useEffect, useCallback } from 'react';
+import React, { useState, useEffect, useCallback, useMemo } from 'react';
 import axios from 'axios';
 import './App.css';
 
 const API_URL = process.env.REACT_APP_API_URL || "http://localhost:8080/api/v1/status";
+const STREAM_URL = process.env.REACT_APP_STREAM_URL || API_URL.replace(/\/status$/, '/stream');
+const SUMMARY_URL = process.env.REACT_APP_SUMMARY_URL || API_URL.replace(/\/status$/, '/fleet/summary');
 const ITEMS_PER_PAGE = 15;
+const POLL_INTERVAL_MS = 3000;
+const STREAM_RETRY_MS = 30000;
+
+const toPumpMap = (list) => {
+  const map = {};
+  list.forEach(p => { map[p.device_id] = p; });
+  return map;
+};
 
 function App() {
-  const [pumps, setPumps] = useState([]);
+  const [pumpMap, setPumpMap] = useState({});
+  const [summary, setSummary] = useState(null);
+  const [streaming, setStreaming] = useState(typeof EventSource !== 'undefined');
   const [loading, setLoading] = useState(true);
   const [filter, setFilter] = useState('ALL');
   const [currentPage, setCurrentPage] = useState(1);
   const [expandedId, setExpandedId] = useState(null); // Stato per la riga espansa
 
+  const pumps = useMemo(() => {
+    const all = Object.values(pumpMap).sort((a, b) =>
+      a.device_id.localeCompare(b.device_id, undefined, { numeric: true })
+    );
+    return filter === 'ALL' ? all : all.filter(p => p.state === filter);
+  }, [pumpMap, filter]);
+
+  // Totali della flotta calcolati lato server in modo incrementale
   const stats = {
-    total: pumps.length,
-    broken: pumps.filter(p => p.state === 'BROKEN').length,
-    faulty: pumps.filter(p => p.state === 'FAULTY').length,
-    warning: pumps.filter(p => p.state === 'WARNING').length,
-    avgHealth: pumps.length > 0 
-      ? (pumps.reduce((acc, p) => acc + (p.health_score || 0), 0) / pumps.length).toFixed(1) 
-      : 0
+    total: summary ? summary.total : 0,
+    broken: summary?.states.BROKEN || 0,
+    faulty: summary?.states.FAULTY || 0,
+    warning: summary?.states.WARNING || 0,
+    avgHealth: summary?.health.mean != null ? summary.health.mean.toFixed(1) : 0
   };
 
+  // Il browser rivalida con l'ETag: se la flotta non cambia la risposta è un 304
+  useEffect(() => {
+    const fetchSummary = async () => {
+      try {
+        const response = await axios.get(SUMMARY_URL, { params: { top: 0 } });
+        setSummary(response.data);
+      } catch (error) {
+        console.error("Summary fetch error:", error);
+      }
+    };
+    fetchSummary();
+    const interval = setInterval(fetchSummary, POLL_INTERVAL_MS);
+    return () => clearInterval(interval);
+  }, []);
+
+  // Stream SSE: snapshot iniziale + sole pompe cambiate
+  useEffect(() => {
+    if (!streaming) return;
+
+    const source = new EventSource(STREAM_URL);
+    source.addEventListener('snapshot', (event) => {
+      setPumpMap(toPumpMap(JSON.parse(event.data).pumps));
+      setLoading(false);
+    });
+    source.addEventListener('pumps', (event) => {
+      const changed = JSON.parse(event.data).pumps;
+      setPumpMap(prev => ({ ...prev, ...toPumpMap(changed) }));
+    });
+    // Pompe scadute lato server (nessun aggiornamento entro max_age)
+    source.addEventListener('removed', (event) => {
+      const removed = JSON.parse(event.data).device_ids;
+      setPumpMap(prev => {
+        const next = { ...prev };
+        removed.forEach(id => delete next[id]);
+        return next;
+      });
+    });
+    source.onerror = () => {
+      console.error("Stream error, falling back to polling");
+      source.close();
+      setStreaming(false);
+    };
+    return () => source.close();
+  }, [streaming]);
+
+  // Fallback: polling ogni 3 secondi, con nuovo tentativo di stream dopo 30 secondi
   const fetchData = useCallback(async () => {
     try {
-      const url = filter === 'ALL' ? API_URL : `${API_URL}?state=${filter}`;
-      const response = await axios.get(url);
-      const sortedPumps = response.data.pumps.sort((a, b) =>
-        a.device_id.localeCompare(b.device_id, undefined, { numeric: true })
-      );
-      setPumps(sortedPumps);
+      const response = await axios.get(API_URL);
+      setPumpMap(toPumpMap(response.data.pumps));
       setLoading(false);
     } catch (error) {
       console.error("Fetch error:", error);
     }
-  }, [filter]);
+  }, []);
 
   useEffect(() => {
+    if (streaming) return;
+
     fetchData();
-    const interval = setInterval(fetchData, 3000);
-    return () => clearInterval(interval);
-  }, [fetchData]);
+    const interval = setInterval(fetchData, POLL_INTERVAL_MS);
+    const retry = typeof EventSource !== 'undefined'
+      ? setTimeout(() => setStreaming(true), STREAM_RETRY_MS)
+      : null;
+    return () => {
+      clearInterval(interval);
+      if (retry) clearTimeout(retry);
+    };
+  }, [streaming, fetchData]);
 
   const indexOfLastItem = currentPage * ITEMS_PER_PAGE;
   const indexOfFirstItem = indexOfLastItem - ITEMS_PER_PAGE;
@@ -62,7 +130,7 @@ function App() {
       <header className="header">
         <div className="title-section">
           <h1>Pumps Health Monitoring Dashboard</h1>
-          <span className="live-indicator">LIVE SYSTEM</span>
+          <span className="live-indicator">{streaming ? 'LIVE STREAM' : 'LIVE SYSTEM'}</span>
         </div>
         <div className="api-info">Node: {API_URL}</div>
       </header>
@@ -0,0 +1,52 @@
+import sys
+import os
+import argparse
+import joblib
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from predictor import FEATURE_ORDER
+from compiled_forest import CompiledPumpModel, COMPILED_FILENAME, verify_equivalence, verification_samples
+
+def load_verification_samples(args, scaler):
+    if args.verify_csv:
+        import pandas as pd
+        return pd.read_csv(args.verify_csv)[FEATURE_ORDER].to_numpy(dtype=float)
+
+    # Campioni sintetici arrotondati come la telemetria (2 decimali)
+    return verification_samples(scaler, len(FEATURE_ORDER), args.verify_samples, args.seed)
+
+def main():
+    parser = argparse.ArgumentParser(description='Compila scaler + Random Forest in array NumPy piatti')
+    parser.add_argument('--model-dir', type=str, default=os.getenv("MODEL_DIR", "models"), help='Cartella dei .pkl')
+    parser.add_argument('--output', type=str, help=f'Path output (default: <model-dir>/{COMPILED_FILENAME})')
+    parser.add_argument('--verify-samples', type=int, default=10000, help='Campioni sintetici per la verifica (default: 10000)')
+    parser.add_argument('--verify-csv', type=str, help='CSV di predizioni reali da usare per la verifica')
+    parser.add_argument('--seed', type=int, default=42)
+
+    args = parser.parse_args()
+    output = args.output or os.path.join(args.model_dir, COMPILED_FILENAME)
+
+    scaler = joblib.load(os.path.join(args.model_dir, 'scaler_v2.pkl'))
+    clf = joblib.load(os.path.join(args.model_dir, 'classifier_state_v2.pkl'))
+    reg = joblib.load(os.path.join(args.model_dir, 'regressor_health_v2.pkl'))
+    le = joblib.load(os.path.join(args.model_dir, 'label_encoder_v2.pkl'))
+
+    compiled = CompiledPumpModel.from_sklearn(scaler, clf, reg, le)
+
+    # Test di equivalenza: il file viene scritto solo se l'output coincide con sklearn
+    X = load_verification_samples(args, scaler)
+    report = verify_equivalence(compiled, scaler, clf, reg, le, X)
+    print(f"[Compiler] Verifica su {report['samples']} campioni: "
+          f"{report['state_mismatches']} stati diversi, errore health max {report['max_health_error']:.2e}")
+
+    if not report["equivalent"]:
+        print("❌ Il modello compilato non è equivalente a sklearn: export annullato.")
+        sys.exit(1)
+
+    compiled.save(output)
+    print(f"✅ Modello compilato salvato in {output} "
+          f"({compiled.classifier.roots.size} + {compiled.regressor.roots.size} alberi)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+import os
+import shutil
+import logging
+import numpy as np
+
+logger = logging.getLogger("CompiledForest")
+
+# Directory con un file .npy per array: i worker li aprono in memory-map e
+# condividono le stesse pagine (page cache) invece di averne una copia ciascuno
+COMPILED_FILENAME = 'compiled_v2'
+
+
+class CompiledForest:
+    """
+    Random Forest appiattito in array NumPy contigui (tutti gli alberi concatenati).
+    Le foglie puntano a se stesse con soglia +inf, così la discesa può eseguire
+    sempre max_depth passi vettoriali senza rami per riga/albero.
+    Come in sklearn l'input (già scalato) è float32 e viene confrontato con
+    le soglie originali dell'albero: le decisioni coincidono bit a bit.
+    """
+
+    def __init__(self, feature, threshold, left, right, value, roots, max_depth):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = roots
+        self.max_depth = int(max_depth)
+
+    @classmethod
+    def from_sklearn(cls, forest, classifier):
+        features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+        offset = 0
+        max_depth = 0
+
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            n_nodes = tree.node_count
+            is_leaf = tree.children_left == -1
+            node_ids = np.arange(offset, offset + n_nodes)
+
+            feature = np.where(is_leaf, 0, tree.feature).astype(np.intp)
+            threshold = np.where(is_leaf, np.inf, tree.threshold)
+
+            features.append(feature)
+            thresholds.append(threshold)
+            lefts.append(np.where(is_leaf, node_ids, tree.children_left + offset))
+            rights.append(np.where(is_leaf, node_ids, tree.children_right + offset))
+
+            if classifier:
+                value = tree.value[:, 0, :]
+                values.append(value / value.sum(axis=1, keepdims=True))
+            else:
+                values.append(tree.value[:, 0, 0])
+
+            roots.append(offset)
+            max_depth = max(max_depth, tree.max_depth)
+            offset += n_nodes
+
+        return cls(
+            feature=np.concatenate(features),
+            threshold=np.concatenate(thresholds).astype(np.float64),
+            left=np.concatenate(lefts).astype(np.intp),
+            right=np.concatenate(rights).astype(np.intp),
+            value=np.concatenate(values).astype(np.float64),
+            roots=np.array(roots, dtype=np.intp),
+            max_depth=max_depth
+        )
+
+    def apply(self, X):
+        """Indici delle foglie raggiunte, shape (n_campioni, n_alberi)"""
+        nodes = np.broadcast_to(self.roots, (X.shape[0], self.roots.shape[0])).copy()
+        rows = np.arange(X.shape[0])[:, None]
+        for _ in range(self.max_depth):
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        return nodes
+
+    def mean_value(self, X):
+        return self.value[self.apply(X)].mean(axis=1)
+
+    def to_arrays(self, prefix):
+        return {
+            f"{prefix}_feature": self.feature,
+            f"{prefix}_threshold": self.threshold,
+            f"{prefix}_left": self.left,
+            f"{prefix}_right": self.right,
+            f"{prefix}_value": self.value,
+            f"{prefix}_roots": self.roots,
+            f"{prefix}_max_depth": np.array(self.max_depth),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix):
+        return cls(
+            feature=arrays[f"{prefix}_feature"],
+            threshold=arrays[f"{prefix}_threshold"],
+            left=arrays[f"{prefix}_left"],
+            right=arrays[f"{prefix}_right"],
+            value=arrays[f"{prefix}_value"],
+            roots=arrays[f"{prefix}_roots"],
+            max_depth=int(arrays[f"{prefix}_max_depth"])
+        )
+
+
+class CompiledPumpModel:
+    """Classificatore + regressore compilati, con i parametri dello scaler"""
+
+    def __init__(self, classifier, regressor, labels, mean, scale):
+        self.classifier = classifier
+        self.regressor = regressor
+        self.labels = labels
+        self.mean = mean
+        self.scale = scale
+
+    @classmethod
+    def from_sklearn(cls, scaler, clf, reg, le):
+        mean, scale = _scaler_params(scaler, clf.n_features_in_)
+        return cls(
+            classifier=CompiledForest.from_sklearn(clf, classifier=True),
+            regressor=CompiledForest.from_sklearn(reg, classifier=False),
+            labels=np.asarray(le.inverse_transform(clf.classes_)).astype(str),
+            mean=mean,
+            scale=scale
+        )
+
+    def transform(self, X):
+        # Stesse operazioni di StandardScaler.transform in float64, poi il cast
+        # a float32 che sklearn applica all'input degli alberi
+        return ((X - self.mean) / self.scale).astype(np.float32)
+
+    def classify(self, X):
+        return self.labels[np.argmax(self.classifier.mean_value(self.transform(X)), axis=1)]
+
+    def regress(self, X):
+        return self.regressor.mean_value(self.transform(X))
+
+    def save(self, path):
+        arrays = {"labels": self.labels, "scaler_mean": self.mean, "scaler_scale": self.scale,
+                  **self.classifier.to_arrays("clf"), **self.regressor.to_arrays("reg")}
+        # Scrittura in una directory temporanea e rename: i reader non vedono mai un modello parziale
+        tmp_path = path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_path, f"{name}.npy"), array)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.isdir(path):
+            raise ValueError("formato obsoleto (file .npz), ricompilare")
+        arrays = {
+            name[:-len(".npy")]: np.load(os.path.join(path, name), mmap_mode='r', allow_pickle=False)
+            for name in os.listdir(path) if name.endswith(".npy")
+        }
+        if "scaler_mean" not in arrays:
+            raise ValueError("formato obsoleto (soglie con scaler incorporato), ricompilare")
+        return cls(
+            classifier=CompiledForest.from_arrays(arrays, "clf"),
+            regressor=CompiledForest.from_arrays(arrays, "reg"),
+            labels=arrays["labels"],
+            mean=arrays["scaler_mean"],
+            scale=arrays["scaler_scale"]
+        )
+
+
+def _scaler_params(scaler, n_features):
+    mean = getattr(scaler, 'mean_', None)
+    scale = getattr(scaler, 'scale_', None)
+    if mean is None or not getattr(scaler, 'with_mean', True):
+        mean = np.zeros(n_features)
+    if scale is None or not getattr(scaler, 'with_std', True):
+        scale = np.ones(n_features)
+    return np.asarray(mean, dtype=np.float64), np.asarray(scale, dtype=np.float64)
+
+
+def verification_samples(scaler, n_features, n_samples=2000, seed=42, decimals=2):
+    """
+    Campioni sintetici distribuiti come il training set (media/scala dello scaler),
+    arrotondati come la telemetria reale: i valori arrotondati cadono spesso
+    vicino alle soglie, dove un errore di arrotondamento cambia ramo.
+    """
+    mean, scale = _scaler_params(scaler, n_features)
+    rng = np.random.default_rng(seed)
+    return np.round(mean + scale * rng.normal(0, 1.5, size=(n_samples, n_features)), decimals)
+
+
+def load_or_compile(model_dir, scaler, clf, reg, le, verify_samples=2000):
+    """
+    Usa il file compilato se presente, altrimenti compila in memoria dai .pkl.
+    Il modello viene sempre confrontato con sklearn su campioni arrotondati:
+    se non è equivalente ritorna None e il predictor resta sul motore sklearn.
+    """
+    path = os.path.join(model_dir, COMPILED_FILENAME)
+    compiled = None
+    if os.path.isdir(path):
+        try:
+            compiled = CompiledPumpModel.load(path)
+            logger.info(f"⚡ Modello compilato caricato da {path}")
+        except Exception as e:
+            logger.warning(f"⚠️ Modello compilato {path} non utilizzabile ({e}): compilazione dai .pkl")
+
+    if compiled is None:
+        # Array in memoria privata del processo: per condividerli tra i worker usare scripts/compile_models.py
+        logger.info("⚡ Compilazione in memoria dai .pkl")
+        compiled = CompiledPumpModel.from_sklearn(scaler, clf, reg, le)
+
+    if verify_samples:
+        X = verification_samples(scaler, clf.n_features_in_, verify_samples)
+        report = verify_equivalence(compiled, scaler, clf, reg, le, X)
+        if not report["equivalent"]:
+            logger.error(f"❌ Modello compilato non equivalente a sklearn ({report['state_mismatches']} stati diversi, "
+                         f"errore health max {report['max_health_error']:.2e}): uso del motore sklearn")
+            return None
+    return compiled
+
+
+def verify_equivalence(compiled, scaler, clf, reg, le, X, health_tolerance=1e-6):
+    """Confronta le predizioni compilate con quelle di sklearn sugli stessi campioni"""
+    X_scaled = scaler.transform(X)
+    expected_states = le.inverse_transform(clf.predict(X_scaled)).astype(str)
+    expected_health = reg.predict(X_scaled)
+
+    states = compiled.classify(X)
+    health = compiled.regress(X)
+
+    state_mismatches = int(np.count_nonzero(states != expected_states))
+    health_error = float(np.max(np.abs(health - expected_health))) if len(X) else 0.0
+
+    return {
+        "samples": len(X),
+        "state_mismatches": state_mismatches,
+        "max_health_error": health_error,
+        "equivalent": state_mismatches == 0 and health_error <= health_tolerance,
+    }
@@ -0,0 +1,157 @@
+import os
+import csv
+import time
+import threading
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger("DeviceCSVWriter")
+
+FSYNC_POLICIES = ("never", "flush", "close")
+
+_QUOTE_CHARS = (',', '"', '\n', '\r')
+
+
+def _encode_value(value):
+    if value is None:
+        return ''
+    text = str(value)
+    if any(c in text for c in _QUOTE_CHARS):
+        text = '"' + text.replace('"', '""') + '"'
+    return text
+
+
+class _DeviceBuffer:
+    __slots__ = ("columns", "lines", "first_ts")
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.lines = []
+        self.first_ts = 0.0
+
+
+class DeviceCSVWriter:
+    """
+    Writer CSV bufferizzato per device.
+    Le righe sono codificate direttamente in testo (niente pandas) e accumulate
+    in memoria; il buffer di un device viene scritto quando supera flush_rows
+    righe o quando la riga più vecchia ha atteso flush_interval secondi.
+    I file aperti sono mantenuti in un pool LRU di max_open_files handle.
+
+    fsync_policy:
+      - never: nessun fsync, ci si affida al page cache del sistema operativo
+      - flush: fsync dopo ogni scrittura di un buffer su file
+      - close: fsync solo alla chiusura dell'handle (eviction LRU o shutdown)
+    """
+
+    def __init__(self, base_output_path, max_open_files=256, flush_rows=100,
+                 flush_interval=2.0, fsync_policy="close"):
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"Politica fsync non valida: {fsync_policy} (ammesse: {FSYNC_POLICIES})")
+
+        self.base_output_path = base_output_path
+        self.max_open_files = max(1, max_open_files)
+        self.flush_rows = max(1, flush_rows)
+        self.flush_interval = max(0.1, flush_interval)
+        self.fsync_policy = fsync_policy
+
+        self._buffers = {}
+        self._handles = OrderedDict()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+        os.makedirs(self.base_output_path, exist_ok=True)
+
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
+
+    def write(self, pump_id, data):
+        with self._lock:
+            buffer = self._buffers.get(pump_id)
+            if buffer is None:
+                buffer = self._open_buffer(pump_id, data)
+
+            if not buffer.lines:
+                buffer.first_ts = time.monotonic()
+            buffer.lines.append(','.join([_encode_value(data.get(c)) for c in buffer.columns]) + '\n')
+
+            if len(buffer.lines) >= self.flush_rows:
+                self._flush_device(pump_id, buffer)
+
+    def flush(self):
+        with self._lock:
+            for pump_id, buffer in self._buffers.items():
+                self._flush_device(pump_id, buffer)
+
+    def close(self):
+        self._stop_event.set()
+        self._flusher.join()
+        with self._lock:
+            for pump_id, buffer in self._buffers.items():
+                self._flush_device(pump_id, buffer)
+            while self._handles:
+                _, handle = self._handles.popitem(last=False)
+                self._close_handle(handle)
+
+    def _file_path(self, pump_id):
+        return os.path.join(self.base_output_path, f"{pump_id}.csv")
+
+    def _open_buffer(self, pump_id, data):
+        """Prima scrittura del device: riusa l'header del file esistente o ne scrive uno nuovo"""
+        file_path = self._file_path(pump_id)
+        columns = None
+
+        if os.path.isfile(file_path) and os.path.getsize(file_path) > 0:
+            with open(file_path, newline='', encoding='utf-8') as f:
+                columns = next(csv.reader(f), None)
+
+        buffer = _DeviceBuffer(columns or list(data.keys()))
+        if not columns:
+            buffer.lines.append(','.join([_encode_value(c) for c in buffer.columns]) + '\n')
+
+        self._buffers[pump_id] = buffer
+        return buffer
+
+    def _get_handle(self, pump_id):
+        handle = self._handles.get(pump_id)
+        if handle is not None:
+            self._handles.move_to_end(pump_id)
+            return handle
+
+        if len(self._handles) >= self.max_open_files:
+            _, evicted = self._handles.popitem(last=False)
+            self._close_handle(evicted)
+
+        handle = open(self._file_path(pump_id), 'a', newline='', encoding='utf-8')
+        self._handles[pump_id] = handle
+        return handle
+
+    def _close_handle(self, handle):
+        try:
+            handle.flush()
+            if self.fsync_policy != "never":
+                os.fsync(handle.fileno())
+        finally:
+            handle.close()
+
+    def _flush_device(self, pump_id, buffer):
+        if not buffer.lines:
+            return
+        try:
+            handle = self._get_handle(pump_id)
+            handle.write(''.join(buffer.lines))
+            handle.flush()
+            if self.fsync_policy == "flush":
+                os.fsync(handle.fileno())
+        except OSError as e:
+            logger.error(f"❌ Errore scrittura CSV per {pump_id}: {e}")
+            return
+        buffer.lines = []
+
+    def _flush_loop(self):
+        while not self._stop_event.wait(self.flush_interval / 2):
+            now = time.monotonic()
+            with self._lock:
+                for pump_id, buffer in self._buffers.items():
+                    if buffer.lines and now - buffer.first_ts >= self.flush_interval:
+                        self._flush_device(pump_id, buffer)
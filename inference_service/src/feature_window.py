@@ -0,0 +1,184 @@
+import logging
+from collections import OrderedDict
+import numpy as np
+from predictor import FEATURE_ORDER
+
+logger = logging.getLogger("FeatureWindow")
+
+INPUT_MODES = ("raw", "mean", "ewma")
+
+
+class FleetFeatureWindow:
+    """
+    Finestra mobile per device sugli 8 feature di FEATURE_ORDER, in un'unica
+    matrice NumPy per tutta la flotta: shape (max_devices, window, n_feature).
+
+    La media mobile è mantenuta in O(1) con una somma incrementale
+    (ricalcolata dal ring a ogni giro completo per evitare drift numerico),
+    l'EWMA con un solo aggiornamento per messaggio. La memoria è fissata da
+    max_devices: quando la flotta lo supera viene liberato il device inattivo
+    da più tempo (ordine LRU, eviction in O(1)).
+
+    Lo smoothing delle predizioni è disattivato di default: va abilitato
+    esplicitamente perché ritarda i cambi di stato di state_confirm messaggi.
+
+    Oltre agli input del modello (raw / mean / ewma) fornisce uno stadio di
+    smoothing delle predizioni: EWMA sulla health e conferma del cambio di stato
+    dopo state_confirm predizioni consecutive, così uno spike isolato non
+    genera un FAULTY.
+    """
+
+    def __init__(self, window=16, alpha=0.2, max_devices=10000, input_mode="raw",
+                 smoothing=False, health_alpha=0.3, state_confirm=3):
+        if input_mode not in INPUT_MODES:
+            raise ValueError(f"Modalità input non valida: {input_mode} (ammesse: {INPUT_MODES})")
+
+        n_features = len(FEATURE_ORDER)
+        self.window = max(1, window)
+        self.alpha = alpha
+        self.max_devices = max(1, max_devices)
+        self.input_mode = input_mode
+        self.smoothing = smoothing
+        self.health_alpha = health_alpha
+        self.state_confirm = max(1, state_confirm)
+
+        self._ring = np.zeros((self.max_devices, self.window, n_features))
+        self._sum = np.zeros((self.max_devices, n_features))
+        self._ewma = np.zeros((self.max_devices, n_features))
+        self._count = np.zeros(self.max_devices, dtype=np.int32)
+        self._pos = np.zeros(self.max_devices, dtype=np.int32)
+
+        # Stato dello smoothing delle predizioni (codici interi per gli stati)
+        self._health = np.full(self.max_devices, np.nan)
+        self._state = np.full(self.max_devices, -1, dtype=np.int16)
+        self._candidate = np.full(self.max_devices, -1, dtype=np.int16)
+        self._candidate_count = np.zeros(self.max_devices, dtype=np.int16)
+        self._state_codes = {}
+        self._state_labels = []
+
+        # device_id -> riga, dal meno al più recentemente aggiornato
+        self._index = OrderedDict()
+        self._free = list(range(self.max_devices - 1, -1, -1))
+
+    def _row_for(self, device_id):
+        row = self._index.get(device_id)
+        if row is not None:
+            self._index.move_to_end(device_id)
+            return row
+
+        if not self._free:
+            # Flotta oltre la capacità: si libera il device inattivo da più tempo
+            _, evicted = self._index.popitem(last=False)
+            self._free.append(evicted)
+
+        row = self._free.pop()
+        self._index[device_id] = row
+        self._sum[row] = 0.0
+        self._count[row] = 0
+        self._pos[row] = 0
+        self._health[row] = np.nan
+        self._state[row] = -1
+        self._candidate[row] = -1
+        self._candidate_count[row] = 0
+        return row
+
+    def update(self, device_id, x):
+        """Inserisce un campione e ritorna la riga del device nella matrice"""
+        row = self._row_for(device_id)
+        pos = self._pos[row]
+        count = self._count[row]
+
+        if count >= self.window:
+            old = self._ring[row, pos]
+            self._sum[row] -= old
+        else:
+            self._count[row] = count + 1
+
+        self._ring[row, pos] = x
+        self._sum[row] += x
+        self._ewma[row] = x if count == 0 else self.alpha * x + (1 - self.alpha) * self._ewma[row]
+
+        pos += 1
+        if pos == self.window:
+            pos = 0
+            # Ricalcolo esatto a ogni giro: costo O(window) ammortizzato O(1)
+            self._sum[row] = self._ring[row].sum(axis=0)
+        self._pos[row] = pos
+        return row
+
+    def mean(self, row):
+        return self._sum[row] / max(1, self._count[row])
+
+    def ewma(self, row):
+        return self._ewma[row]
+
+    def prepare_batch(self, batch):
+        """
+        Aggiorna le finestre con i campioni del batch e ritorna (input_modello, righe).
+        I payload incompleti passano invariati (il predictor li scarterà) con riga None.
+        """
+        model_inputs = []
+        rows = []
+        for data in batch:
+            try:
+                x = np.array([data[f] for f in FEATURE_ORDER], dtype=float)
+                valid = np.isfinite(x).all()
+            except (KeyError, TypeError, ValueError):
+                valid = False
+            if not valid:
+                # Non entra nella finestra (non la inquina)
+                model_inputs.append(data)
+                rows.append(None)
+                continue
+
+            row = self.update(data.get('device_id', 'unknown_device'), x)
+            rows.append(row)
+
+            if self.input_mode == "raw":
+                model_inputs.append(data)
+            else:
+                smoothed = self.mean(row) if self.input_mode == "mean" else self.ewma(row)
+                model_inputs.append(dict(zip(FEATURE_ORDER, smoothed.tolist())))
+
+        return model_inputs, rows
+
+    def smooth_batch(self, rows, predictions):
+        if not self.smoothing:
+            return predictions
+        return [
+            self.smooth_prediction(row, prediction) if prediction and row is not None else prediction
+            for row, prediction in zip(rows, predictions)
+        ]
+
+    def smooth_prediction(self, row, prediction):
+        code = self._state_codes.get(prediction['state'])
+        if code is None:
+            code = self._state_codes[prediction['state']] = len(self._state_labels)
+            self._state_labels.append(prediction['state'])
+
+        # Health: EWMA per device
+        health = prediction['health']
+        previous = self._health[row]
+        if not np.isnan(previous):
+            health = self.health_alpha * health + (1 - self.health_alpha) * previous
+        self._health[row] = health
+
+        # Stato: il cambio viene accettato dopo state_confirm predizioni consecutive
+        current = self._state[row]
+        if current == -1 or code == current:
+            self._state[row] = code
+            self._candidate_count[row] = 0
+        else:
+            if code == self._candidate[row]:
+                self._candidate_count[row] += 1
+            else:
+                self._candidate[row] = code
+                self._candidate_count[row] = 1
+            if self._candidate_count[row] >= self.state_confirm:
+                self._state[row] = code
+                self._candidate_count[row] = 0
+
+        return {
+            "state": self._state_labels[self._state[row]],
+            "health": round(float(health), 2)
+        }
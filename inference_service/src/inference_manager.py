@@ -1,28 +1,94 @@
-import os
-import pandas as pd
+import time
+import threading
 import json
 from datetime import datetime
 import logging
+from csv_writer import DeviceCSVWriter
+from metrics import REGISTRY
 
 logger = logging.getLogger("InferenceManager")
 
 class InferenceManager:
-    def __init__(self, predictor, base_output_path, mqtt_client=None):
+    def __init__(self, predictor, base_output_path, mqtt_client=None, batch_size=1, batch_window_ms=0, writer=None, feature_window=None, publish_policy=None):
         self.predictor = predictor
         self.base_output_path = base_output_path
         self.mqtt_client = mqtt_client
+        self.writer = writer or DeviceCSVWriter(base_output_path)
+        self.feature_window = feature_window
+        self.publish_policy = publish_policy
         self.message_counter = 0  # Counter per gestire la frequenza dei log
-        
-        if not os.path.exists(self.base_output_path):
-            os.makedirs(self.base_output_path)
+
+        # Micro-batching: il batch viene svuotato a batch_size messaggi
+        # oppure quando il più vecchio ha atteso batch_window_ms
+        self.batch_size = max(1, batch_size)
+        self.batch_window = batch_window_ms / 1000.0
+        self._pending = []
+        self._batch_started = 0.0
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._flusher = None
+
+        if self.batch_size > 1 and self.batch_window > 0:
+            self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+            self._flusher.start()
 
     def process_data(self, data):
+        """Accoda un messaggio; l'inferenza parte quando il batch è pieno o scaduto"""
+        with self._lock:
+            if not self._pending:
+                self._batch_started = time.monotonic()
+            self._pending.append(data)
+
+            if len(self._pending) >= self.batch_size:
+                self._flush_pending()
+
+    def flush(self):
+        with self._lock:
+            self._flush_pending()
+
+    def close(self):
+        self._stop_event.set()
+        if self._flusher:
+            self._flusher.join()
+        self.flush()
+        self.writer.close()
+
+    def _flush_loop(self):
+        while not self._stop_event.wait(self.batch_window / 2):
+            with self._lock:
+                if self._pending and time.monotonic() - self._batch_started >= self.batch_window:
+                    self._flush_pending()
+
+    def _flush_pending(self):
+        if not self._pending:
+            return
+        batch = self._pending
+        self._pending = []
+        self._process_batch(batch)
+
+    def _process_batch(self, batch):
+        # Esecuzione Inferenza (una sola passata vettoriale per tutto il batch)
+        try:
+            if self.feature_window:
+                t0 = time.perf_counter()
+                model_inputs, rows = self.feature_window.prepare_batch(batch)
+                REGISTRY.observe("window", time.perf_counter() - t0)
+                predictions = self.predictor.predict_batch(model_inputs)
+                predictions = self.feature_window.smooth_batch(rows, predictions)
+            else:
+                predictions = self.predictor.predict_batch(batch)
+        except Exception as e:
+            logger.error(f"❌ Errore inferenza batch ({len(batch)} messaggi): {e}")
+            return
+
+        for data, prediction in zip(batch, predictions):
+            self._handle_prediction(data, prediction)
+
+    def _handle_prediction(self, data, prediction):
         self.message_counter += 1
+        REGISTRY.inc("messages")
         pump_id = data.get('device_id', 'unknown_device')
         
-        # Esecuzione Inferenza
-        prediction = self.predictor.predict(data)
-        
         if prediction:
             data['state'] = prediction['state']
             data['health_percent'] = prediction['health']
@@ -34,22 +100,27 @@ class InferenceManager:
         data['inference_timestamp'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
         current_state = data['state']
+        REGISTRY.inc("predictions", state=current_state)
         
         if current_state != "HEALTHY":
             logger.warning(f"🚨 CRITICAL: [{pump_id}] State: {current_state} | Health: {data['health_percent']}%")
         
         elif self.message_counter % 50 == 0:
             logger.info(f"✅ Healthy Stream: Processate {self.message_counter} inferenze. Last: [{pump_id}] at {data['health_percent']}%")
+            if self.publish_policy:
+                logger.info(f"📤 Publish: {self.publish_policy.published} inviate | {self.publish_policy.suppressed} soppresse")
 
         
-        self._save_to_device_csv(pump_id, data)
+        t0 = time.perf_counter()
+        self.writer.write(pump_id, data)
+        t1 = time.perf_counter()
+        REGISTRY.observe("persist", t1 - t0)
 
         if self.mqtt_client:
+            if self.publish_policy and not self.publish_policy.should_publish(pump_id, current_state, data['health_percent']):
+                REGISTRY.inc("publish_suppressed")
+                return
             output_topic = f"factory/pumps/{pump_id}/predictions"
             self.mqtt_client.publish(output_topic, json.dumps(data))
-
-    def _save_to_device_csv(self, pump_id, data):
-        file_path = os.path.join(self.base_output_path, f"{pump_id}.csv")
-        df = pd.DataFrame([data])
-        file_exists = os.path.isfile(file_path)
-        df.to_csv(file_path, mode='a', index=False, header=not file_exists)
\ No newline at end of file
+            REGISTRY.observe("publish", time.perf_counter() - t1)
+            REGISTRY.inc("published")
@@ -1,8 +1,18 @@
 import os
+import signal
 import logging
-from mqtt_fetcher import MQTTPumpFetcher
+from functools import partial
+from mqtt_fetcher import MQTTPumpFetcher, create_publisher
 from predictor import PumpPredictor
+from model_registry import ModelWatcher
 from inference_manager import InferenceManager
+from csv_writer import DeviceCSVWriter
+from prediction_archive import PredictionArchiveWriter
+from worker_pool import ShardedWorkerPool
+from feature_window import FleetFeatureWindow
+from publish_policy import PublishPolicy
+from metrics import start_metrics
+from prediction_cache import PredictionCache
 import warnings
 
 warnings.filterwarnings("ignore", category=UserWarning)
@@ -10,36 +20,195 @@ warnings.filterwarnings("ignore", category=UserWarning)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("Main")
 
+def load_config():
+    return {
+        "broker": os.getenv("MQTT_BROKER", "mosquitto"),
+        "port": int(os.getenv("MQTT_PORT", 1883)),
+        "input_topic": os.getenv("MQTT_INPUT_TOPIC", "factory/pumps/+/telemetry"),
+        "model_dir": os.getenv("MODEL_DIR", "/app/models"),
+        # Engine di inferenza: "sklearn" oppure "compiled" (array NumPy piatti)
+        "predictor_engine": os.getenv("PREDICTOR_ENGINE", "sklearn"),
+        # Hot-reload: intervallo di controllo di MODEL_DIR/versions (0 = disattivato)
+        "model_watch_interval": float(os.getenv("MODEL_WATCH_INTERVAL", 30.0)),
+        "output_dir": os.getenv("OUTPUT_DATA_DIR", "/app/data/predictions"),
+
+        # Micro-batching: flush a N messaggi oppure dopo T millisecondi
+        "batch_size": int(os.getenv("INFERENCE_BATCH_SIZE", 64)),
+        "batch_window_ms": int(os.getenv("INFERENCE_BATCH_WINDOW_MS", 20)),
+
+        # Cache LRU delle predizioni su input quantizzati (0 voci = disattivata).
+        # Quanto: un valore unico oppure 8 valori separati da virgola (FEATURE_ORDER)
+        "cache_size": int(os.getenv("PREDICTION_CACHE_SIZE", 0)),
+        "cache_quantum": [float(q) for q in os.getenv("PREDICTION_CACHE_QUANTUM", "0.01").split(",")],
+
+        # Finestra mobile per device (0 = disattivata; usata solo con input mean/ewma
+        # o con lo smoothing delle predizioni) e smoothing delle predizioni
+        "window_size": int(os.getenv("FEATURE_WINDOW_SIZE", 16)),
+        "window_alpha": float(os.getenv("FEATURE_WINDOW_ALPHA", 0.2)),
+        "window_max_devices": int(os.getenv("FEATURE_WINDOW_MAX_DEVICES", 10000)),
+        "window_input": os.getenv("FEATURE_WINDOW_INPUT", "raw"),
+        "prediction_smoothing": os.getenv("PREDICTION_SMOOTHING", "false").lower() == "true",
+        "health_smoothing_alpha": float(os.getenv("HEALTH_SMOOTHING_ALPHA", 0.3)),
+        "state_confirm": int(os.getenv("STATE_CONFIRM_MESSAGES", 3)),
+
+        # Report-by-exception (PUBLISH_MODE=exception): publish su cambio stato, deadband health
+        # o heartbeat. Default "always": ogni predizione viene pubblicata come in origine
+        "publish_mode": os.getenv("PUBLISH_MODE", "always"),
+        "publish_health_deadband": float(os.getenv("PUBLISH_HEALTH_DEADBAND", 1.0)),
+        "publish_heartbeat": float(os.getenv("PUBLISH_HEARTBEAT_INTERVAL", 60.0)),
+        "publish_max_devices": int(os.getenv("PUBLISH_MAX_DEVICES", 10000)),
+
+        # Storage delle predizioni: "csv" (file per device) o "arrow" (archivio colonnare)
+        "storage_mode": os.getenv("OUTPUT_STORAGE_MODE", "csv"),
+
+        # Writer CSV bufferizzato per device
+        "csv_max_open_files": int(os.getenv("CSV_MAX_OPEN_FILES", 256)),
+        "csv_flush_rows": int(os.getenv("CSV_FLUSH_ROWS", 100)),
+        "csv_flush_interval": float(os.getenv("CSV_FLUSH_INTERVAL", 2.0)),
+        "csv_fsync_policy": os.getenv("CSV_FSYNC_POLICY", "close"),
+
+        # Archivio Arrow: rotazione segmenti, compattazione e retention
+        "archive_dir": os.getenv("ARCHIVE_DATA_DIR", "/app/data/archive"),
+        "archive_segment_rows": int(os.getenv("ARCHIVE_SEGMENT_ROWS", 5000)),
+        "archive_segment_interval": float(os.getenv("ARCHIVE_SEGMENT_INTERVAL", 60.0)),
+        "archive_compaction_interval": float(os.getenv("ARCHIVE_COMPACTION_INTERVAL", 300.0)),
+        "archive_retention_hours": int(os.getenv("ARCHIVE_RETENTION_HOURS", 168)),
+
+        # Endpoint metriche Prometheus (0 = disattivato); i worker usano le porte successive
+        "metrics_port": int(os.getenv("METRICS_PORT", 9100)),
+        "profile_hz": int(os.getenv("METRICS_PROFILE_HZ", 0)),
+
+        # Worker pool (0 = inferenza inline nel thread MQTT)
+        "workers": int(os.getenv("INFERENCE_WORKERS", 1)),
+        "start_method": os.getenv("INFERENCE_START_METHOD", "spawn"),
+        "queue_size": int(os.getenv("INFERENCE_QUEUE_SIZE", 1000)),
+        "overflow_policy": os.getenv("INFERENCE_OVERFLOW_POLICY", "block"),
+        "block_timeout": float(os.getenv("INFERENCE_BLOCK_TIMEOUT", 5.0)),
+        "stats_interval": int(os.getenv("INFERENCE_STATS_INTERVAL", 30)),
+    }
+
+def create_writer(config, maintenance=True):
+    if config["storage_mode"] == "arrow":
+        return PredictionArchiveWriter(
+            config["archive_dir"],
+            segment_rows=config["archive_segment_rows"],
+            segment_interval=config["archive_segment_interval"],
+            compaction_interval=config["archive_compaction_interval"],
+            retention_hours=config["archive_retention_hours"],
+            maintenance=maintenance
+        )
+    if config["storage_mode"] != "csv":
+        raise ValueError(f"OUTPUT_STORAGE_MODE non valido: {config['storage_mode']} (ammessi: csv, arrow)")
+    return DeviceCSVWriter(
+        config["output_dir"],
+        max_open_files=config["csv_max_open_files"],
+        flush_rows=config["csv_flush_rows"],
+        flush_interval=config["csv_flush_interval"],
+        fsync_policy=config["csv_fsync_policy"]
+    )
+
+def create_manager(config, mqtt_client, archive_maintenance=True):
+    cache = None
+    if config["cache_size"] > 0:
+        quantum = config["cache_quantum"]
+        cache = PredictionCache(config["cache_size"], quantum[0] if len(quantum) == 1 else quantum)
+
+    predictor = PumpPredictor(config["model_dir"], engine=config["predictor_engine"], cache=cache)
+    if config["model_watch_interval"] > 0:
+        ModelWatcher(predictor, config["model_dir"], interval=config["model_watch_interval"]).start()
+    writer = create_writer(config, maintenance=archive_maintenance)
+
+    # Con input raw e smoothing disattivato la finestra non verrebbe mai letta
+    feature_window = None
+    window_needed = config["window_input"] != "raw" or config["prediction_smoothing"]
+    if config["window_size"] > 0 and window_needed:
+        feature_window = FleetFeatureWindow(
+            window=config["window_size"],
+            alpha=config["window_alpha"],
+            max_devices=config["window_max_devices"],
+            input_mode=config["window_input"],
+            smoothing=config["prediction_smoothing"],
+            health_alpha=config["health_smoothing_alpha"],
+            state_confirm=config["state_confirm"]
+        )
+
+    publish_policy = PublishPolicy(
+        mode=config["publish_mode"],
+        health_deadband=config["publish_health_deadband"],
+        heartbeat_interval=config["publish_heartbeat"],
+        max_devices=config["publish_max_devices"]
+    )
+
+    return InferenceManager(
+        predictor=predictor, 
+        base_output_path=config["output_dir"], 
+        mqtt_client=mqtt_client,
+        batch_size=config["batch_size"],
+        batch_window_ms=config["batch_window_ms"],
+        writer=writer,
+        feature_window=feature_window,
+        publish_policy=publish_policy
+    )
+
+def create_worker_manager(worker_index, config):
+    """Factory eseguita dentro ogni processo worker: modelli e client MQTT propri"""
+    publisher = create_publisher(config["broker"], config["port"])
+    # Compattazione e retention dell'archivio condiviso: solo il primo worker
+    return create_manager(config, publisher, archive_maintenance=worker_index == 0)
+
+def start_worker_metrics(worker_index, config):
+    if config["metrics_port"] > 0:
+        start_metrics(config["metrics_port"] + 1 + worker_index, config["profile_hz"])
+
 def main():
     logger.info("🚀 Avvio Inference Service (Scaling Mode - 100+ Devices)")
 
-    broker = os.getenv("MQTT_BROKER", "mosquitto")
-    port = int(os.getenv("MQTT_PORT", 1883))
-        
-    input_topic = os.getenv("MQTT_INPUT_TOPIC", "factory/pumps/+/telemetry")
-    
-    model_dir = os.getenv("MODEL_DIR", "/app/models")
-    
-    output_dir = os.getenv("OUTPUT_DATA_DIR", "/app/data/predictions")
-
+    config = load_config()
 
     try:
-        predictor = PumpPredictor(model_dir)
-        fetcher = MQTTPumpFetcher(broker, port, input_topic)
-        
-        manager = InferenceManager(
-            predictor=predictor, 
-            base_output_path=output_dir, 
-            mqtt_client=fetcher.client
-        )
-        
-        logger.info(f"📡 In ascolto su: {input_topic}")
-        logger.info(f"📂 Salvataggio stream dati in: {output_dir}")
-   
-        fetcher.start(callback_function=manager.process_data)
+        if config["metrics_port"] > 0:
+            start_metrics(config["metrics_port"], config["profile_hz"])
+
+        fetcher = MQTTPumpFetcher(config["broker"], config["port"], config["input_topic"])
+
+        # SIGTERM (docker stop, kubernetes): si ferma il loop MQTT e il finally
+        # chiude pool e manager, che svuotano i buffer su disco
+        def on_sigterm(signum, frame):
+            logger.info("🛑 SIGTERM ricevuto, arresto in corso...")
+            fetcher.stop()
+        signal.signal(signal.SIGTERM, on_sigterm)
+
+        logger.info(f"📡 In ascolto su: {config['input_topic']}")
+        if config["storage_mode"] == "arrow":
+            logger.info(f"🗄️ Archivio colonnare predizioni in: {config['archive_dir']}")
+        else:
+            logger.info(f"📂 Salvataggio stream dati in: {config['output_dir']}")
+        logger.info(f"📦 Micro-batching: {config['batch_size']} messaggi / {config['batch_window_ms']} ms")
+
+        if config["workers"] > 0:
+            pool = ShardedWorkerPool(
+                manager_factory=partial(create_worker_manager, config=config),
+                num_workers=config["workers"],
+                queue_size=config["queue_size"],
+                overflow_policy=config["overflow_policy"],
+                block_timeout=config["block_timeout"],
+                stats_interval=config["stats_interval"],
+                metrics_starter=partial(start_worker_metrics, config=config),
+                start_method=config["start_method"]
+            )
+            pool.start()
+            fetcher.start(callback_function=pool.submit_message, raw=True)
+        else:
+            manager = create_manager(config, fetcher.client)
+            fetcher.start(callback_function=manager.process_data)
         
     except Exception as e:
         logger.error(f"❌ Errore fatale durante l'avvio: {e}")
+    finally:
+        if 'pool' in locals():
+            pool.close()
+        if 'manager' in locals():
+            manager.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
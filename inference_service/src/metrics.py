@@ -0,0 +1,195 @@
+import sys
+import time
+import bisect
+import threading
+import logging
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger("Metrics")
+
+# Bucket in secondi: da 10µs a 1s, adatti sia al path compilato che a sklearn
+STAGE_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0
+)
+
+
+class _Histogram:
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self, n_buckets):
+        self.counts = [0] * (n_buckets + 1)
+        self.total = 0.0
+        self.count = 0
+
+
+class MetricsRegistry:
+    """
+    Registry minimale in formato Prometheus: istogrammi di latenza per stage,
+    counter con label e gauge calcolati al momento dello scrape.
+    Ogni processo (main e worker) ha il proprio registry.
+    """
+
+    def __init__(self, prefix="inference", buckets=STAGE_BUCKETS):
+        self.prefix = prefix
+        self.buckets = buckets
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            hist = self._histograms.get(stage)
+            if hist is None:
+                hist = self._histograms[stage] = _Histogram(len(self.buckets))
+            hist.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            hist.total += seconds
+            hist.count += 1
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def register_gauge(self, name, fn, help_text=""):
+        self._gauges[name] = (fn, help_text)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+            self._gauges.clear()
+
+    def render(self):
+        lines = []
+        name = f"{self.prefix}_stage_seconds"
+        with self._lock:
+            histograms = {stage: (list(h.counts), h.total, h.count) for stage, h in self._histograms.items()}
+            counters = dict(self._counters)
+
+        if histograms:
+            lines.append(f"# HELP {name} Latenza per stage del path di inferenza")
+            lines.append(f"# TYPE {name} histogram")
+            for stage, (counts, total, count) in sorted(histograms.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {count}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {total}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {count}')
+
+        typed = set()
+        for (counter, labels), value in sorted(counters.items()):
+            metric = f"{self.prefix}_{counter}_total"
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} counter")
+                typed.add(metric)
+            label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+            lines.append(f"{metric}{{{label_text}}} {value}" if label_text else f"{metric} {value}")
+
+        for gauge, (fn, help_text) in sorted(self._gauges.items()):
+            metric = f"{self.prefix}_{gauge}"
+            try:
+                value = fn()
+            except Exception as e:
+                logger.error(f"⚠️ Errore lettura gauge {gauge}: {e}")
+                continue
+            if help_text:
+                lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+class SamplingProfiler:
+    """
+    Profiler a campionamento: a hz campioni/s registra il frame in esecuzione
+    di ogni thread (escluso se stesso). Overhead trascurabile, nessuna
+    instrumentazione del codice.
+    """
+
+    def __init__(self, hz=100):
+        self.interval = 1.0 / max(1, hz)
+        self.samples = Counter()
+        self.total = 0
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        logger.info(f"🔬 Profiler a campionamento attivo ({1 / self.interval:.0f} Hz)")
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                code = frame.f_code
+                self.samples[f"{code.co_filename}:{code.co_name}:{frame.f_lineno}"] += 1
+                self.total += 1
+
+    def render(self, top=50):
+        lines = [f"# {self.total} campioni"]
+        for location, count in self.samples.most_common(top):
+            lines.append(f"{count:8d} {100.0 * count / max(1, self.total):6.2f}% {location}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """Endpoint HTTP: /metrics (Prometheus text) e /profile (se il profiler è attivo)"""
+
+    def __init__(self, port, registry=REGISTRY, profiler=None, host="0.0.0.0"):
+        registry_ref = registry
+        profiler_ref = profiler
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body = registry_ref.render()
+                elif self.path == "/profile" and profiler_ref:
+                    body = profiler_ref.render()
+                else:
+                    self.send_error(404)
+                    return
+                data = body.encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.port = port
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        logger.info(f"📈 Endpoint metriche su :{self.port}/metrics")
+
+    def stop(self):
+        self._server.shutdown()
+
+
+def start_metrics(port, profile_hz=0):
+    profiler = None
+    if profile_hz > 0:
+        profiler = SamplingProfiler(profile_hz)
+        profiler.start()
+    server = MetricsServer(port, profiler=profiler)
+    server.start()
+    return server
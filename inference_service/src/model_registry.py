@@ -0,0 +1,99 @@
+import os
+import re
+import threading
+import logging
+
+logger = logging.getLogger("ModelRegistry")
+
+VERSIONS_DIRNAME = "versions"
+CURRENT_FILENAME = "CURRENT"
+LEGACY_VERSION = "legacy"
+
+MODEL_FILES = (
+    'scaler_v2.pkl', 'classifier_state_v2.pkl',
+    'regressor_health_v2.pkl', 'label_encoder_v2.pkl'
+)
+
+
+def _natural_key(name):
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', name)]
+
+
+def list_versions(model_dir):
+    """Versioni complete (tutti i .pkl presenti) in ordine crescente"""
+    versions_dir = os.path.join(model_dir, VERSIONS_DIRNAME)
+    if not os.path.isdir(versions_dir):
+        return []
+    return sorted(
+        (name for name in os.listdir(versions_dir)
+         if all(os.path.isfile(os.path.join(versions_dir, name, f)) for f in MODEL_FILES)),
+        key=_natural_key
+    )
+
+
+def older_versions(model_dir, version):
+    """Versioni precedenti a `version`, dalla più recente alla più vecchia"""
+    if version == LEGACY_VERSION:
+        return []
+    key = _natural_key(version)
+    return [v for v in reversed(list_versions(model_dir)) if _natural_key(v) < key]
+
+
+def resolve_version(model_dir):
+    """
+    Ritorna (versione, cartella) da caricare:
+      1. la versione indicata nel file MODEL_DIR/CURRENT, se presente
+      2. altrimenti l'ultima versione sotto MODEL_DIR/versions/
+      3. altrimenti il layout legacy con i .pkl direttamente in MODEL_DIR
+    """
+    current_path = os.path.join(model_dir, CURRENT_FILENAME)
+    if os.path.isfile(current_path):
+        with open(current_path) as f:
+            pinned = f.read().strip()
+        if pinned:
+            return pinned, os.path.join(model_dir, VERSIONS_DIRNAME, pinned)
+
+    versions = list_versions(model_dir)
+    if versions:
+        return versions[-1], os.path.join(model_dir, VERSIONS_DIRNAME, versions[-1])
+
+    return LEGACY_VERSION, model_dir
+
+
+class ModelWatcher:
+    """
+    Controlla periodicamente il registry e, quando compare una nuova versione,
+    chiede al predictor di caricarla in background. Le versioni che falliscono
+    il caricamento o lo smoke test non vengono ritentate.
+    """
+
+    def __init__(self, predictor, model_dir, interval=30.0):
+        self.predictor = predictor
+        self.model_dir = model_dir
+        self.interval = interval
+        self._failed = set()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        logger.info(f"👀 Watcher modelli attivo su {self.model_dir} (ogni {self.interval}s)")
+
+    def stop(self):
+        self._stop_event.set()
+
+    def check(self):
+        version, path = resolve_version(self.model_dir)
+        if version == self.predictor.version or version in self._failed:
+            return False
+        if not self.predictor.reload(version, path):
+            self._failed.add(version)
+            return False
+        return True
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"❌ Errore controllo registry modelli: {e}")
@@ -1,6 +1,8 @@
 import json
+import time
 import logging
 from paho.mqtt import client as mqtt_client
+from metrics import REGISTRY
 
 logger = logging.getLogger("InferenceFetcher")
 
@@ -23,19 +25,41 @@ class MQTTPumpFetcher:
         client.on_connect = on_connect
         return client
 
-    def start(self, callback_function):
+    def start(self, callback_function, raw=False):
         """
         Avvia l'ascolto. Ogni volta che arriva un messaggio, 
         chiama la callback_function passata come argomento.
+        Con raw=True la callback riceve (topic, payload) senza decodifica JSON,
+        così il thread di rete resta libero (la decodifica avviene nei worker).
         """
+        def on_raw_message(client, userdata, msg):
+            try:
+                callback_function(msg.topic, msg.payload)
+            except Exception as e:
+                logger.error(f"⚠️ Errore inoltro messaggio: {e}")
+
         def on_message(client, userdata, msg):
             try:
+                t0 = time.perf_counter()
                 payload = json.loads(msg.payload.decode())
+                REGISTRY.observe("decode", time.perf_counter() - t0)
                 # Passiamo il dato decodificato alla funzione che farà l'inferenza
                 callback_function(payload)
             except Exception as e:
                 logger.error(f"⚠️ Errore decodifica JSON: {e}")
 
-        self.client.on_message = on_message
+        self.client.on_message = on_raw_message if raw else on_message
         self.client.connect(self.broker, self.port)
-        self.client.loop_forever()
\ No newline at end of file
+        self.client.loop_forever()
+
+    def stop(self):
+        """Interrompe loop_forever: start() ritorna dopo la disconnessione"""
+        self.client.disconnect()
+
+
+def create_publisher(broker, port):
+    """Client MQTT di sola pubblicazione, usato dai processi worker"""
+    client = mqtt_client.Client()
+    client.connect(broker, port)
+    client.loop_start()
+    return client
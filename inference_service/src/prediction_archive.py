@@ -0,0 +1,316 @@
+import os
+import time
+import shutil
+import threading
+import logging
+from datetime import datetime, timezone, timedelta
+import pyarrow as pa
+import pyarrow.compute as pc
+from metrics import REGISTRY
+
+logger = logging.getLogger("PredictionArchive")
+
+ARCHIVE_SCHEMA = pa.schema([
+    ("timestamp", pa.timestamp("ms", tz="UTC")),
+    ("device_id", pa.string()),
+    ("measurement_id", pa.int64()),
+    ("current", pa.float64()),
+    ("pressure", pa.float64()),
+    ("rpm", pa.int64()),
+    ("temperature", pa.float64()),
+    ("vibration_rms", pa.float64()),
+    ("vibration_x", pa.float64()),
+    ("vibration_y", pa.float64()),
+    ("vibration_z", pa.float64()),
+    ("state", pa.string()),
+    ("health_percent", pa.float64()),
+    ("last_maintenance", pa.string()),
+])
+
+_PAYLOAD_COLUMNS = [f.name for f in ARCHIVE_SCHEMA if f.name != "timestamp"]
+
+_INT64_MIN, _INT64_MAX = -2 ** 63, 2 ** 63 - 1
+
+
+def _to_int64(value):
+    value = int(value)
+    if not _INT64_MIN <= value <= _INT64_MAX:
+        raise OverflowError(f"{value} fuori dal range int64")
+    return value
+
+
+def _converter(arrow_type):
+    if pa.types.is_integer(arrow_type):
+        return _to_int64
+    if pa.types.is_floating(arrow_type):
+        return float
+    return str
+
+
+# Conversione per colonna verso il tipo dello schema (None resta null)
+_CONVERTERS = [(name, _converter(ARCHIVE_SCHEMA.field(name).type)) for name in _PAYLOAD_COLUMNS]
+
+
+def _coerce_row(data):
+    """Valori della riga nei tipi dello schema; solleva se un campo non è convertibile"""
+    return [None if data.get(name) is None else convert(data.get(name)) for name, convert in _CONVERTERS]
+
+HOUR_FORMAT = "%Y%m%d%H"
+
+
+def _hour_key(ts):
+    return datetime.fromtimestamp(ts, tz=timezone.utc).strftime(HOUR_FORMAT)
+
+
+def _partition_dir(base_path, hour, pump_id):
+    return os.path.join(base_path, f"hour={hour}", f"device_id={pump_id}")
+
+
+def _list_segments(partition_dir):
+    try:
+        return sorted(
+            os.path.join(partition_dir, name)
+            for name in os.listdir(partition_dir)
+            if name.endswith(".arrow")
+        )
+    except FileNotFoundError:
+        return []
+
+
+def _write_table(path, table):
+    """Scrittura atomica: i reader non vedono mai un segmento parziale"""
+    tmp_path = path + ".tmp"
+    with pa.OSFile(tmp_path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+
+def _read_segment(path):
+    # Arrow IPC non compresso: le colonne puntano direttamente alla memoria mappata
+    return pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+
+
+class _SegmentBuffer:
+    __slots__ = ("columns", "rows", "opened_at")
+
+    def __init__(self):
+        self.columns = {name: [] for name in ARCHIVE_SCHEMA.names}
+        self.rows = 0
+        self.opened_at = time.monotonic()
+
+
+class PredictionArchiveWriter:
+    """
+    Archivio colonnare delle predizioni in segmenti Arrow IPC,
+    partizionati per ora (UTC) e device:  {base}/hour=YYYYMMDDHH/device_id={id}/seg-*.arrow
+
+    Un segmento viene chiuso a segment_rows righe, dopo segment_interval secondi
+    o al cambio d'ora. In background le ore chiuse vengono compattate in un unico
+    segmento per device e le ore più vecchie di retention_hours vengono rimosse.
+    Con più processi sullo stesso archivio la manutenzione va attivata su uno solo
+    (maintenance=True): la compattazione visita i device presenti su disco, inclusi
+    quelli scritti prima di un riavvio o da altri worker.
+    Espone la stessa interfaccia di DeviceCSVWriter (write / flush / close).
+    """
+
+    def __init__(self, base_path, segment_rows=5000, segment_interval=60.0,
+                 compaction_interval=300.0, retention_hours=168, maintenance=True):
+        self.base_path = base_path
+        self.segment_rows = max(1, segment_rows)
+        self.segment_interval = max(1.0, segment_interval)
+        self.compaction_interval = max(1.0, compaction_interval)
+        self.retention_hours = retention_hours
+
+        self._buffers = {}
+        self.dropped_rows = 0
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+        os.makedirs(self.base_path, exist_ok=True)
+
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
+        self._compactor = None
+        if maintenance:
+            self._compactor = threading.Thread(target=self._compaction_loop, daemon=True)
+            self._compactor.start()
+
+    def write(self, pump_id, data):
+        # Una riga con un campo non convertibile viene scartata da sola:
+        # altrimenti farebbe fallire la scrittura dell'intero segmento
+        try:
+            values = _coerce_row(data)
+        except (TypeError, ValueError, OverflowError) as e:
+            self.dropped_rows += 1
+            REGISTRY.inc("archive_rows_dropped")
+            logger.warning(f"⚠️ Riga di {pump_id} scartata dall'archivio: {e}")
+            return
+
+        now = time.time()
+        key = (_hour_key(now), pump_id)
+
+        with self._lock:
+            buffer = self._buffers.get(key)
+            if buffer is None:
+                # Cambio d'ora: i segmenti dell'ora precedente vengono chiusi subito
+                for old_key in [k for k in self._buffers if k[1] == pump_id]:
+                    self._close_segment(old_key, self._buffers.pop(old_key))
+                buffer = self._buffers[key] = _SegmentBuffer()
+
+            columns = buffer.columns
+            columns["timestamp"].append(int(now * 1000))
+            for name, value in zip(_PAYLOAD_COLUMNS, values):
+                columns[name].append(value)
+            buffer.rows += 1
+
+            if buffer.rows >= self.segment_rows:
+                self._close_segment(key, self._buffers.pop(key))
+
+    def flush(self):
+        with self._lock:
+            for key in list(self._buffers):
+                self._close_segment(key, self._buffers.pop(key))
+
+    def close(self):
+        self._stop_event.set()
+        self._flusher.join()
+        if self._compactor:
+            self._compactor.join()
+        self.flush()
+
+    def _close_segment(self, key, buffer):
+        if not buffer.rows:
+            return
+        hour, pump_id = key
+        partition_dir = _partition_dir(self.base_path, hour, pump_id)
+        try:
+            table = pa.Table.from_pydict(buffer.columns, schema=ARCHIVE_SCHEMA)
+            os.makedirs(partition_dir, exist_ok=True)
+            _write_table(os.path.join(partition_dir, f"seg-{time.time_ns()}-{os.getpid()}.arrow"), table)
+        except Exception as e:
+            logger.error(f"❌ Errore scrittura segmento {hour}/{pump_id}: {e}")
+
+    def _flush_loop(self):
+        while not self._stop_event.wait(self.segment_interval / 2):
+            now = time.monotonic()
+            with self._lock:
+                for key in [k for k, b in self._buffers.items() if now - b.opened_at >= self.segment_interval]:
+                    self._close_segment(key, self._buffers.pop(key))
+
+    def _compaction_loop(self):
+        while not self._stop_event.wait(self.compaction_interval):
+            try:
+                self.apply_retention()
+                self.compact_closed_hours()
+            except Exception as e:
+                logger.error(f"❌ Errore manutenzione archivio: {e}")
+
+    def compact_closed_hours(self):
+        """Unisce i segmenti di ogni ora chiusa in un unico file per device"""
+        current_hour = _hour_key(time.time())
+        with self._lock:
+            open_keys = set(self._buffers)
+
+        compacted = 0
+        for hour in self._list_hours():
+            if hour >= current_hour:
+                continue
+            hour_dir = os.path.join(self.base_path, f"hour={hour}")
+            try:
+                device_dirs = sorted(d for d in os.listdir(hour_dir) if d.startswith("device_id="))
+            except FileNotFoundError:
+                continue
+            for device_dir in device_dirs:
+                pump_id = device_dir.split("=", 1)[1]
+                if (hour, pump_id) in open_keys:
+                    continue
+                # Un segmento tardivo di un altro processo scritto durante la
+                # compattazione resta un file a sé e viene unito al giro successivo
+                segments = _list_segments(os.path.join(hour_dir, device_dir))
+                if len(segments) < 2:
+                    continue
+                table = pa.concat_tables([_read_segment(path) for path in segments])
+                target = os.path.join(os.path.dirname(segments[0]), f"compact-{time.time_ns()}-{os.getpid()}.arrow")
+                _write_table(target, table.combine_chunks())
+                for path in segments:
+                    os.remove(path)
+                compacted += 1
+
+        if compacted:
+            logger.info(f"🗜️ Compattate {compacted} partizioni dell'archivio")
+
+    def apply_retention(self):
+        if not self.retention_hours:
+            return
+        cutoff = (datetime.now(timezone.utc) - timedelta(hours=self.retention_hours)).strftime(HOUR_FORMAT)
+        for hour in self._list_hours():
+            if hour < cutoff:
+                shutil.rmtree(os.path.join(self.base_path, f"hour={hour}"), ignore_errors=True)
+                logger.info(f"🧹 Rimossa partizione scaduta hour={hour}")
+
+    def _list_hours(self):
+        return sorted(
+            name.split("=", 1)[1]
+            for name in os.listdir(self.base_path)
+            if name.startswith("hour=")
+        )
+
+
+class PredictionArchiveReader:
+    """
+    Lettura dell'archivio con memory-mapping dei segmenti (scan zero-copy).
+    Il pruning avviene sulle partizioni (ora, device) prima di aprire i file.
+    """
+
+    def __init__(self, base_path):
+        self.base_path = base_path
+
+    def iter_segments(self, device_id=None, start=None, end=None, columns=None):
+        """Genera una tabella Arrow per segmento, senza materializzare tutto l'archivio"""
+        start_hour = start.astimezone(timezone.utc).strftime(HOUR_FORMAT) if start else None
+        end_hour = end.astimezone(timezone.utc).strftime(HOUR_FORMAT) if end else None
+
+        if not os.path.isdir(self.base_path):
+            return
+
+        for hour_name in sorted(os.listdir(self.base_path)):
+            if not hour_name.startswith("hour="):
+                continue
+            hour = hour_name.split("=", 1)[1]
+            if (start_hour and hour < start_hour) or (end_hour and hour > end_hour):
+                continue
+
+            hour_dir = os.path.join(self.base_path, hour_name)
+            device_dirs = [f"device_id={device_id}"] if device_id else sorted(os.listdir(hour_dir))
+            for device_dir in device_dirs:
+                for path in _list_segments(os.path.join(hour_dir, device_dir)):
+                    try:
+                        table = _read_segment(path)
+                    except (FileNotFoundError, pa.ArrowInvalid):
+                        # Segmento rimosso da compattazione/retention durante la scansione
+                        continue
+                    if start or end:
+                        table = table.filter(self._time_mask(table, start, end))
+                    if columns:
+                        table = table.select(columns)
+                    if table.num_rows:
+                        yield table
+
+    def scan(self, device_id=None, start=None, end=None, columns=None):
+        tables = list(self.iter_segments(device_id, start, end, columns))
+        if not tables:
+            schema = pa.schema([ARCHIVE_SCHEMA.field(c) for c in columns]) if columns else ARCHIVE_SCHEMA
+            return schema.empty_table()
+        return pa.concat_tables(tables)
+
+    @staticmethod
+    def _time_mask(table, start, end):
+        ts = table.column("timestamp")
+        mask = None
+        if start:
+            mask = pc.greater_equal(ts, pa.scalar(start, type=ts.type))
+        if end:
+            upper = pc.less(ts, pa.scalar(end, type=ts.type))
+            mask = upper if mask is None else pc.and_(mask, upper)
+        return mask
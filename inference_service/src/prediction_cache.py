@@ -0,0 +1,64 @@
+import threading
+from collections import OrderedDict
+
+
+class PredictionCache:
+    """
+    Cache LRU limitata delle predizioni, con chiave il vettore degli 8 feature
+    quantizzato: valori entro lo stesso quanto condividono la stessa predizione.
+    quantum può essere uno scalare o una sequenza con un quanto per feature
+    (in FEATURE_ORDER). Va svuotata a ogni cambio di modello.
+    """
+
+    def __init__(self, max_entries=50000, quantum=0.01):
+        self.max_entries = max(1, max_entries)
+        if isinstance(quantum, (int, float)):
+            self._scale = None
+            self._inv_quantum = 1.0 / quantum
+        else:
+            self._scale = tuple(1.0 / q for q in quantum)
+            self._inv_quantum = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, row):
+        if self._scale is None:
+            inv = self._inv_quantum
+            return tuple([round(v * inv) for v in row])
+        return tuple([round(v * s) for v, s in zip(row, self._scale)])
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, generation=None):
+        with self._lock:
+            # Predizioni calcolate prima di un clear() (modello sostituito) vengono ignorate
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
@@ -1,46 +1,203 @@
 import joblib
 import numpy as np
 import os
+import math
+import time
 import logging
+from compiled_forest import load_or_compile
+from model_registry import resolve_version, older_versions, VERSIONS_DIRNAME
+from metrics import REGISTRY
 
 logger = logging.getLogger("Predictor")
 
+FEATURE_ORDER = [
+    'current', 'pressure', 'rpm', 'temperature',
+    'vibration_rms', 'vibration_x', 'vibration_y', 'vibration_z'
+]
+
+ENGINES = ("sklearn", "compiled")
+
+class ModelBundle:
+    """Set completo di modelli di una versione: viene sostituito in blocco al reload"""
+
+    def __init__(self, version, path, engine):
+        # Gli alberi sklearn vengono copiati in buffer privati (Tree.__setstate__):
+        # ogni worker ne ha una copia. Solo il motore compilato, con gli array
+        # .npy in memory-map, condivide le pagine tra i processi
+        self.version = version
+        self.scaler = joblib.load(os.path.join(path, 'scaler_v2.pkl'))
+        self.clf = joblib.load(os.path.join(path, 'classifier_state_v2.pkl'))
+        self.reg = joblib.load(os.path.join(path, 'regressor_health_v2.pkl')) # Carichiamo il regressore
+        self.le = joblib.load(os.path.join(path, 'label_encoder_v2.pkl'))
+        self.compiled = None
+
+        if engine == "compiled":
+            self.compiled = load_or_compile(path, self.scaler, self.clf, self.reg, self.le)
+            if self.compiled is not None:
+                # Verificato: le foreste sklearn non servono più e la loro memoria viene liberata
+                self.clf = self.reg = None
+
+    def smoke_test(self):
+        """Predizione su un campione medio: verifica che la versione sia utilizzabile"""
+        mean = getattr(self.scaler, 'mean_', None)
+        X = np.zeros((1, len(FEATURE_ORDER))) if mean is None else np.asarray(mean).reshape(1, -1)
+        states, health = self.predict(X)
+        if len(states) != 1 or not np.isfinite(health).all():
+            raise ValueError("output non valido sul campione di prova")
+
+    def predict(self, X):
+        t0 = time.perf_counter()
+        if self.compiled is not None:
+            # Fast path: scaling e discesa vettoriali, nessuna validazione sklearn
+            X_scaled = X
+            state_labels = self.compiled.classify(X)
+        else:
+            X_scaled = self.scaler.transform(X)
+            t1 = time.perf_counter()
+            REGISTRY.observe("scale", t1 - t0)
+            t0 = t1
+
+            # 1. Predizione dello STATO (Classificazione)
+            state_labels = self.le.inverse_transform(self.clf.predict(X_scaled))
+
+        t1 = time.perf_counter()
+        REGISTRY.observe("classify", t1 - t0)
+
+        # 2. Predizione della SALUTE (Regressione)
+        if self.compiled is not None:
+            health = self.compiled.regress(X)
+        else:
+            health = self.reg.predict(X_scaled)
+        REGISTRY.observe("regress", time.perf_counter() - t1)
+        return state_labels, health
+
+
 class PumpPredictor:
-    def __init__(self, model_dir):
+    def __init__(self, model_dir, engine="sklearn", cache=None):
+        if engine not in ENGINES:
+            raise ValueError(f"Engine non valido: {engine} (ammessi: {ENGINES})")
+        self.model_dir = model_dir
+        self.engine = engine
+        self.cache = cache
+
+        if self.cache is not None:
+            REGISTRY.register_gauge("prediction_cache_entries", lambda: len(self.cache),
+                                    "Voci nella cache delle predizioni")
+            REGISTRY.register_gauge("prediction_cache_hit_rate", lambda: self.cache.hit_rate,
+                                    "Hit rate della cache delle predizioni")
+
+        version, path = resolve_version(model_dir)
+        # All'avvio, se la versione scelta è rotta si ripiega sulle precedenti
+        # (mai su versioni più recenti di quella fissata in CURRENT)
+        candidates = [(version, path)] + [
+            (v, os.path.join(model_dir, VERSIONS_DIRNAME, v))
+            for v in older_versions(model_dir, version)
+        ]
+
+        for i, (version, path) in enumerate(candidates):
+            try:
+                self._bundle = ModelBundle(version, path, engine)
+                self._bundle.smoke_test()
+                logger.info(f"🧠 Modelli ML (Classificatore + Regressore) caricati correttamente. Versione: {version}")
+                break
+            except Exception as e:
+                if i == len(candidates) - 1:
+                    logger.critical(f"💀 Impossibile caricare i modelli: {e}")
+                    raise
+                logger.error(f"❌ Versione {version} non caricabile, provo la precedente: {e}")
+
+    @property
+    def version(self):
+        return self._bundle.version
+
+    def reload(self, version, path):
+        """
+        Carica e riscalda una nuova versione in background; lo swap è atomico
+        (una sola assegnazione di riferimento). Se il caricamento o lo smoke test
+        falliscono resta attiva la versione corrente.
+        """
+        logger.info(f"🔄 Nuova versione modelli rilevata: {version}, caricamento in corso...")
         try:
-            self.scaler = joblib.load(os.path.join(model_dir, 'scaler_v2.pkl'))
-            self.clf = joblib.load(os.path.join(model_dir, 'classifier_state_v2.pkl'))
-            self.reg = joblib.load(os.path.join(model_dir, 'regressor_health_v2.pkl')) # Carichiamo il regressore
-            self.le = joblib.load(os.path.join(model_dir, 'label_encoder_v2.pkl'))
-            logger.info("🧠 Modelli ML (Classificatore + Regressore) caricati correttamente.")
+            bundle = ModelBundle(version, path, self.engine)
+            bundle.smoke_test()
         except Exception as e:
-            logger.critical(f"💀 Impossibile caricare i modelli: {e}")
-            raise
+            logger.error(f"❌ Caricamento versione {version} fallito, rollback su {self.version}: {e}")
+            return False
+
+        previous = self.version
+        self._bundle = bundle
+        if self.cache is not None:
+            # Le predizioni in cache appartengono al modello precedente
+            self.cache.clear()
+        logger.info(f"✅ Modelli aggiornati: {previous} → {version}")
+        return True
 
     def predict(self, data):
-        feature_order = [
-            'current', 'pressure', 'rpm', 'temperature', 
-            'vibration_rms', 'vibration_x', 'vibration_y', 'vibration_z'
-        ]
-        
-        try:
-            input_data = [data[f] for f in feature_order]
-            X = np.array(input_data).reshape(1, -1)
-            X_scaled = self.scaler.transform(X)
-            
-            # 1. Predizione dello STATO (Classificazione)
-            class_idx = self.clf.predict(X_scaled)[0]
-            state_label = self.le.inverse_transform([class_idx])[0]
-            
-            # 2. Predizione della SALUTE (Regressione)
-            predicted_health = float(self.reg.predict(X_scaled)[0])
-            predicted_health = max(0, min(100, predicted_health))
-            
-            return {
-                "state": state_label,
-                "health": round(predicted_health, 2)
+        return self.predict_batch([data])[0]
+
+    def predict_batch(self, batch):
+        """
+        Esegue l'inferenza su una lista di payload con un'unica passata vettoriale
+        (scaler, classificatore, label encoder e regressore chiamati una sola volta).
+        Ritorna una lista allineata all'input: None per i payload incompleti o non validi.
+        """
+        t0 = time.perf_counter()
+        results = [None] * len(batch)
+        rows = []
+        positions = []
+        keys = []
+        cache = self.cache
+        generation = cache.generation if cache is not None else None
+        # Snapshot del bundle: un reload concorrente non cambia i modelli a metà batch
+        bundle = self._bundle
+
+        for i, data in enumerate(batch):
+            # Validazione per riga: un payload non valido non fa cadere il resto del batch
+            try:
+                row = [float(data[f]) for f in FEATURE_ORDER]
+            except KeyError as e:
+                logger.error(f"❌ Dato mancante nel JSON MQTT: {e}")
+                REGISTRY.inc("skipped_missing_fields")
+                continue
+            except (TypeError, ValueError) as e:
+                logger.error(f"❌ Dato non numerico nel JSON MQTT: {e}")
+                REGISTRY.inc("skipped_invalid_fields")
+                continue
+            if not all(map(math.isfinite, row)):
+                logger.error(f"❌ Valore non finito nel JSON MQTT: {row}")
+                REGISTRY.inc("skipped_invalid_fields")
+                continue
+
+            if cache is not None:
+                key = cache.key(row)
+                cached = cache.get(key)
+                if cached is not None:
+                    results[i] = {"state": cached[0], "health": cached[1]}
+                    REGISTRY.inc("prediction_cache", result="hit")
+                    continue
+                REGISTRY.inc("prediction_cache", result="miss")
+                keys.append(key)
+
+            rows.append(row)
+            positions.append(i)
+
+        if not rows:
+            return results
+
+        X = np.array(rows, dtype=float)
+        REGISTRY.observe("features", time.perf_counter() - t0)
+
+        state_labels, predicted_health = bundle.predict(X)
+        predicted_health = np.clip(predicted_health, 0, 100)
+
+        for pos, state_label, health in zip(positions, state_labels, predicted_health):
+            results[pos] = {
+                "state": str(state_label),
+                "health": round(float(health), 2)
             }
-            
-        except KeyError as e:
-            logger.error(f"❌ Dato mancante nel JSON MQTT: {e}")
-            return None
\ No newline at end of file
+
+        if cache is not None:
+            for pos, key in zip(positions, keys):
+                cache.put(key, (results[pos]["state"], results[pos]["health"]), generation)
+
+        return results
@@ -0,0 +1,68 @@
+import time
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger("PublishPolicy")
+
+PUBLISH_MODES = ("always", "exception")
+
+
+class _PublishedState:
+    __slots__ = ("state", "health", "published_at")
+
+    def __init__(self, state, health, published_at):
+        self.state = state
+        self.health = health
+        self.published_at = published_at
+
+
+class PublishPolicy:
+    """
+    Report-by-exception sulle predizioni pubblicate via MQTT.
+    In modalità "exception" una predizione viene pubblicata solo se:
+      - lo stato è cambiato rispetto all'ultimo pubblicato
+      - la health si è spostata oltre health_deadband punti percentuali
+      - è trascorso heartbeat_interval secondi dall'ultima pubblicazione
+    In modalità "always" (default) tutte le predizioni vengono pubblicate.
+
+    L'ultimo stato pubblicato è tenuto per al più max_devices device in ordine
+    LRU: un device rimosso pubblica di nuovo alla predizione successiva.
+    """
+
+    def __init__(self, mode="always", health_deadband=1.0, heartbeat_interval=60.0, max_devices=10000):
+        if mode not in PUBLISH_MODES:
+            raise ValueError(f"Modalità publish non valida: {mode} (ammesse: {PUBLISH_MODES})")
+        self.mode = mode
+        self.health_deadband = health_deadband
+        self.heartbeat_interval = heartbeat_interval
+        self.max_devices = max(1, max_devices)
+        # device_id -> ultimo stato pubblicato, dal meno al più recentemente aggiornato
+        self._last = OrderedDict()
+        self.published = 0
+        self.suppressed = 0
+
+    def should_publish(self, device_id, state, health, now=None):
+        if self.mode == "always":
+            self.published += 1
+            return True
+
+        now = time.monotonic() if now is None else now
+        last = self._last.get(device_id)
+
+        if last is None:
+            if len(self._last) >= self.max_devices:
+                self._last.popitem(last=False)
+            self._last[device_id] = _PublishedState(state, health, now)
+        elif (state != last.state
+              or abs(health - last.health) > self.health_deadband
+              or now - last.published_at >= self.heartbeat_interval):
+            last.state = state
+            last.health = health
+            last.published_at = now
+            self._last.move_to_end(device_id)
+        else:
+            self.suppressed += 1
+            return False
+
+        self.published += 1
+        return True
@@ -0,0 +1,209 @@
+import json
+import time
+import queue
+import signal
+import logging
+import threading
+import zlib
+import multiprocessing as mp
+from metrics import REGISTRY
+
+logger = logging.getLogger("WorkerPool")
+
+OVERFLOW_POLICIES = ("block", "drop_new", "drop_oldest")
+START_METHODS = ("spawn", "forkserver", "fork")
+
+
+def _worker_main(index, work_queue, manager_factory, metrics_starter=None):
+    """Loop del processo worker: decodifica, inferenza, persistenza e publish"""
+    # Lo shutdown è gestito dal processo principale tramite sentinel; un SIGTERM
+    # diretto al worker (es. kill del process group) svuota la coda e chiude i writer
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+
+    # Con fork il worker eredita i gauge delle code del processo principale
+    REGISTRY.reset()
+    worker_logger = logging.getLogger(f"Worker-{index}")
+    if metrics_starter:
+        metrics_starter(index)
+    manager = manager_factory(index)
+    worker_logger.info(f"⚙️ Worker {index} avviato (pid {mp.current_process().pid})")
+
+    try:
+        while True:
+            try:
+                item = work_queue.get(timeout=0.5)
+            except queue.Empty:
+                if stopping.is_set():
+                    break
+                continue
+            if item is None:
+                break
+
+            try:
+                t0 = time.perf_counter()
+                data = json.loads(item)
+                REGISTRY.observe("decode", time.perf_counter() - t0)
+            except Exception as e:
+                worker_logger.error(f"⚠️ Errore decodifica JSON: {e}")
+                continue
+
+            try:
+                manager.process_data(data)
+            except Exception as e:
+                worker_logger.error(f"❌ Errore elaborazione messaggio: {e}")
+    finally:
+        manager.close()
+        if manager.mqtt_client:
+            manager.mqtt_client.disconnect()
+            manager.mqtt_client.loop_stop()
+        worker_logger.info(f"🛑 Worker {index} terminato")
+
+
+class ShardedWorkerPool:
+    """
+    Pool di processi worker alimentato da code limitate, una per shard.
+    Ogni messaggio è assegnato allo shard in base al device, così l'ordine
+    dei messaggi di una singola pompa è preservato.
+
+    Politiche di overflow quando la coda dello shard è piena:
+      - block:       attende fino a block_timeout (backpressure sul loop MQTT), poi scarta
+      - drop_new:    scarta il messaggio in arrivo
+      - drop_oldest: scarta il messaggio più vecchio in coda e accoda il nuovo
+
+    I worker sono avviati con "spawn" (default): il monitor li riavvia da un
+    thread, e un fork da un processo multi-thread può ereditare lock acquisiti.
+    """
+
+    def __init__(self, manager_factory, num_workers, queue_size=1000,
+                 overflow_policy="block", block_timeout=5.0, stats_interval=30, metrics_starter=None,
+                 start_method="spawn"):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Politica di overflow non valida: {overflow_policy} (ammesse: {OVERFLOW_POLICIES})")
+        if start_method not in START_METHODS:
+            raise ValueError(f"Start method non valido: {start_method} (ammessi: {START_METHODS})")
+
+        self.manager_factory = manager_factory
+        self.num_workers = max(1, num_workers)
+        self.queue_size = queue_size
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+        self.stats_interval = stats_interval
+        self.metrics_starter = metrics_starter
+        self._context = mp.get_context(start_method)
+
+        self._queues = [self._context.Queue(maxsize=queue_size) for _ in range(self.num_workers)]
+        self._workers = [None] * self.num_workers
+        self._submitted = [0] * self.num_workers
+        self._dropped = [0] * self.num_workers
+        self._stop_event = threading.Event()
+        self._monitor = None
+
+        REGISTRY.register_gauge("queue_depth", lambda: sum(d for d in self.queue_depths() if d > 0),
+                                "Messaggi in attesa nelle code dei worker")
+        REGISTRY.register_gauge("queue_dropped", lambda: sum(self._dropped),
+                                "Messaggi scartati per overflow delle code")
+        REGISTRY.register_gauge("queue_submitted", lambda: sum(self._submitted),
+                                "Messaggi accodati ai worker")
+
+    def start(self):
+        for index in range(self.num_workers):
+            self._start_worker(index)
+
+        self._monitor = threading.Thread(target=self._monitor_loop, daemon=True)
+        self._monitor.start()
+        logger.info(f"🏭 Avviati {self.num_workers} worker (coda {self.queue_size}/shard, overflow: {self.overflow_policy})")
+
+    def _start_worker(self, index):
+        worker = self._context.Process(
+            target=_worker_main,
+            args=(index, self._queues[index], self.manager_factory, self.metrics_starter),
+            name=f"inference-worker-{index}",
+            daemon=True
+        )
+        worker.start()
+        self._workers[index] = worker
+
+    def shard_for(self, key):
+        return zlib.crc32(key.encode()) % self.num_workers
+
+    def submit(self, key, payload):
+        """
+        Accoda il payload grezzo (bytes) sullo shard del device.
+        Ritorna False se il messaggio è stato scartato per overflow.
+        """
+        index = self.shard_for(key)
+        work_queue = self._queues[index]
+
+        try:
+            if self.overflow_policy == "block":
+                work_queue.put(payload, timeout=self.block_timeout)
+            elif self.overflow_policy == "drop_new":
+                work_queue.put_nowait(payload)
+            else:
+                try:
+                    work_queue.put_nowait(payload)
+                except queue.Full:
+                    try:
+                        work_queue.get_nowait()
+                        self._dropped[index] += 1
+                    except queue.Empty:
+                        pass
+                    work_queue.put_nowait(payload)
+        except queue.Full:
+            self._dropped[index] += 1
+            return False
+
+        self._submitted[index] += 1
+        return True
+
+    def submit_message(self, topic, payload):
+        # Il topic contiene il device_id (factory/pumps/{id}/telemetry):
+        # lo usiamo come chiave di sharding senza decodificare il JSON nel thread di rete
+        return self.submit(topic, payload)
+
+    def queue_depths(self):
+        depths = []
+        for work_queue in self._queues:
+            try:
+                depths.append(work_queue.qsize())
+            except NotImplementedError:
+                depths.append(-1)
+        return depths
+
+    def stats(self):
+        depths = self.queue_depths()
+        return {
+            "workers": self.num_workers,
+            "alive": sum(1 for w in self._workers if w and w.is_alive()),
+            "queue_depth": sum(d for d in depths if d > 0),
+            "queue_depth_per_shard": depths,
+            "submitted": sum(self._submitted),
+            "dropped": sum(self._dropped),
+        }
+
+    def _monitor_loop(self):
+        while not self._stop_event.wait(self.stats_interval):
+            for index, worker in enumerate(self._workers):
+                if worker and not worker.is_alive():
+                    logger.error(f"💀 Worker {index} terminato inaspettatamente (exit {worker.exitcode}), riavvio...")
+                    self._start_worker(index)
+
+            s = self.stats()
+            level = logging.WARNING if s["queue_depth"] > 0.8 * self.queue_size * self.num_workers else logging.INFO
+            logger.log(level, f"📊 Queue: {s['queue_depth']} {s['queue_depth_per_shard']} | "
+                              f"Submitted: {s['submitted']} | Dropped: {s['dropped']} | Workers: {s['alive']}/{s['workers']}")
+
+    def close(self, timeout=10.0):
+        self._stop_event.set()
+        for work_queue in self._queues:
+            try:
+                work_queue.put(None, timeout=timeout)
+            except queue.Full:
+                pass
+        for worker in self._workers:
+            if worker:
+                worker.join(timeout)
+                if worker.is_alive():
+                    worker.terminate()
@@ -0,0 +1,58 @@
+import os
+import sys
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
+from sklearn.preprocessing import LabelEncoder, StandardScaler
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from compiled_forest import COMPILED_FILENAME, CompiledPumpModel, load_or_compile, verification_samples, verify_equivalence
+
+STATES = ["HEALTHY", "WARNING", "FAULTY", "BROKEN"]
+
+
+def _fit_models(seed=0):
+    # Dati arrotondati come la telemetria: molte soglie cadono a metà tra due valori
+    rng = np.random.default_rng(seed)
+    X = np.round(rng.normal([5.0, 3.0, 1450.0, 60.0, 2.0, 1.2, 1.2, 1.2], [1.0, 0.5, 40.0, 8.0, 0.8, 0.5, 0.5, 0.5],
+                            size=(2000, 8)), 2)
+    le = LabelEncoder().fit(STATES)
+    y_state = le.transform(np.array(STATES)[np.digitize(X[:, 4], [1.5, 2.5, 3.2])])
+    y_health = np.clip(100 - 12 * X[:, 4] - 0.3 * (X[:, 3] - 60), 0, 100)
+
+    scaler = StandardScaler().fit(X)
+    X_scaled = scaler.transform(X)
+    clf = RandomForestClassifier(n_estimators=15, max_depth=8, random_state=seed).fit(X_scaled, y_state)
+    reg = RandomForestRegressor(n_estimators=15, max_depth=8, random_state=seed).fit(X_scaled, y_health)
+    return X, scaler, clf, reg, le
+
+
+def test_compiled_matches_sklearn_on_training_and_rounded_samples():
+    X, scaler, clf, reg, le = _fit_models()
+    compiled = CompiledPumpModel.from_sklearn(scaler, clf, reg, le)
+
+    for samples in (X, verification_samples(scaler, X.shape[1], 5000)):
+        X_scaled = scaler.transform(samples)
+        expected_states = le.inverse_transform(clf.predict(X_scaled)).astype(str)
+        np.testing.assert_array_equal(compiled.classify(samples), expected_states)
+        np.testing.assert_allclose(compiled.regress(samples), reg.predict(X_scaled), rtol=0, atol=1e-9)
+
+
+def test_save_load_roundtrip_and_verified_loading(tmp_path):
+    X, scaler, clf, reg, le = _fit_models(seed=1)
+    CompiledPumpModel.from_sklearn(scaler, clf, reg, le).save(os.path.join(tmp_path, COMPILED_FILENAME))
+
+    compiled = load_or_compile(str(tmp_path), scaler, clf, reg, le)
+    assert compiled is not None
+    # Array aperti in memory-map: le pagine sono condivise tra i worker
+    assert isinstance(compiled.classifier.threshold, np.memmap)
+    assert verify_equivalence(compiled, scaler, clf, reg, le, X)["equivalent"]
+
+
+def test_load_or_compile_rejects_non_equivalent_file(tmp_path):
+    X, scaler, clf, reg, le = _fit_models(seed=2)
+    compiled = CompiledPumpModel.from_sklearn(scaler, clf, reg, le)
+    compiled.regressor.value = compiled.regressor.value + 1.0
+    compiled.save(os.path.join(tmp_path, COMPILED_FILENAME))
+
+    assert load_or_compile(str(tmp_path), scaler, clf, reg, le) is None
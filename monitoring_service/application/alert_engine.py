@@ -0,0 +1,139 @@
+import json
+import logging
+import threading
+from itertools import islice
+from collections import deque
+
+# Stati critici in ordine di gravità
+SEVERITY = {"WARNING": 1, "FAULTY": 2, "BROKEN": 3}
+
+
+class _DeviceAlert:
+    __slots__ = ("active", "severity", "pending_since", "last_event")
+
+    def __init__(self):
+        self.active = False
+        self.severity = None
+        # Istante da cui la condizione di ingresso/uscita è verificata senza interruzioni
+        self.pending_since = None
+        self.last_event = None
+
+
+class AlertEngine:
+    """
+    Motore di allarmi per device con isteresi, tempo minimo di permanenza e
+    rate limiting. Un allarme si apre quando la pompa è in uno stato critico o
+    la health scende sotto enter_health, e si chiude solo quando lo stato non
+    è più critico e la health risale sopra exit_health; entrambe le condizioni
+    devono persistere per dwell_seconds. Tra due eventi dello stesso device
+    passano almeno min_interval secondi. Vengono emesse solo le transizioni
+    (raised, escalated, cleared): il costo è proporzionale ai cambi di stato,
+    non alla frequenza dei messaggi.
+    """
+
+    def __init__(self, enter_health=60.0, exit_health=70.0, dwell_seconds=30, min_interval=60,
+                 max_events=1000, log_path=None):
+        if exit_health < enter_health:
+            raise ValueError("exit_health deve essere >= enter_health")
+        self.enter_health = enter_health
+        self.exit_health = exit_health
+        self.dwell_seconds = dwell_seconds
+        self.min_interval = min_interval
+        self._devices = {}
+        self._events = deque(maxlen=max_events)
+        self._seq = 0
+        self._lock = threading.Lock()
+
+        # Alert log dedicato (JSON lines), separato dal log applicativo
+        self.alert_log = None
+        if log_path:
+            self.alert_log = logging.getLogger("alerts")
+            self.alert_log.propagate = False
+            self.alert_log.setLevel(logging.INFO)
+            handler = logging.FileHandler(log_path)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self.alert_log.addHandler(handler)
+
+    def _severity(self, record):
+        state = record.get("state", "UNKNOWN")
+        if state in SEVERITY:
+            return state
+        health = record.get("health_score")
+        if health is not None and health < self.enter_health:
+            return "WARNING"
+        return None
+
+    def evaluate(self, record: dict):
+        """Aggiorna lo stato di allarme del device; ritorna l'evento emesso o None"""
+        device_id = record["device_id"]
+        now = record["_time"].timestamp()
+        alert = self._devices.get(device_id)
+        if alert is None:
+            alert = self._devices[device_id] = _DeviceAlert()
+
+        severity = self._severity(record)
+        if alert.active:
+            health = record.get("health_score")
+            clearing = severity is None and (health is None or health >= self.exit_health)
+            escalating = severity is not None and SEVERITY[severity] > SEVERITY[alert.severity]
+            if escalating:
+                # Peggioramento: nessuna attesa, solo rate limiting
+                return self._transition(alert, record, now, "escalated", severity)
+            if not clearing:
+                alert.pending_since = None
+                return None
+            event_type = "cleared"
+        else:
+            if severity is None:
+                alert.pending_since = None
+                return None
+            event_type = "raised"
+
+        if alert.pending_since is None:
+            alert.pending_since = now
+        if now - alert.pending_since < self.dwell_seconds:
+            return None
+        return self._transition(alert, record, now, event_type, severity)
+
+    def _transition(self, alert, record, now, event_type, severity):
+        if alert.last_event is not None and now - alert.last_event < self.min_interval:
+            # Rate limit: la transizione resta in attesa e viene rivalutata al prossimo messaggio
+            return None
+
+        alert.active = event_type != "cleared"
+        alert.severity = severity
+        alert.pending_since = None
+        alert.last_event = now
+
+        with self._lock:
+            self._seq += 1
+            event = {
+                "id": self._seq,
+                "type": event_type,
+                "device_id": record["device_id"],
+                "state": record.get("state", "UNKNOWN"),
+                "severity": severity,
+                "health_score": record.get("health_score"),
+                "vibration_rms": record.get("vibration_rms"),
+                "temperature": record.get("temperature"),
+                "time": record["_time"].isoformat(),
+            }
+            self._events.append(event)
+
+        if self.alert_log:
+            self.alert_log.info(json.dumps(event))
+        return event
+
+    def events(self, since=0, limit=100):
+        """Eventi con id > since, dal più vecchio; (ultimo id, eventi)"""
+        with self._lock:
+            last_id = self._seq
+            if since >= last_id:
+                return last_id, []
+            # Gli id sono consecutivi: si salta direttamente alla posizione richiesta
+            skip = max(0, len(self._events) - (last_id - since))
+            selected = list(islice(self._events, skip, skip + limit))
+        return last_id, selected
+
+    def active(self):
+        return {d: a.severity for d, a in list(self._devices.items()) if a.active}
@@ -1,47 +1,127 @@
+import time
 import logging
+from application.fleet_state import FleetStateTable, record_from_payload, validate_query
+from application.fleet_broadcaster import FleetBroadcaster
+from application.alert_engine import AlertEngine
 
 class CoreManager:
-    def __init__(self, data_manager, log_interval=50):
+    def __init__(self, data_manager, log_interval=50, fleet_state=None, broadcaster=None, warm_retry_interval=30,
+                 rollup_manager=None, alert_engine=None):
         self.data_manager = data_manager
         self.logger = logging.getLogger(__name__)
         self.message_count = 0
         self.log_interval = log_interval
+        # Snapshot in memoria della flotta: le API non interrogano più InfluxDB
+        self.fleet_state = fleet_state if fleet_state is not None else FleetStateTable()
+        # Push delle variazioni verso le dashboard in streaming
+        self.broadcaster = broadcaster or FleetBroadcaster()
+        if self.fleet_state.on_expire is None:
+            self.fleet_state.on_expire = self.broadcaster.publish_removal
+        # Rollup incrementali 1m/1h calcolati dallo stream (opzionali)
+        self.rollup_manager = rollup_manager
+        # Allarmi con isteresi e rate limiting: solo eventi di transizione
+        self.alert_engine = alert_engine or AlertEngine()
+        self._warm = False
+        self._warm_retry_interval = warm_retry_interval
+        self._next_warm_attempt = 0.0
+
+    def warm_up(self):
+        """Caricamento iniziale (una sola volta) dell'ultimo stato noto da InfluxDB"""
+        try:
+            loaded = self.fleet_state.load(self.data_manager.get_latest_pumps_data())
+            self._warm = True
+            self.logger.info(f"🔥 Warm-up completato: {loaded} pompe caricate da InfluxDB")
+        except Exception as e:
+            self.logger.warning(f"⚠️ Warm-up da InfluxDB fallito, lo snapshot verrà popolato dallo stream: {e}")
+
+    async def ensure_warm(self):
+        """
+        Ritenta il warm-up dalle API se all'avvio InfluxDB non era raggiungibile.
+        Richieste concorrenti condividono la stessa query (single-flight).
+        """
+        if self._warm or time.monotonic() < self._next_warm_attempt:
+            return
+        try:
+            loaded = self.fleet_state.load(await self.data_manager.get_latest_pumps_data_async())
+            self._warm = True
+            self.logger.info(f"🔥 Warm-up completato: {loaded} pompe caricate da InfluxDB")
+        except Exception as e:
+            self._next_warm_attempt = time.monotonic() + self._warm_retry_interval
+            self.logger.warning(f"⚠️ Warm-up da InfluxDB non riuscito: {e}")
 
     def process_message(self, raw_payload):
         try:
             # Salvataggio dati su InfluxDB
             self.data_manager.save_prediction(raw_payload)
+            record = record_from_payload(raw_payload)
+            self.fleet_state.upsert(record)
+            self.broadcaster.publish(record)
+            if self.rollup_manager:
+                self.rollup_manager.add(record)
             self.message_count += 1
 
-            state = raw_payload.get("state", "UNKNOWN")
-            pump_id = raw_payload.get("device_id", "unknown")
-            
-            
-            if state in ["WARNING", "BROKEN", "FAULTY"]:
-                health = raw_payload.get('health_percent', 0)
-               
+            event = self.alert_engine.evaluate(record)
+            if event and event["type"] != "cleared":
                 self.logger.warning(
-                    f"🚨 ALERT: {pump_id} is {state}! Health: {health}% | "
-                    f"Vib: {raw_payload.get('vibration_rms')} | Temp: {raw_payload.get('temperature')}°C"
+                    f"🚨 ALERT {event['type']}: {event['device_id']} is {event['state']}! "
+                    f"Health: {event['health_score']}% | Vib: {event['vibration_rms']} | Temp: {event['temperature']}°C"
                 )
-            
-            elif self.message_count % self.log_interval == 0:
+            elif event:
+                self.logger.info(f"✅ ALERT cleared: {event['device_id']} is {event['state']} (Health: {event['health_score']}%)")
+
+            if self.message_count % self.log_interval == 0:
                 # Log di riepilogo ogni X messaggi per evitare spam
-                self.logger.info(f"📊 Monitoring Active: Processed {self.message_count} messages. Last: {pump_id} is {state}")
+                self.logger.info(
+                    f"📊 Monitoring Active: Processed {self.message_count} messages. "
+                    f"Last: {record['device_id']} is {record['state']}"
+                )
 
         except Exception as e:
             self.logger.error(f"❌ Error processing message: {e}")
 
     def get_all_pumps_status(self):
-        """Recupera lo stato più recente di tutte le pompe da InfluxDB"""
-        return self.data_manager.get_latest_pumps_data()
+        """Stato più recente di tutte le pompe (snapshot in memoria)"""
+        return self.fleet_state.all()
 
     def get_pumps_by_state(self, state: str):
-        """Filtra le pompe per stato"""
-        all_pumps = self.data_manager.get_latest_pumps_data()
-        return [p for p in all_pumps if p.get("state", "").upper() == state.upper()]
+        """Filtra le pompe per stato tramite l'indice secondario"""
+        return self.fleet_state.by_state(state)
+
+    def get_fleet_snapshot(self, *states):
+        """(versione flotta, pompe) per le risposte condizionali delle API"""
+        return self.fleet_state.snapshot(*states)
+
+    def get_fleet_version(self):
+        """Versione corrente della flotta (per le risposte 304 senza query)"""
+        return self.fleet_state.current_version()
+
+    def get_fleet_summary(self, top_k=None):
+        """(versione, aggregati incrementali della flotta): nessuna scansione delle pompe"""
+        return self.fleet_state.summary(top_k)
+
+    def get_alert_events(self, since=0, limit=100):
+        """(ultimo id, eventi di transizione successivi a since)"""
+        return self.alert_engine.events(since, limit)
+
+    def get_active_alerts(self):
+        return self.alert_engine.active()
+
+    def get_write_stats(self):
+        """Contatori dello scrittore delle predizioni (accodate, scritte, ritentate, scartate)"""
+        return self.data_manager.write_stats()
+
+    def validate_pump_query(self, sort, cursor=None):
+        """Solleva ValueError per ordinamento o cursore non validi (prima della risposta 304)"""
+        validate_query(sort, cursor)
+
+    def query_pumps(self, **kwargs):
+        """Filtro, ordinamento, paginazione e proiezione eseguiti sullo snapshot"""
+        return self.fleet_state.query(**kwargs)
+
+    async def get_pump_history(self, device_id: str, start, stop, points: int):
+        """Storico downsampled di una pompa (query InfluxDB non bloccante)"""
+        return await self.data_manager.get_pump_history_async(device_id, start, stop, points)
 
     def get_pump_details(self, device_id: str):
-        """Recupera i dettagli di una singola pompa"""
-        all_pumps = self.data_manager.get_latest_pumps_data()
-        return next((p for p in all_pumps if p.get("device_id") == device_id), None)
\ No newline at end of file
+        """Recupera i dettagli di una singola pompa (lookup O(1))"""
+        return self.fleet_state.get(device_id)
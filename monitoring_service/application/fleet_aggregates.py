@@ -0,0 +1,105 @@
+import heapq
+
+
+class FleetAggregates:
+    """
+    Aggregati della flotta aggiornati in modo incrementale a ogni messaggio:
+    conteggi per stato, istogramma della health, media/minimo e le K pompe
+    peggiori. Il minimo e le peggiori usano un min-heap con cancellazione
+    lazy (le voci superate restano nello heap e vengono scartate in lettura),
+    quindi l'aggiornamento costa O(log n) e la lettura O(K log K).
+    Non è thread-safe: viene aggiornato sotto il lock di FleetStateTable.
+    """
+
+    def __init__(self, bins=10, top_k=10):
+        self.bins = bins
+        self.top_k = top_k
+        self.state_counts = {}
+        self.histogram = [0] * bins
+        self.health_sum = 0.0
+        self.health_count = 0
+        # device_id -> (health, seq) della voce valida nello heap
+        self._current = {}
+        self._heap = []
+        self._seq = 0
+
+    def _bin(self, health):
+        return min(self.bins - 1, max(0, int(health * self.bins / 100)))
+
+    def update(self, device_id, previous, record):
+        if previous is not None:
+            self._remove(device_id, previous)
+        self._add(device_id, record)
+
+    def remove(self, device_id, record):
+        self._remove(device_id, record)
+
+    def _remove(self, device_id, record):
+        state = record.get("state", "UNKNOWN")
+        self.state_counts[state] -= 1
+        if not self.state_counts[state]:
+            del self.state_counts[state]
+
+        health = record.get("health_score")
+        if health is not None:
+            self.histogram[self._bin(health)] -= 1
+            self.health_sum -= health
+            self.health_count -= 1
+        self._current.pop(device_id, None)
+
+    def _add(self, device_id, record):
+        state = record.get("state", "UNKNOWN")
+        self.state_counts[state] = self.state_counts.get(state, 0) + 1
+
+        health = record.get("health_score")
+        if health is None:
+            return
+        health = float(health)
+        self.histogram[self._bin(health)] += 1
+        self.health_sum += health
+        self.health_count += 1
+
+        self._seq += 1
+        self._current[device_id] = (health, self._seq)
+        heapq.heappush(self._heap, (health, self._seq, device_id))
+
+        # Compattazione quando le voci superate dominano lo heap (costo ammortizzato O(1))
+        if len(self._heap) > 2 * len(self._current) + 64:
+            self._heap = [(h, s, d) for d, (h, s) in self._current.items()]
+            heapq.heapify(self._heap)
+
+    def _is_live(self, entry):
+        health, seq, device_id = entry
+        return self._current.get(device_id) == (health, seq)
+
+    def worst(self, k):
+        """Le k pompe con health più bassa: visita parziale dello heap in ordine"""
+        heap = self._heap
+        result = []
+        frontier = [(heap[0], 0)] if heap else []
+        while frontier and len(result) < k:
+            entry, i = heapq.heappop(frontier)
+            if self._is_live(entry):
+                result.append((entry[2], entry[0]))
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < len(heap):
+                    heapq.heappush(frontier, (heap[child], child))
+        return result
+
+    def summary(self, top_k=None):
+        k = self.top_k if top_k is None else top_k
+        worst = self.worst(max(k, 1))
+        width = 100 / self.bins
+        return {
+            "total": sum(self.state_counts.values()),
+            "states": dict(sorted(self.state_counts.items())),
+            "health": {
+                "mean": self.health_sum / self.health_count if self.health_count else None,
+                "min": worst[0][1] if worst else None,
+                "histogram": [
+                    {"from": round(i * width, 2), "to": round((i + 1) * width, 2), "count": count}
+                    for i, count in enumerate(self.histogram)
+                ],
+            },
+            "worst": [{"device_id": device_id, "health_score": health} for device_id, health in worst[:k]],
+        }
@@ -0,0 +1,97 @@
+import asyncio
+import threading
+import logging
+
+
+class FleetSubscription:
+    """
+    Coda di un singolo client: gli aggiornamenti sono coalescenti per device,
+    quindi un consumer lento riceve solo l'ultimo stato di ogni pompa e la
+    memoria resta limitata alla dimensione della flotta. Una rimozione è
+    registrata come None e sostituisce (o viene sostituita da) un aggiornamento.
+    """
+
+    def __init__(self, loop):
+        self._loop = loop
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._event = asyncio.Event()
+        self._signalled = False
+        self.coalesced = 0
+
+    def push(self, record: dict):
+        # Chiamato dal thread MQTT
+        self._push(record["device_id"], record)
+
+    def push_removal(self, device_id: str):
+        self._push(device_id, None)
+
+    def _push(self, device_id, record):
+        with self._lock:
+            if device_id in self._pending:
+                self.coalesced += 1
+            self._pending[device_id] = record
+            if self._signalled:
+                return
+            self._signalled = True
+        self._loop.call_soon_threadsafe(self._event.set)
+
+    async def next_batch(self, timeout: float):
+        """
+        Attende nuovi aggiornamenti: (record cambiati, device_id rimossi),
+        entrambi vuoti allo scadere del timeout (keep-alive)
+        """
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return [], []
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+            self._signalled = False
+            self._event.clear()
+        changed = [record for record in pending.values() if record is not None]
+        removed = [device_id for device_id, record in pending.items() if record is None]
+        return changed, removed
+
+
+class FleetBroadcaster:
+    """Distribuisce le variazioni della flotta ai client in streaming (SSE)"""
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self) -> FleetSubscription:
+        subscription = FleetSubscription(asyncio.get_running_loop())
+        with self._lock:
+            self._subscriptions.add(subscription)
+        self.logger.info(f"📺 Nuovo client stream ({len(self._subscriptions)} attivi)")
+        return subscription
+
+    def unsubscribe(self, subscription: FleetSubscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+        self.logger.info(f"📴 Client stream disconnesso ({len(self._subscriptions)} attivi)")
+
+    def publish(self, record: dict):
+        self._deliver(lambda subscription: subscription.push(record))
+
+    def publish_removal(self, device_id: str):
+        """Pompa uscita dalla flotta (scaduta): i client la eliminano dalla vista"""
+        self._deliver(lambda subscription: subscription.push_removal(device_id))
+
+    def _deliver(self, push):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            try:
+                push(subscription)
+            except RuntimeError:
+                # Event loop del client già chiuso
+                self.unsubscribe(subscription)
+
+    @property
+    def client_count(self):
+        return len(self._subscriptions)
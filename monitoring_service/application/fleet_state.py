@@ -0,0 +1,245 @@
+import json
+import heapq
+import base64
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from application.fleet_aggregates import FleetAggregates
+
+# Colonne tecniche aggiunte dal pivot Flux, non utili ai client
+INFLUX_TECHNICAL_COLUMNS = ("result", "table", "_start", "_stop", "_measurement")
+
+
+# Campi ammessi per l'ordinamento lato server
+SORTABLE_FIELDS = (
+    "device_id", "state", "health_score", "temperature",
+    "vibration_rms", "current", "pressure"
+)
+
+
+def encode_cursor(key) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    try:
+        return tuple(json.loads(base64.urlsafe_b64decode(cursor.encode())))
+    except (ValueError, TypeError):
+        raise ValueError("Cursor non valido")
+
+
+def validate_query(sort: str, cursor=None):
+    """Controlli dei parametri di query che non dipendono dai dati della flotta"""
+    if sort not in SORTABLE_FIELDS:
+        raise ValueError(f"Ordinamento non supportato: {sort} (ammessi: {SORTABLE_FIELDS})")
+    if cursor:
+        key = decode_cursor(cursor)
+        # Chiave di ordinamento: (valore mancante, valore, device_id)
+        if len(key) != 3 or not isinstance(key[0], bool) or not isinstance(key[2], str):
+            raise ValueError("Cursor non valido")
+        if sort == "device_id" and not isinstance(key[1], str):
+            raise ValueError("Cursor non valido per questo ordinamento")
+
+
+def record_from_payload(data: dict) -> dict:
+    """Converte una predizione MQTT nello stesso formato dei record letti da InfluxDB"""
+    return {
+        "_time": datetime.now(timezone.utc),
+        "device_id": data.get("device_id", "unknown"),
+        "state": data.get("state", "UNKNOWN"),
+        "health_score": float(data.get("health_percent", 0.0)),
+        "vibration_rms": float(data.get("vibration_rms", 0.0)),
+        "temperature": float(data.get("temperature", 0.0)),
+        "is_ai_prediction": bool(data.get("is_ai_prediction", False)),
+        "current": float(data.get("current", 0.0)),
+        "pressure": float(data.get("pressure", 0.0)),
+        "vibration_x": float(data.get("vibration_x", 0.0)),
+        "vibration_y": float(data.get("vibration_y", 0.0)),
+        "vibration_z": float(data.get("vibration_z", 0.0)),
+        "last_maintenance": data.get("last_maintenance"),
+    }
+
+
+def _timestamp(record: dict) -> float:
+    value = record.get("_time")
+    if isinstance(value, datetime):
+        return (value if value.tzinfo else value.replace(tzinfo=timezone.utc)).timestamp()
+    return datetime.now(timezone.utc).timestamp()
+
+
+class FleetStateTable:
+    """
+    Tabella in memoria dell'ultimo stato noto di ogni pompa, alimentata dallo
+    stream MQTT. Indici secondari per device_id e per stato; i record sono
+    immutabili (ogni aggiornamento sostituisce il dict) quindi le letture
+    possono restituirli senza copie.
+
+    Come la vecchia query range(start: -1h), le pompe senza aggiornamenti da
+    più di max_age secondi escono dalla tabella: la scadenza avviene alla
+    lettura, scorrendo i device in ordine di ultimo aggiornamento (costo
+    proporzionale ai soli record scaduti). on_expire(device_id) viene
+    chiamato per ogni pompa scaduta (sotto lock: non deve rientrare nella tabella).
+    """
+
+    def __init__(self, aggregates=None, max_age=3600, on_expire=None):
+        self._records = {}
+        self._by_state = {}
+        self.max_age = max_age
+        self.on_expire = on_expire
+        # device_id -> timestamp dell'ultimo record, dal più vecchio al più recente
+        self._updated = OrderedDict()
+        # Aggregati della flotta mantenuti a ogni aggiornamento
+        self.aggregates = aggregates or FleetAggregates()
+        self._lock = threading.Lock()
+        # Versione monotona della flotta: cambia a ogni aggiornamento (usata per gli ETag)
+        self.version = 0
+
+    def upsert(self, record: dict):
+        device_id = record["device_id"]
+        state = record.get("state", "UNKNOWN")
+        with self._lock:
+            self._put(device_id, state, record)
+            self._expire()
+
+    def load(self, records):
+        """Warm-up da InfluxDB: non sovrascrive i device già aggiornati dallo stream"""
+        loaded = 0
+        with self._lock:
+            for record in records:
+                device_id = record.get("device_id")
+                if not device_id or device_id in self._records:
+                    continue
+                clean = {k: v for k, v in record.items() if k not in INFLUX_TECHNICAL_COLUMNS}
+                self._put(device_id, clean.get("state", "UNKNOWN"), clean)
+                loaded += 1
+            if loaded:
+                # I record del warm-up possono essere più vecchi di quelli dello stream
+                self._updated = OrderedDict(sorted(self._updated.items(), key=lambda item: item[1]))
+        return loaded
+
+    def _put(self, device_id, state, record):
+        previous = self._records.get(device_id)
+        if previous is not None:
+            previous_state = previous.get("state", "UNKNOWN")
+            if previous_state != state:
+                bucket = self._by_state.get(previous_state)
+                if bucket is not None:
+                    bucket.discard(device_id)
+        self._records[device_id] = record
+        self._by_state.setdefault(state, set()).add(device_id)
+        self.aggregates.update(device_id, previous, record)
+        self._updated[device_id] = _timestamp(record)
+        self._updated.move_to_end(device_id)
+        self.version += 1
+
+    def _expire(self):
+        """Rimuove le pompe non aggiornate da più di max_age secondi (sotto lock)"""
+        if not self.max_age:
+            return
+        cutoff = datetime.now(timezone.utc).timestamp() - self.max_age
+        while self._updated:
+            device_id, updated = next(iter(self._updated.items()))
+            if updated >= cutoff:
+                break
+            del self._updated[device_id]
+            record = self._records.pop(device_id)
+            self._by_state.get(record.get("state", "UNKNOWN"), set()).discard(device_id)
+            self.aggregates.remove(device_id, record)
+            self.version += 1
+            if self.on_expire:
+                self.on_expire(device_id)
+
+    def current_version(self):
+        """Versione della flotta, dopo la scadenza dei record vecchi"""
+        with self._lock:
+            self._expire()
+            return self.version
+
+    def query(self, states=(), sort="device_id", descending=False, limit=None, cursor=None, fields=None):
+        """
+        Filtro per stato (indice secondario), ordinamento, paginazione a cursore
+        e proiezione dei campi. Con un limite viene usata una selezione parziale
+        (heap, O(n log k)) invece dell'ordinamento dell'intera flotta.
+        Ritorna (versione, totale filtrato, pagina, cursore successivo).
+        """
+        validate_query(sort, cursor)
+
+        # Chiave di ordinamento: i valori mancanti vanno sempre in fondo
+        if descending:
+            def sort_key(r):
+                v = r.get(sort)
+                return (v is not None, v if v is not None else 0, r["device_id"])
+        else:
+            def sort_key(r):
+                v = r.get(sort)
+                return (v is None, v if v is not None else 0, r["device_id"])
+        if sort == "device_id":
+            sort_key = lambda r: (False, r["device_id"], r["device_id"])
+
+        with self._lock:
+            self._expire()
+            version = self.version
+            if states:
+                device_ids = set()
+                for state in states:
+                    device_ids.update(self._by_state.get(state.upper(), ()))
+                candidates = [self._records[d] for d in device_ids]
+            else:
+                candidates = list(self._records.values())
+
+        total = len(candidates)
+        if cursor:
+            after = decode_cursor(cursor)
+            try:
+                if descending:
+                    candidates = [r for r in candidates if sort_key(r) < after]
+                else:
+                    candidates = [r for r in candidates if sort_key(r) > after]
+            except TypeError:
+                # Cursore generato con un ordinamento diverso
+                raise ValueError("Cursor non valido per questo ordinamento")
+
+        if limit is not None and limit < len(candidates):
+            select = heapq.nlargest if descending else heapq.nsmallest
+            page = select(limit, candidates, key=sort_key)
+            next_cursor = encode_cursor(sort_key(page[-1])) if page else None
+        else:
+            page = sorted(candidates, key=sort_key, reverse=descending)
+            next_cursor = None
+
+        if fields:
+            wanted = ["device_id"] + [f for f in fields if f != "device_id"]
+            page = [{f: r.get(f) for f in wanted} for r in page]
+
+        return version, total, page, next_cursor
+
+    def summary(self, top_k=None):
+        """(versione, aggregati della flotta) letti in modo consistente"""
+        with self._lock:
+            self._expire()
+            return self.version, self.aggregates.summary(top_k)
+
+    def get(self, device_id: str):
+        with self._lock:
+            self._expire()
+            return self._records.get(device_id)
+
+    def all(self):
+        return self.snapshot()[1]
+
+    def by_state(self, state: str):
+        return self.snapshot(state)[1]
+
+    def snapshot(self, *states):
+        """(versione, record) letti in modo consistente; senza stati ritorna tutta la flotta"""
+        with self._lock:
+            self._expire()
+            if not states:
+                return self.version, [self._records[d] for d in sorted(self._records)]
+            device_ids = set()
+            for state in states:
+                device_ids.update(self._by_state.get(state.upper(), ()))
+            return self.version, [self._records[d] for d in sorted(device_ids)]
+
+    def __len__(self):
+        return len(self._records)
@@ -0,0 +1,155 @@
+import time
+import logging
+import threading
+from datetime import datetime, timezone
+from data.data_manager import ROLLUP_TIERS
+
+ROLLUP_FIELDS = (
+    "health_score", "vibration_rms", "temperature", "current",
+    "pressure", "vibration_x", "vibration_y", "vibration_z"
+)
+
+
+class _Bucket:
+    __slots__ = ("start", "count", "mins", "maxs", "sums")
+
+    def __init__(self, start):
+        self.start = start
+        self.count = 0
+        self.mins = [float("inf")] * len(ROLLUP_FIELDS)
+        self.maxs = [float("-inf")] * len(ROLLUP_FIELDS)
+        self.sums = [0.0] * len(ROLLUP_FIELDS)
+
+    def add(self, values):
+        self.count += 1
+        for i, v in enumerate(values):
+            if v < self.mins[i]:
+                self.mins[i] = v
+            if v > self.maxs[i]:
+                self.maxs[i] = v
+            self.sums[i] += v
+
+    def stats(self):
+        result = {"samples": self.count}
+        for i, field in enumerate(ROLLUP_FIELDS):
+            result[f"{field}_min"] = self.mins[i]
+            result[f"{field}_mean"] = self.sums[i] / self.count
+            result[f"{field}_max"] = self.maxs[i]
+        return result
+
+
+class RollupManager:
+    """
+    Rollup continui di pump_diagnostics calcolati in modo incrementale dallo
+    stream MQTT: per ogni tier (1m, 1h), device e campo mantiene min/mean/max
+    del bucket corrente. Alla chiusura del bucket (primo messaggio del bucket
+    successivo, o sweep periodico per i device silenziosi) il punto aggregato
+    viene scritto nella measurement pump_diagnostics_<tier>.
+    All'avvio i bucket ancora aperti sono ricostruiti dai dati grezzi, così un
+    riavvio a metà ora non riscrive il punto 1h con i soli dati successivi.
+    """
+
+    def __init__(self, data_manager, tiers=ROLLUP_TIERS, sweep_interval=30, grace_seconds=10):
+        self.logger = logging.getLogger(__name__)
+        self.data_manager = data_manager
+        self.tiers = tiers
+        self.sweep_interval = sweep_interval
+        self.grace_seconds = grace_seconds
+        self._buckets = {name: {} for name, _ in tiers}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._seed()
+        self._thread = threading.Thread(target=self._sweep_loop, daemon=True)
+        self._thread.start()
+        self.logger.info(f"🧮 Rollup attivi: {', '.join(name for name, _ in self.tiers)}")
+
+    def stop(self):
+        self._stop_event.set()
+        self.flush()
+
+    def _seed(self):
+        now = time.time()
+        for name, seconds in self.tiers:
+            start = now - (now % seconds)
+            try:
+                records = self.data_manager.get_partial_rollups(datetime.fromtimestamp(start, tz=timezone.utc),
+                                                                ROLLUP_FIELDS)
+            except Exception as e:
+                self.logger.warning(f"⚠️ Could not rebuild open {name} rollups from raw data: {e}")
+                continue
+
+            buckets = {}
+            for r in records:
+                if r.get("_field") not in ROLLUP_FIELDS or not r.get("count"):
+                    continue
+                bucket = buckets.get(r["device_id"])
+                if bucket is None:
+                    bucket = buckets[r["device_id"]] = _Bucket(start)
+                i = ROLLUP_FIELDS.index(r["_field"])
+                bucket.count = max(bucket.count, int(r["count"]))
+                bucket.sums[i] = float(r["sum"])
+                bucket.mins[i] = float(r["min"])
+                bucket.maxs[i] = float(r["max"])
+
+            for bucket in buckets.values():
+                # Campi assenti: come in add() valgono 0.0
+                for i in range(len(ROLLUP_FIELDS)):
+                    if bucket.mins[i] == float("inf"):
+                        bucket.mins[i] = bucket.maxs[i] = 0.0
+            with self._lock:
+                self._buckets[name].update(buckets)
+            if buckets:
+                self.logger.info(f"🧮 Rebuilt {len(buckets)} open {name} rollups from raw data")
+
+    def add(self, record: dict):
+        ts = record["_time"].timestamp()
+        device_id = record["device_id"]
+        values = [float(record.get(field) or 0.0) for field in ROLLUP_FIELDS]
+        closed = []
+
+        with self._lock:
+            for name, seconds in self.tiers:
+                start = ts - (ts % seconds)
+                buckets = self._buckets[name]
+                bucket = buckets.get(device_id)
+                if bucket is None or bucket.start != start:
+                    if bucket is not None and bucket.count:
+                        closed.append((name, device_id, bucket))
+                    bucket = buckets[device_id] = _Bucket(start)
+                bucket.add(values)
+
+        for name, device_id, bucket in closed:
+            self._emit(name, device_id, bucket)
+
+    def flush(self, older_than=None):
+        """Chiude i bucket terminati prima di older_than (tutti se None)"""
+        closed = []
+        with self._lock:
+            for name, seconds in self.tiers:
+                buckets = self._buckets[name]
+                for device_id in list(buckets):
+                    bucket = buckets[device_id]
+                    if older_than is None or bucket.start + seconds <= older_than:
+                        closed.append((name, device_id, buckets.pop(device_id)))
+
+        for name, device_id, bucket in closed:
+            if bucket.count:
+                self._emit(name, device_id, bucket)
+
+    def _emit(self, tier, device_id, bucket):
+        try:
+            self.data_manager.save_rollup(
+                tier, device_id,
+                datetime.fromtimestamp(bucket.start, tz=timezone.utc),
+                bucket.stats()
+            )
+        except Exception as e:
+            self.logger.error(f"❌ Error writing {tier} rollup for {device_id}: {e}")
+
+    def _sweep_loop(self):
+        # Chiude i bucket dei device che hanno smesso di trasmettere
+        while not self._stop_event.wait(self.sweep_interval):
+            self.flush(older_than=time.time() - self.grace_seconds)
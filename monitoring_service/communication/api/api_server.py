@@ -1,7 +1,8 @@
 # api_server.py
 from fastapi import FastAPI
-from communication.api.routes import pumps
+from communication.api.routes import pumps, stream, fleet, health
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 
 def create_app(core_manager):
     app = FastAPI(title="Pump Monitoring API")
@@ -12,11 +13,18 @@ def create_app(core_manager):
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=["ETag"],
         )
+
+    # Compressione delle risposte grandi (snapshot della flotta)
+    app.add_middleware(GZipMiddleware, minimum_size=1024)
     
     # Injection del CoreManager per renderlo accessibile alle route
     app.state.core_manager = core_manager
     
     app.include_router(pumps.router, prefix="/api/v1")
+    app.include_router(stream.router, prefix="/api/v1")
+    app.include_router(fleet.router, prefix="/api/v1")
+    app.include_router(health.router, prefix="/api/v1")
     
     return app
\ No newline at end of file
@@ -0,0 +1,55 @@
+import json
+import uuid
+from datetime import datetime
+from fastapi import Request
+from fastapi.responses import Response
+
+# Risposte condizionali condivise dalle route: ETag sulla versione della flotta,
+# 304 con If-None-Match e cache del corpo serializzato
+
+# Ultimo corpo serializzato per (endpoint, parametri): se la flotta non è
+# cambiata la risposta viene riutilizzata senza serializzare di nuovo
+_rendered = {}
+_RENDERED_MAX_KEYS = 256
+
+# Epoca del processo: dopo un riavvio la versione riparte da zero, quindi
+# un ETag emesso prima del riavvio non deve mai coincidere con uno nuovo
+_BOOT_ID = uuid.uuid4().hex[:12]
+
+
+def json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def etag_headers(version):
+    # no-cache: il browser rivalida sempre con If-None-Match e riceve 304 se nulla è cambiato
+    return {"ETag": f'W/"{_BOOT_ID}-{version}"', "Cache-Control": "no-cache"}
+
+
+def not_modified(request: Request, version):
+    """Risposta 304 se il client ha già la versione corrente, altrimenti None"""
+    headers = etag_headers(version)
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or headers["ETag"] in [t.strip() for t in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+    return None
+
+
+def conditional_response(request: Request, cache_key, version, build):
+    cached_response = not_modified(request, version)
+    if cached_response is not None:
+        return cached_response
+    headers = etag_headers(version)
+
+    cached = _rendered.get(cache_key)
+    if cached and cached[0] == version:
+        body = cached[1]
+    else:
+        body = json.dumps(build(), default=json_default).encode()
+        if len(_rendered) >= _RENDERED_MAX_KEYS:
+            _rendered.clear()
+        _rendered[cache_key] = (version, body)
+
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -0,0 +1,13 @@
+from fastapi import APIRouter, Request, Query
+from communication.api.conditional import conditional_response
+
+router = APIRouter()
+
+
+@router.get("/fleet/summary")
+async def get_fleet_summary(request: Request, top: int = Query(10, ge=0, le=100)):
+    """Conteggi per stato, istogramma e statistiche di health, pompe peggiori (aggregati incrementali)"""
+    core_manager = request.app.state.core_manager
+    await core_manager.ensure_warm()
+    version, summary = core_manager.get_fleet_summary(top)
+    return conditional_response(request, ("fleet_summary", top), version, lambda: summary)
@@ -0,0 +1,13 @@
+from fastapi import APIRouter, Request
+
+router = APIRouter()
+
+
+@router.get("/health")
+async def get_health(request: Request):
+    """Messaggi elaborati e contatori di scrittura verso InfluxDB (coda, retry, scarti)"""
+    core_manager = request.app.state.core_manager
+    return {
+        "messages": core_manager.message_count,
+        "writes": core_manager.get_write_stats(),
+    }
@@ -1,24 +1,92 @@
+import re
+from datetime import datetime, timedelta, timezone
 from fastapi import APIRouter, Request, HTTPException, Query
 from typing import Optional
+from communication.api.conditional import conditional_response, not_modified
 
 router = APIRouter()
 
+
+def _columnar(pumps):
+    """Forma compatta: un array per campo invece di una lista di oggetti"""
+    columns = []
+    seen = set()
+    for pump in pumps:
+        for key in pump:
+            if key not in seen:
+                seen.add(key)
+                columns.append(key)
+    return {column: [pump.get(column) for pump in pumps] for column in columns}
+
+
+_RELATIVE_TIME = re.compile(r"^-(\d+)([smhdw])$")
+_UNIT_SECONDS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+def _parse_time(value: Optional[str], now: datetime) -> datetime:
+    """Accetta durate relative stile Flux (-30m, -24h, -7d) oppure timestamp ISO 8601"""
+    if not value or value == "now":
+        return now
+    match = _RELATIVE_TIME.match(value)
+    if match:
+        return now - timedelta(seconds=int(match.group(1)) * _UNIT_SECONDS[match.group(2)])
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Tempo non valido: {value}")
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _split(value: Optional[str]):
+    return tuple(v.strip() for v in value.split(",") if v.strip()) if value else ()
+
+
 @router.get("/status")
-async def get_pumps_status(request: Request, state: Optional[str] = Query(None)):
+async def get_pumps_status(request: Request,
+                           state: Optional[str] = Query(None, description="Uno o più stati separati da virgola"),
+                           sort: str = Query("device_id", description="Campo di ordinamento, prefisso '-' per decrescente"),
+                           limit: Optional[int] = Query(None, ge=1, le=5000),
+                           cursor: Optional[str] = Query(None),
+                           fields: Optional[str] = Query(None, description="Campi da restituire, separati da virgola"),
+                           format: str = Query("rows", pattern="^(rows|columnar)$")):
     core_manager = request.app.state.core_manager
-    
-    if state:
-        # Se viene passato ?state=FAULTY
-        data = core_manager.get_pumps_by_state(state)
+    await core_manager.ensure_warm()
+
+    # Parametri validati prima del 304: un cursore malformato è sempre un 400
+    try:
+        core_manager.validate_pump_query(sort.lstrip("-"), cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Flotta invariata: 304 senza filtrare, ordinare né serializzare
+    cached_response = not_modified(request, core_manager.get_fleet_version())
+    if cached_response is not None:
+        return cached_response
+
+    # Es: ?state=FAULTY,BROKEN&sort=health_score&limit=20&fields=device_id,health_score
+    states = tuple(s.upper() for s in _split(state))
+    descending = sort.startswith("-")
+    try:
+        version, total, data, next_cursor = core_manager.query_pumps(
+            states=states, sort=sort.lstrip("-"), descending=descending,
+            limit=limit, cursor=cursor, fields=_split(fields)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    page = {"count": len(data), "total": total, "next_cursor": next_cursor}
+    if format == "columnar":
+        build = lambda: {**page, "columns": _columnar(data)}
     else:
-        # Comportamento standard
-        data = core_manager.get_all_pumps_status()
-        
-    return {"count": len(data), "pumps": data}
+        build = lambda: {**page, "pumps": data}
+
+    cache_key = ("status", states, sort, limit, cursor, fields, format)
+    return conditional_response(request, cache_key, version, build)
 
 @router.get("/status/{device_id}")
 async def get_pump_detail(device_id: str, request: Request):
     core_manager = request.app.state.core_manager
+    await core_manager.ensure_warm()
     pump = core_manager.get_pump_details(device_id)
     
     if not pump:
@@ -29,6 +97,49 @@ async def get_pump_detail(device_id: str, request: Request):
 async def get_critical_pumps(request: Request):
     """Ritorna solo pompe in stato critico"""
     core_manager = request.app.state.core_manager
-    all_pumps = core_manager.get_all_pumps_status()
-    critical = [p for p in all_pumps if p.get("state") in ["WARNING", "FAULTY"]]
-    return {"critical_count": len(critical), "alerts": critical}
\ No newline at end of file
+    await core_manager.ensure_warm()
+    version, critical = core_manager.get_fleet_snapshot("WARNING", "FAULTY")
+    return conditional_response(
+        request, ("alerts",), version,
+        lambda: {"critical_count": len(critical), "alerts": critical}
+    )
+
+
+@router.get("/alerts/events")
+async def get_alert_events(request: Request,
+                           since: int = Query(0, ge=0),
+                           limit: int = Query(100, ge=1, le=1000)):
+    """Feed degli eventi di allarme (raised, escalated, cleared) successivi all'id `since`"""
+    core_manager = request.app.state.core_manager
+    last_id, events = core_manager.get_alert_events(since, limit)
+    return {
+        "last_id": last_id,
+        # Da usare come `since` alla richiesta successiva (riallinea anche dopo un riavvio)
+        "next_since": events[-1]["id"] if events else last_id,
+        "active": core_manager.get_active_alerts(),
+        "events": events,
+    }
+
+
+@router.get("/pumps/{device_id}/history")
+async def get_pump_history(device_id: str, request: Request,
+                           start: Optional[str] = Query("-24h"),
+                           stop: Optional[str] = Query(None),
+                           points: int = Query(500, ge=10, le=5000)):
+    """Trend di health, vibrazione e temperatura, mai oltre `points` punti"""
+    core_manager = request.app.state.core_manager
+    # Arrotondato al secondo: richieste concorrenti identiche condividono la stessa query
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    start_time = _parse_time(start, now)
+    stop_time = _parse_time(stop, now)
+    if start_time >= stop_time:
+        raise HTTPException(status_code=400, detail="start deve precedere stop")
+
+    history = await core_manager.get_pump_history(device_id, start_time, stop_time, points)
+    return {
+        "device_id": device_id,
+        "start": start_time,
+        "stop": stop_time,
+        "count": len(history["series"]["_time"]),
+        **history,
+    }
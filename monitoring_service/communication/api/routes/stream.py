@@ -0,0 +1,54 @@
+import json
+import asyncio
+from fastapi import APIRouter, Request, Query
+from fastapi.responses import StreamingResponse
+from communication.api.conditional import json_default
+
+router = APIRouter()
+
+
+def _sse(event: str, payload: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(payload, default=json_default)}\n\n"
+
+
+@router.get("/stream")
+async def stream_fleet(request: Request,
+                       min_interval: float = Query(0.5, ge=0.0, le=30.0),
+                       keepalive: float = Query(15.0, ge=1.0, le=60.0)):
+    """
+    Server-Sent Events: uno snapshot iniziale ("snapshot") seguito dalle sole
+    pompe cambiate ("pumps") e da quelle scadute ("removed"). Tra due invii
+    passano almeno min_interval secondi: nel frattempo gli aggiornamenti dello
+    stesso device vengono coalescenti.
+    """
+    core_manager = request.app.state.core_manager
+    broadcaster = core_manager.broadcaster
+
+    async def event_stream():
+        # Sottoscrizione prima dello snapshot: nessun aggiornamento va perso
+        subscription = broadcaster.subscribe()
+        try:
+            pumps = core_manager.get_all_pumps_status()
+            yield _sse("snapshot", {"count": len(pumps), "pumps": pumps})
+
+            while not await request.is_disconnected():
+                changed, removed = await subscription.next_batch(keepalive)
+                if removed:
+                    yield _sse("removed", {"count": len(removed), "device_ids": removed})
+                if changed:
+                    yield _sse("pumps", {"count": len(changed), "pumps": changed})
+                if changed or removed:
+                    if min_interval:
+                        await asyncio.sleep(min_interval)
+                else:
+                    # La scadenza avviene alla lettura: senza traffico la si verifica qui
+                    core_manager.get_fleet_version()
+                    yield ": keep-alive\n\n"
+        finally:
+            broadcaster.unsubscribe(subscription)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -1,14 +1,61 @@
-from influxdb_client import InfluxDBClient, Point
+from influxdb_client import InfluxDBClient, Point, BucketRetentionRules
 from influxdb_client.client.write_api import WriteOptions
-import random
-from datetime import datetime, timedelta
+import math
+import logging
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from data.downsampling import lttb
+from data.line_protocol_writer import LineProtocolWriter
+
+# Tier di rollup: nome, durata del bucket in secondi
+ROLLUP_TIERS = (("1m", 60), ("1h", 3600))
+
+# Campi esposti dall'endpoint di storico
+HISTORY_FIELDS = ("health_score", "vibration_rms", "temperature")
+
+# Fino a points * LTTB_MAX_FACTOR punti grezzi si scarica tutto e si applica LTTB
+# in-process (forma più fedele); oltre si aggrega lato InfluxDB con aggregateWindow
+LTTB_MAX_FACTOR = 20
+
+
+def _flux_string(value: str) -> str:
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def _flux_time(value: datetime) -> str:
+    return value.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def _bucket_start(value: datetime, seconds: int) -> datetime:
+    return datetime.fromtimestamp(value.timestamp() // seconds * seconds, tz=timezone.utc)
 
 class DataManager:
-    def __init__(self, url, token, org, bucket):
-        self.client = InfluxDBClient(url=url, token=token, org=org)
+    def __init__(self, url, token, org, bucket, query_workers=4, rollup_buckets=None, rollup_retention=None,
+                 write_options=None, rollups_enabled=True):
+        # Pool di connessioni dimensionato sul numero di query concorrenti
+        self.client = InfluxDBClient(url=url, token=token, org=org, connection_pool_maxsize=query_workers + 2)
         self.bucket = bucket
+        self.org = org
+
+        # Bucket dei rollup per tier (default: <bucket>_<tier>, con la propria retention).
+        # Con i rollup disattivati non si creano bucket e lo storico legge solo i dati grezzi
+        self.rollups_enabled = rollups_enabled
+        self.rollup_buckets = {name: f"{bucket}_{name}" for name, _ in ROLLUP_TIERS}
+        self.rollup_buckets.update({k: v for k, v in (rollup_buckets or {}).items() if v})
+        if rollups_enabled:
+            self._ensure_rollup_buckets(rollup_retention or {})
+
+        # Query API condivisa ed executor dedicato e limitato: le query sincrone
+        # non bloccano mai l'event loop di uvicorn
+        self.query_api = self.client.query_api()
+        self._query_executor = ThreadPoolExecutor(max_workers=query_workers, thread_name_prefix="influx-query")
+        self._inflight = {}
         
-        # Ottimizzazione InfluxDB: Invio a batch ogni 50 record o 5 secondi
+        # Predizioni: serializzazione diretta in line protocol e batch per record/byte
+        self.writer = LineProtocolWriter(self.client, bucket, **(write_options or {}))
+
+        # Rollup (basso volume): invio a batch ogni 50 record o 5 secondi
         self.write_api = self.client.write_api(write_options=WriteOptions(
             batch_size=50,
             flush_interval=5_000,
@@ -16,47 +63,15 @@ class DataManager:
             max_retries=3
         ))
 
-    def _generate_random_maintenance_date(self):
-        """Fallback: Genera una data casuale negli ultimi 180 giorni"""
-        days_ago = random.randint(1, 180)
-        date = datetime.now() - timedelta(days=days_ago)
-        return date.strftime("%Y-%m-%d")
-
     def save_prediction(self, data: dict):
-        """Converte il JSON ricevuto in un punto InfluxDB e lo salva"""
-        point = Point("pump_diagnostics") \
-            .tag("device_id", data.get("device_id", "unknown")) \
-            .field("state", data.get("state", "UNKNOWN")) \
-            .field("health_score", float(data.get("health_percent", 0.0))) \
-            .field("vibration_rms", float(data.get("vibration_rms", 0.0))) \
-            .field("temperature", float(data.get("temperature", 0.0))) \
-            .field("is_ai_prediction", bool(data.get("is_ai_prediction", False))) \
-            .field("current", float(data.get("current", 0.0))) \
-            .field("pressure", float(data.get("pressure", 0.0))) \
-            .field("vibration_x", float(data.get("vibration_x", 0.0))) \
-            .field("vibration_y", float(data.get("vibration_y", 0.0))) \
-            .field("vibration_z", float(data.get("vibration_z", 0.0)))
-        
-        # Gestione data manutenzione: usa quella del payload o ne genera una
-        last_maint = data.get("last_maintenance")
-        if not last_maint:
-            last_maint = self._generate_random_maintenance_date()
-            
-        point.field("last_maintenance", str(last_maint))
-            
-        self.write_api.write(bucket=self.bucket, record=point)
+        """Serializza il JSON ricevuto in line protocol e lo accoda per la scrittura bulk"""
+        self.writer.write_prediction(data)
+
+    def write_stats(self) -> dict:
+        return self.writer.stats()
     
-    def get_latest_pumps_data(self):
-        """Esegue query Flux per ottenere l'ultimo stato noto di ogni pompa"""
-        query_api = self.client.query_api()
-        query = f'''
-        from(bucket: "{self.bucket}")
-          |> range(start: -1h)
-          |> filter(fn: (r) => r["_measurement"] == "pump_diagnostics")
-          |> last()
-          |> pivot(rowKey:["device_id"], columnKey: ["_field"], valueColumn: "_value")
-        '''
-        tables = query_api.query(query)
+    def _query_records(self, query: str):
+        tables = self.query_api.query(query)
         
         results = []
         for table in tables:
@@ -64,6 +79,245 @@ class DataManager:
                 results.append(record.values)
         return results
 
+    async def query_async(self, query: str):
+        """
+        Esegue la query nell'executor dedicato. Query identiche concorrenti
+        vengono coalescenti (single-flight): una sola richiesta a InfluxDB,
+        il risultato è condiviso tra tutti i chiamanti e va trattato in sola lettura.
+        """
+        future = self._inflight.get(query)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self._query_executor, self._query_records, query)
+            self._inflight[query] = future
+            future.add_done_callback(lambda _: self._inflight.pop(query, None))
+        # shield: la cancellazione di un client non annulla la query degli altri
+        return await asyncio.shield(future)
+
+    def _latest_pumps_query(self):
+        return f'''
+        from(bucket: "{self.bucket}")
+          |> range(start: -1h)
+          |> filter(fn: (r) => r["_measurement"] == "pump_diagnostics")
+          |> last()
+          |> pivot(rowKey:["device_id"], columnKey: ["_field"], valueColumn: "_value")
+        '''
+
+    def _ensure_rollup_buckets(self, retention: dict):
+        """Crea i bucket dedicati ai rollup, ognuno con la propria retention, se mancanti"""
+        buckets_api = self.client.buckets_api()
+        for tier, name in self.rollup_buckets.items():
+            if name == self.bucket:
+                logging.getLogger(__name__).warning(
+                    f"⚠️ Rollup {tier} in the raw bucket {name}: its retention is not applied")
+                continue
+            try:
+                if buckets_api.find_bucket_by_name(name) is None:
+                    rules = []
+                    if retention.get(tier):
+                        rules.append(BucketRetentionRules(type="expire", every_seconds=int(retention[tier])))
+                    buckets_api.create_bucket(bucket_name=name, retention_rules=rules, org=self.org)
+            except Exception as e:
+                logging.getLogger(__name__).warning(f"⚠️ Could not verify rollup bucket {name}: {e}")
+
+    def save_rollup(self, tier: str, device_id: str, bucket_start: datetime, stats: dict):
+        point = Point(f"pump_diagnostics_{tier}").tag("device_id", device_id).time(bucket_start)
+        for field, value in stats.items():
+            point.field(field, value)
+        self.write_api.write(bucket=self.rollup_buckets[tier], record=point)
+
+    def get_partial_rollups(self, start: datetime, fields):
+        """
+        count/sum/min/max per device e campo dei dati grezzi da `start`: usati per
+        ricostruire i bucket di rollup aperti dopo un riavvio
+        """
+        field_filter = " or ".join(f'r["_field"] == "{f}"' for f in fields)
+        return self._query_records(f'''
+        from(bucket: "{self.bucket}")
+          |> range(start: {_flux_time(start)})
+          |> filter(fn: (r) => r["_measurement"] == "pump_diagnostics")
+          |> filter(fn: (r) => {field_filter})
+          |> group(columns: ["device_id", "_field"])
+          |> map(fn: (r) => ({{r with _value: float(v: r._value)}}))
+          |> reduce(
+              identity: {{count: 0, sum: 0.0, min: 1.0e308, max: -1.0e308}},
+              fn: (r, accumulator) => ({{
+                count: accumulator.count + 1,
+                sum: accumulator.sum + r._value,
+                min: if r._value < accumulator.min then r._value else accumulator.min,
+                max: if r._value > accumulator.max then r._value else accumulator.max
+              }})
+          )
+        ''')
+
+    def select_tier(self, start: datetime, stop: datetime, points: int):
+        """
+        Tier più grossolano che rispetta comunque la risoluzione richiesta
+        (durata del bucket <= range / points); None = dati grezzi.
+        """
+        if not self.rollups_enabled:
+            return None
+        window = (stop - start).total_seconds() / points
+        for name, seconds in sorted(ROLLUP_TIERS, key=lambda t: t[1], reverse=True):
+            if window >= seconds:
+                return name
+        return None
+
+    def get_latest_pumps_data(self):
+        """Esegue query Flux per ottenere l'ultimo stato noto di ogni pompa"""
+        return self._query_records(self._latest_pumps_query())
+
+    async def get_latest_pumps_data_async(self):
+        return await self.query_async(self._latest_pumps_query())
+
+    def _history_source(self, tier):
+        """(bucket, measurement, colonne sorgente) per i dati grezzi o per un tier di rollup"""
+        if tier is None:
+            return self.bucket, "pump_diagnostics", HISTORY_FIELDS
+        return self.rollup_buckets[tier], f"pump_diagnostics_{tier}", tuple(f"{f}_mean" for f in HISTORY_FIELDS)
+
+    def _history_query(self, device_id: str, start: datetime, stop: datetime, window_seconds=None, tier=None):
+        bucket, measurement, fields = self._history_source(tier)
+        aggregate = ""
+        if window_seconds:
+            aggregate = f"|> aggregateWindow(every: {window_seconds}s, fn: mean, createEmpty: false)"
+        field_filter = " or ".join(f'r["_field"] == "{f}"' for f in fields)
+        columns = ", ".join(f'"{c}"' for c in ("_time",) + fields)
+        return f'''
+        from(bucket: "{bucket}")
+          |> range(start: {_flux_time(start)}, stop: {_flux_time(stop)})
+          |> filter(fn: (r) => r["_measurement"] == "{measurement}" and r["device_id"] == {_flux_string(device_id)})
+          |> filter(fn: (r) => {field_filter})
+          {aggregate}
+          |> pivot(rowKey:["_time"], columnKey: ["_field"], valueColumn: "_value")
+          |> keep(columns: [{columns}])
+          |> sort(columns: ["_time"])
+        '''
+
+    def _history_count_query(self, device_id: str, start: datetime, stop: datetime, tier=None):
+        bucket, measurement, fields = self._history_source(tier)
+        return f'''
+        from(bucket: "{bucket}")
+          |> range(start: {_flux_time(start)}, stop: {_flux_time(stop)})
+          |> filter(fn: (r) => r["_measurement"] == "{measurement}" and r["device_id"] == {_flux_string(device_id)})
+          |> filter(fn: (r) => r["_field"] == "{fields[0]}")
+          |> count()
+        '''
+
+    def _history_first_query(self, device_id: str, start: datetime, stop: datetime, tier=None):
+        bucket, measurement, fields = self._history_source(tier)
+        return f'''
+        from(bucket: "{bucket}")
+          |> range(start: {_flux_time(start)}, stop: {_flux_time(stop)})
+          |> filter(fn: (r) => r["_measurement"] == "{measurement}" and r["device_id"] == {_flux_string(device_id)})
+          |> filter(fn: (r) => r["_field"] == "{fields[0]}")
+          |> first()
+        '''
+
+    async def _history_count(self, device_id: str, start: datetime, stop: datetime, tier=None):
+        counts = await self.query_async(self._history_count_query(device_id, start, stop, tier))
+        return sum(int(r.get("_value") or 0) for r in counts)
+
+    async def _history_segment(self, device_id: str, start: datetime, stop: datetime, points: int, count: int, tier):
+        """Serie di un intervallo da una sola sorgente: (metodo, finestra, righe normalizzate)"""
+        _, _, columns = self._history_source(tier)
+
+        window_seconds = None
+        if count <= points:
+            source = "raw"
+        elif count <= points * LTTB_MAX_FACTOR:
+            source = "lttb"
+        else:
+            source = "aggregate"
+            window_seconds = max(1, math.ceil((stop - start).total_seconds() / points))
+
+        rows = await self.query_async(self._history_query(device_id, start, stop, window_seconds, tier))
+
+        if len(rows) > points:
+            # LTTB guidato dalla health: stessi istanti selezionati per tutti i campi
+            xs = [r["_time"].timestamp() for r in rows]
+            ys = [float(r.get(columns[0]) or 0.0) for r in rows]
+            rows = [rows[i] for i in lttb(xs, ys, points)]
+
+        rows = [{"_time": r.get("_time"), **{f: r.get(c) for f, c in zip(HISTORY_FIELDS, columns)}} for r in rows]
+        return source, window_seconds, rows
+
+    async def get_pump_history_async(self, device_id: str, start: datetime, stop: datetime, points: int):
+        """
+        Storico di una pompa entro un budget di punti. La sorgente è il tier di
+        rollup più grossolano compatibile con la risoluzione richiesta (dati
+        grezzi se nessun tier è adatto o se il tier è vuoto). Le parti del range
+        non coperte dal tier vengono lette dai dati grezzi e unite alla serie:
+          - la testa, se il tier inizia dopo `start` (rollup attivati di recente
+            o retention più corta)
+          - la coda dal bucket ancora aperto, che viene scritto solo alla chiusura
+        Per ogni sorgente:
+          - raw:       pochi punti, restituiti così come sono
+          - lttb:      fino a points * LTTB_MAX_FACTOR punti, downsampling LTTB in-process
+          - aggregate: oltre, media per finestra con aggregateWindow lato InfluxDB
+        """
+        tier = self.select_tier(start, stop, points)
+        tier_start, tier_stop = start, stop
+        if tier is not None:
+            seconds = dict(ROLLUP_TIERS)[tier]
+            tier_stop = _bucket_start(min(stop, datetime.now(timezone.utc)), seconds)
+            if tier_stop <= start:
+                tier = None
+        if tier is not None:
+            count, first = await asyncio.gather(
+                self._history_count(device_id, start, tier_stop, tier),
+                self.query_async(self._history_first_query(device_id, start, tier_stop, tier))
+            )
+            if not count or not first:
+                # Rollup non ancora disponibili per questo range: si ripiega sui dati grezzi
+                tier = None
+            elif first[0]["_time"] - start > timedelta(seconds=seconds):
+                tier_start = first[0]["_time"]
+
+        if tier is None:
+            tier_start, tier_stop = start, stop
+            count = await self._history_count(device_id, start, stop)
+
+        # Budget di punti diviso in proporzione alla durata degli intervalli grezzi
+        total_seconds = (stop - start).total_seconds()
+        raw_ranges = [r for r in ((start, tier_start), (tier_stop, stop)) if r[1] > r[0]]
+        raw_counts = await asyncio.gather(*(self._history_count(device_id, a, b) for a, b in raw_ranges))
+        raw_parts = []
+        for (a, b), raw_count in zip(raw_ranges, raw_counts):
+            raw_points = max(1, round(points * (b - a).total_seconds() / total_seconds))
+            points = max(1, points - raw_points)
+            raw_parts.append((a, b, raw_points, raw_count))
+        raw_segments = await asyncio.gather(
+            *(self._history_segment(device_id, a, b, n, c, None) for a, b, n, c in raw_parts))
+
+        source, window_seconds, rows = await self._history_segment(device_id, tier_start, tier_stop, points, count, tier)
+        head = tail = None
+        for (a, _), segment in zip(raw_ranges, raw_segments):
+            if a == start:
+                head = segment[2]
+            else:
+                tail = segment[2]
+        rows = (head or []) + rows + (tail or [])
+
+        series = {"_time": [r["_time"] for r in rows]}
+        for field in HISTORY_FIELDS:
+            series[field] = [r[field] for r in rows]
+
+        return {
+            "source": source,
+            "tier": tier or "raw",
+            "raw_points": count + sum(raw_counts),
+            "window_seconds": window_seconds,
+            # Inizio della parte servita dal tier (None se nessuna testa dai dati grezzi)
+            "stitched_at": tier_start if head is not None else None,
+            # Inizio del bucket aperto letto dai dati grezzi (None se nessuna coda)
+            "open_bucket_from": tier_stop if tail is not None else None,
+            "series": series,
+        }
+
     def close(self):
+        self.writer.close()
+        self.write_api.close()
+        self._query_executor.shutdown(wait=False)
         if self.client:
             self.client.close()
\ No newline at end of file
@@ -0,0 +1,218 @@
+import math
+import time
+import random
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from influxdb_client import WritePrecision
+from influxdb_client.client.write_api import SYNCHRONOUS
+from influxdb_client.rest import ApiException
+
+# Campi numerici di pump_diagnostics: (campo InfluxDB, chiave nel payload)
+FLOAT_FIELDS = (
+    ("health_score", "health_percent"),
+    ("vibration_rms", "vibration_rms"),
+    ("temperature", "temperature"),
+    ("current", "current"),
+    ("pressure", "pressure"),
+    ("vibration_x", "vibration_x"),
+    ("vibration_y", "vibration_y"),
+    ("vibration_z", "vibration_z"),
+)
+
+# Template preallocato della riga: un solo format() per messaggio
+_LINE_TEMPLATE = (
+    "pump_diagnostics,device_id={} state={},"
+    + ",".join(f"{name}={{!r}}" for name, _ in FLOAT_FIELDS)
+    + ",is_ai_prediction={},last_maintenance={} {}"
+)
+
+_TAG_ESCAPES = str.maketrans({",": "\\,", " ": "\\ ", "=": "\\=", "\\": "\\\\"})
+
+
+def _escape_tag(value: str) -> str:
+    return value.translate(_TAG_ESCAPES)
+
+
+def _string_field(value: str) -> str:
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def encode_prediction(data: dict, last_maintenance: str, timestamp_ns: int) -> str:
+    """Serializza il payload di predizione direttamente in line protocol"""
+    values = [float(data.get(key, 0.0)) for _, key in FLOAT_FIELDS]
+    fields = [
+        _escape_tag(str(data.get("device_id", "unknown"))),
+        _string_field(str(data.get("state", "UNKNOWN"))),
+    ]
+    if all(map(math.isfinite, values)):
+        return _LINE_TEMPLATE.format(
+            *fields, *values,
+            "true" if data.get("is_ai_prediction", False) else "false",
+            _string_field(last_maintenance),
+            timestamp_ns
+        )
+
+    # NaN/inf non sono ammessi dal line protocol: si omettono quei campi
+    field_set = [f"state={fields[1]}"]
+    field_set.extend(f"{name}={value!r}" for (name, _), value in zip(FLOAT_FIELDS, values) if math.isfinite(value))
+    field_set.append(f"is_ai_prediction={'true' if data.get('is_ai_prediction', False) else 'false'}")
+    field_set.append(f"last_maintenance={_string_field(last_maintenance)}")
+    return f"pump_diagnostics,device_id={fields[0]} {','.join(field_set)} {timestamp_ns}"
+
+
+def _is_retryable(error: Exception) -> bool:
+    """Errori di trasporto, 5xx e 429 sono transitori; gli altri 4xx no (il batch verrebbe rifiutato di nuovo)"""
+    if isinstance(error, ApiException):
+        status = error.status or 0
+        return status == 0 or status == 429 or status >= 500
+    return True
+
+
+class LineProtocolWriter:
+    """
+    Scrittura bulk verso InfluxDB: le righe già serializzate vengono accodate
+    e inviate in batch quando si raggiunge il numero di record, la dimensione
+    in byte o l'intervallo di flush. Retry con backoff solo per gli errori
+    transitori (trasporto, 5xx, 429): un batch rifiutato con un altro 4xx non
+    viene reinviato e finisce nel contatore rejected. Coda limitata (i record
+    più vecchi vengono scartati) e contatori queued/flushed/retried/dropped/rejected.
+    """
+
+    def __init__(self, client, bucket, batch_records=500, batch_bytes=512 * 1024,
+                 flush_interval=1.0, max_retries=3, retry_interval=2.0,
+                 max_queue=50_000, stats_interval=60):
+        self.logger = logging.getLogger(__name__)
+        self.write_api = client.write_api(write_options=SYNCHRONOUS)
+        self.bucket = bucket
+        self.batch_records = batch_records
+        self.batch_bytes = batch_bytes
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_interval = retry_interval
+        self.max_queue = max_queue
+        self.stats_interval = stats_interval
+
+        self._lines = deque()
+        self._pending_bytes = 0
+        self._cond = threading.Condition()
+        self._closed = False
+
+        # Data di manutenzione di fallback, calcolata una sola volta per device
+        self._maintenance_dates = {}
+
+        self.queued = 0
+        self.flushed = 0
+        self.retried = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.batches = 0
+        self.bytes_written = 0
+
+        self._thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self._thread.start()
+
+    def _maintenance_date(self, device_id: str) -> str:
+        date = self._maintenance_dates.get(device_id)
+        if date is None:
+            days_ago = random.randint(1, 180)
+            date = (datetime.now() - timedelta(days=days_ago)).strftime("%Y-%m-%d")
+            self._maintenance_dates[device_id] = date
+        return date
+
+    def write_prediction(self, data: dict):
+        last_maint = data.get("last_maintenance")
+        if last_maint:
+            last_maint = str(last_maint)
+        else:
+            last_maint = self._maintenance_date(data.get("device_id", "unknown"))
+        self.write_line(encode_prediction(data, last_maint, time.time_ns()))
+
+    def write_line(self, line: str):
+        with self._cond:
+            if len(self._lines) >= self.max_queue:
+                self._pending_bytes -= len(self._lines.popleft()) + 1
+                self.dropped += 1
+            self._lines.append(line)
+            self._pending_bytes += len(line) + 1
+            self.queued += 1
+            if len(self._lines) >= self.batch_records or self._pending_bytes >= self.batch_bytes:
+                self._cond.notify()
+
+    def _take_batch(self):
+        batch = []
+        size = 0
+        while self._lines and len(batch) < self.batch_records and size < self.batch_bytes:
+            line = self._lines.popleft()
+            batch.append(line)
+            size += len(line) + 1
+        self._pending_bytes -= size
+        return batch, size
+
+    def _flush_loop(self):
+        last_stats = time.monotonic()
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.flush_interval
+                while (not self._closed
+                       and len(self._lines) < self.batch_records
+                       and self._pending_bytes < self.batch_bytes):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch, size = self._take_batch()
+                closing = self._closed and not self._lines
+
+            if batch:
+                self._send(batch, size)
+
+            if self.stats_interval and time.monotonic() - last_stats >= self.stats_interval:
+                last_stats = time.monotonic()
+                self.logger.info(f"📝 Influx writer: {self.stats()}")
+
+            if closing:
+                return
+
+    def _send(self, batch, size):
+        body = "\n".join(batch)
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.write_api.write(bucket=self.bucket, record=body, write_precision=WritePrecision.NS)
+                self.flushed += len(batch)
+                self.batches += 1
+                self.bytes_written += size
+                return
+            except Exception as e:
+                if not _is_retryable(e):
+                    self.rejected += len(batch)
+                    self.logger.error(f"❌ Batch of {len(batch)} records rejected by InfluxDB ({e.status}): {e.body}")
+                    return
+                if attempt == self.max_retries:
+                    self.dropped += len(batch)
+                    self.logger.error(f"❌ Dropped batch of {len(batch)} records after {attempt + 1} attempts: {e}")
+                    return
+                self.retried += 1
+                time.sleep(self.retry_interval * (2 ** attempt))
+
+    def stats(self) -> dict:
+        with self._cond:
+            pending = len(self._lines)
+        return {
+            "queued": self.queued,
+            "flushed": self.flushed,
+            "retried": self.retried,
+            "dropped": self.dropped,
+            "rejected": self.rejected,
+            "pending": pending,
+            "batches": self.batches,
+            "bytes_written": self.bytes_written,
+        }
+
+    def close(self, timeout=10):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout)
+        self.write_api.close()
@@ -4,6 +4,9 @@ import threading
 import uvicorn
 from communication.mqtt.mqtt_fetcher import MQTTFetcher
 from application.core_manager import CoreManager
+from application.fleet_state import FleetStateTable
+from application.rollup_manager import RollupManager
+from application.alert_engine import AlertEngine
 from data.data_manager import DataManager
 from communication.api.api_server import create_app  # Assicurati che il file si chiami così
 
@@ -23,11 +26,61 @@ def main():
     influx_token = os.getenv("INFLUX_TOKEN")
     influx_org = os.getenv("INFLUX_ORG")
     influx_bucket = os.getenv("INFLUX_BUCKET")
+    # Thread dedicati alle query InfluxDB delle API
+    query_workers = int(os.getenv("INFLUX_QUERY_WORKERS", 4))
+
+    # Scrittura bulk delle predizioni: batch per numero di record o byte
+    write_options = {
+        "batch_records": int(os.getenv("INFLUX_BATCH_RECORDS", 500)),
+        "batch_bytes": int(os.getenv("INFLUX_BATCH_BYTES", 512 * 1024)),
+        "flush_interval": float(os.getenv("INFLUX_FLUSH_INTERVAL_MS", 1000)) / 1000,
+        "max_retries": int(os.getenv("INFLUX_MAX_RETRIES", 3)),
+        "max_queue": int(os.getenv("INFLUX_WRITE_QUEUE", 50_000)),
+        "stats_interval": int(os.getenv("INFLUX_WRITE_STATS_INTERVAL", 60)),
+    }
+
+    # Allarmi: isteresi sulla health, permanenza minima e rate limiting per device
+    alert_engine = AlertEngine(
+        enter_health=float(os.getenv("ALERT_ENTER_HEALTH", 60)),
+        exit_health=float(os.getenv("ALERT_EXIT_HEALTH", 70)),
+        dwell_seconds=float(os.getenv("ALERT_DWELL_SECONDS", 30)),
+        min_interval=float(os.getenv("ALERT_MIN_INTERVAL", 60)),
+        max_events=int(os.getenv("ALERT_EVENTS_BUFFER", 1000)),
+        log_path=os.getenv("ALERT_LOG_PATH")
+    )
+
+    # Pompe senza aggiornamenti da più di questo intervallo escono da /status, /alerts e /fleet/summary
+    fleet_max_age = int(os.getenv("FLEET_STATE_MAX_AGE_SECONDS", 3600))
+
+    # Rollup 1m/1h: bucket dedicati (default: <INFLUX_BUCKET>_1m / _1h) con la propria retention
+    rollups_enabled = os.getenv("ROLLUPS_ENABLED", "true").lower() == "true"
+    rollup_buckets = {
+        "1m": os.getenv("INFLUX_ROLLUP_BUCKET_1M"),
+        "1h": os.getenv("INFLUX_ROLLUP_BUCKET_1H"),
+    }
+    rollup_retention = {
+        "1m": int(os.getenv("ROLLUP_1M_RETENTION_DAYS", 30)) * 86400,
+        "1h": int(os.getenv("ROLLUP_1H_RETENTION_DAYS", 365)) * 86400,
+    }
 
     try:
         # 2. Inizializzazione Layer
-        data_manager = DataManager(influx_url, influx_token, influx_org, influx_bucket)
-        core_manager = CoreManager(data_manager)
+        data_manager = DataManager(
+            influx_url, influx_token, influx_org, influx_bucket,
+            query_workers=query_workers,
+            rollup_buckets=rollup_buckets,
+            rollup_retention=rollup_retention,
+            write_options=write_options,
+            rollups_enabled=rollups_enabled
+        )
+        rollup_manager = None
+        if rollups_enabled:
+            rollup_manager = RollupManager(data_manager)
+            rollup_manager.start()
+        core_manager = CoreManager(data_manager, fleet_state=FleetStateTable(max_age=fleet_max_age),
+                                   rollup_manager=rollup_manager, alert_engine=alert_engine)
+        # Warm-up dello snapshot prima di ricevere lo stream
+        core_manager.warm_up()
         fetcher = MQTTFetcher(mqtt_broker, mqtt_port, mqtt_topic, core_manager)
 
         # 3. Start MQTT Fetcher in a BACKGROUND THREAD
@@ -50,6 +103,8 @@ def main():
         # Nota: uvicorn gestisce i segnali di stop (Ctrl+C), 
         # questo blocco verrà eseguito allo spegnimento
         logger.info("🛑 Shutting down service...")
+        if 'rollup_manager' in locals() and rollup_manager:
+            rollup_manager.stop()
         if 'data_manager' in locals():
             data_manager.close()
 